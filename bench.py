@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Benchmark every stage of the pipeline on synthetic wikis of several sizes
+(see corpus.py), reporting throughput in pages/s and links/s, peak
+memory, and regressions against a stored baseline.
+With --adversarial, time the extractors on pathological pages instead,
+each case with a time limit.
+
+    python bench.py [--scales 100,1000,10000] [--baseline FILE] [--save]
+    python bench.py --adversarial [N] [--limit SECONDS]
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from anytree import PreOrderIter
+
+from build_graph import build_namespace_tree, build_page_graph, \
+    rank_hits, rank_pagerank
+from classes import RE_EMBEDDEDMEDIA, RE_HEADING, RE_LINK, Wikipage, \
+    find_links, find_media
+from corpus import adversarial_pages, generate_corpus
+from media import MediaIndex
+from mediafiles import reconcile, scan_media
+
+BASELINE = "bench_baseline.json"
+# seconds an extractor may take for one adversarial page
+ADVERSARIAL_LIMIT = 1.0
+
+
+def _extract_regex(source: str) -> None:
+    RE_LINK.findall(source)
+    RE_EMBEDDEDMEDIA.findall(source)
+    RE_HEADING.findall(source)
+
+
+def _extract_scanner(source: str) -> None:
+    find_links(source)
+    find_media(source)
+    Wikipage.get_headings(source)
+
+
+EXTRACTORS = {'regex': _extract_regex, 'scanner': _extract_scanner}
+
+
+def _stages(datadir: str) -> List[tuple]:
+    """
+    The stages as (name, function) in pipeline order. Every function takes
+    and returns a dict of intermediate results, so later stages can use
+    the output of earlier ones.
+    """
+    pagesdir = os.path.join(datadir, "pages")
+    mediadir = os.path.join(datadir, "media")
+
+    def tree(state):
+        state['tree'] = build_namespace_tree(pagesdir)
+        state['pages'] = [p for ns in PreOrderIter(state['tree'])
+                          for p in ns.pages]
+
+    def populate(state):
+        pages = [Wikipage(name, path, pagesdir=pagesdir)
+                 for name, path in state['pages']]
+        for page in pages:
+            page.populate()
+        state['links'] = [link for page in pages for link, _ in page.links]
+
+    def parse_raw_link(state):
+        for link in state['links']:
+            Wikipage.parse_raw_link(link)
+
+    def page_graph(state):
+        state['graph'] = build_page_graph(state['tree'], pagesdir)
+
+    def pagerank(state):
+        rank_pagerank(state['graph'])
+
+    def hits(state):
+        rank_hits(state['graph'])
+
+    def media_index(state):
+        state['media_index'] = MediaIndex.from_tree(state['tree'], pagesdir)
+
+    def media_reconcile(state):
+        reconcile(scan_media(mediadir), state['media_index'])
+
+    return [("namespace_tree", tree), ("populate", populate),
+            ("parse_raw_link", parse_raw_link), ("page_graph", page_graph),
+            ("pagerank", pagerank), ("hits", hits),
+            ("media_index", media_index),
+            ("media_reconcile", media_reconcile)]
+
+
+def _measure(function: Callable, state: Dict, memory: bool) -> Dict:
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            function(state)
+    except ImportError as e:
+        # e.g. networkx needs scipy for pagerank and hits
+        return {'skipped': str(e)}
+    finally:
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': peak}
+
+
+def run_benchmarks(scales: List[int], workdir: str,
+                   memory: bool = True) -> Dict[str, Dict[str, Dict]]:
+    """
+    Generate a wiki for every scale in workdir and time all stages.
+    With memory, every stage is run a second time under tracemalloc
+    to record its peak memory without distorting the timings.
+    Returns {scale: {stage: {'seconds', 'pages_per_s', 'links_per_s',
+                             'peak_bytes'}}}
+    """
+    results = {}
+    for scale in scales:
+        datadir = os.path.join(workdir, str(scale))
+        if not os.path.exists(datadir):
+            generate_corpus(datadir, pages=scale)
+        results[str(scale)] = stage_results = {}
+        timing_state, memory_state = {}, {}
+        for name, function in _stages(datadir):
+            result = _measure(function, timing_state, memory=False)
+            if memory and 'skipped' not in result:
+                result['peak_bytes'] = _measure(
+                    function, memory_state, memory=True)['peak_bytes']
+            if 'seconds' in result:
+                pages = len(timing_state['pages'])
+                links = len(timing_state.get('links', []))
+                result['pages_per_s'] = pages / max(result['seconds'], 1e-9)
+                result['links_per_s'] = links / max(result['seconds'], 1e-9)
+            stage_results[name] = result
+    return results
+
+
+def regressions(results: Dict, baseline: Dict, tolerance: float = 0.25,
+                min_seconds: float = 0.01) -> List[str]:
+    """
+    Stages that got more than `tolerance` slower than in the baseline,
+    ignoring differences below min_seconds (timer noise).
+    """
+    found = []
+    for scale, stages in results.items():
+        for name, result in stages.items():
+            before = baseline.get(scale, {}).get(name, {}).get('seconds')
+            now = result.get('seconds')
+            if before is None or now is None:
+                continue
+            if now > before * (1 + tolerance) and now - before > min_seconds:
+                found.append("{} pages, {}: {:.3f}s -> {:.3f}s ({:+.0%})"
+                             .format(scale, name, before, now,
+                                     now / before - 1))
+    return found
+
+
+def _timed(extractor: str, source: str, queue: multiprocessing.Queue) -> None:
+    start = time.perf_counter()
+    EXTRACTORS[extractor](source)
+    queue.put(time.perf_counter() - start)
+
+
+def time_limited(extractor: str, source: str,
+                 limit: float) -> Optional[float]:
+    """
+    Seconds the extractor takes for source, or None if it took longer
+    than limit. It runs in a separate process, since a backtracking
+    regex can not be interrupted.
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_timed,
+                                      args=(extractor, source, queue))
+    process.start()
+    process.join(limit)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return None
+    return queue.get(timeout=limit)
+
+
+def run_adversarial(n: int = 10000, limit: float = ADVERSARIAL_LIMIT,
+                    extractors: List[str] = None
+                    ) -> Dict[str, Dict[str, Optional[float]]]:
+    """ {case: {extractor: seconds or None}} for corpus.adversarial_pages """
+    extractors = extractors or sorted(EXTRACTORS)
+    return {case: {e: time_limited(e, source, limit) for e in extractors}
+            for case, source in adversarial_pages(n).items()}
+
+
+def print_results(results: Dict) -> None:
+    print("{:>7} {:<16} {:>9} {:>11} {:>12} {:>10}".format(
+        "pages", "stage", "seconds", "pages/s", "links/s", "peak MB"))
+    for scale, stages in results.items():
+        for name, r in stages.items():
+            if 'skipped' in r:
+                print("{:>7} {:<16} skipped: {}".format(scale, name,
+                                                         r['skipped']))
+                continue
+            peak = r.get('peak_bytes')
+            print("{:>7} {:<16} {:>9.3f} {:>11.0f} {:>12.0f} {:>10}".format(
+                scale, name, r['seconds'], r['pages_per_s'],
+                r['links_per_s'],
+                "-" if peak is None else "{:.1f}".format(peak / 2**20)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", default="100,1000,10000")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true",
+                        help="store the results as new baseline")
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--workdir", help="keep generated wikis here")
+    parser.add_argument("--adversarial", type=int, nargs="?", const=10000)
+    parser.add_argument("--limit", type=float, default=ADVERSARIAL_LIMIT)
+    args = parser.parse_args()
+
+    if args.adversarial:
+        failed = False
+        for case, times in run_adversarial(args.adversarial,
+                                           args.limit).items():
+            print("{:<20} ".format(case) + "  ".join(
+                "{} {}".format(e, "TIMEOUT" if t is None else
+                               "{:.4f}s".format(t))
+                for e, t in times.items()))
+            failed = failed or times['scanner'] is None
+        sys.exit(1 if failed else 0)
+
+    scales = [int(s) for s in args.scales.split(",")]
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_benchmarks(scales, args.workdir or tmp,
+                                 memory=not args.no_memory)
+    print_results(results)
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            for line in regressions(results, json.load(f)):
+                print("REGRESSION " + line)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1)
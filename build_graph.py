@@ -8,7 +8,10 @@ from anytree.resolver import Resolver
 from anytree import RenderTree
 from typing import Dict, List, Tuple
 
-from classes import Namespace, Wikipage
+from classes import PAGE_BUDGET, ExtractionTimeout, LinkResolver, \
+    Namespace, Wikipage
+from media import MediaIndex
+from metrics import NULL, Metrics, NullMetrics, print_progress
 
 DATADIR = os.path.join(os.getcwd(), 'data')
 PAGESDIR = os.path.join(DATADIR, 'pages')
@@ -19,12 +22,19 @@ def is_template(filename: str) -> bool:
             filename.startswith('_') or filename.startswith('n_'))
 
 
-def build_namespace_tree(pagesdir: str, exclude_templates: bool = True) -> Namespace:
+def build_namespace_tree(pagesdir: str, exclude_templates: bool = True,
+                         metrics: NullMetrics = NULL) -> Namespace:
     """
     Walk the pagesdir and build a tree representing the structures of the wiki.
     The nodes are Namepspace objects, which contain a list of pages.
     Returns the root node of the tree, i.e. the root namespace.
     """
+    with metrics.timer('walk'):
+        return _walk(pagesdir, exclude_templates, metrics)
+
+
+def _walk(pagesdir: str, exclude_templates: bool,
+          metrics: NullMetrics) -> Namespace:
     r = Resolver('name')
     rootns = Namespace(name='pages', parent=None)
 
@@ -45,9 +55,10 @@ def build_namespace_tree(pagesdir: str, exclude_templates: bool = True) -> Names
             page_name = os.path.splitext(file)[0]
             page_file_path = os.path.join(relpath, file)
             if exclude_templates and is_template(page_name):
-                print("{} is template".format(page_name))
+                metrics.event("template", page_file_path)
             else:
                 basens.pages.append((page_name, page_file_path))
+        metrics.count('files', len(files))
 
     return rootns
 
@@ -67,26 +78,63 @@ def print_structure(treeroot):
                 print("{} {}".format(fill, page))
 
 
-def build_page_graph(tree_rootns: Namespace) -> nx.DiGraph:
+def build_page_graph(tree_rootns: Namespace,
+                     pagesdir: str = PAGESDIR,
+                     media_index: MediaIndex = None,
+                     metrics: NullMetrics = NULL,
+                     budget: float = PAGE_BUDGET) -> nx.DiGraph:
     """
     Walk the structure and build a directed graph of the pages of the wiki
     Pages are represented in the graph by their full, absolute wikipath
     e.g. :start or :infovault:bilder
-    Directed edges represent links from/to pages.   
+    Directed edges represent links from/to pages.
+    Links are resolved against the pages in the tree like dokuwiki does,
+    the edge attribute 'rule' records how (see classes.LinkResolver).
+    If a media_index is given, the embedded media of every page are
+    added to it in the same pass.
+    The time spent reading, extracting, resolving and inserting is
+    recorded in metrics, as well as the events of the parser.
+    Pages taking longer than budget seconds to parse are added without
+    their links, with the node attribute skipped=True and an
+    extraction_timeout event.
     """
 
     pagegraph = nx.DiGraph()
-
-    for namespace in PreOrderIter(tree_rootns):
-        for page_name, page_file_path in namespace.pages:
-            page = Wikipage(page_name, page_file_path,
-                            populate_immediately=True)
-            pagegraph.add_node(page.path, object=page)
-            # for link in page.internal_links:
-            #    pagegraph.add_edge(page.path, link)
-            # alternative?
-            pagegraph.add_edges_from([[page.path, link]
-                                      for link in page.internal_links])
+    resolver = LinkResolver.from_tree(tree_rootns)
+    total = sum(len(ns.pages) for ns in PreOrderIter(tree_rootns))
+    done = 0
+
+    with metrics.activate():
+        for namespace in PreOrderIter(tree_rootns):
+            for page_name, page_file_path in namespace.pages:
+                page = Wikipage(page_name, page_file_path, pagesdir=pagesdir)
+                with metrics.timer('read'):
+                    page.src = page.read_src()
+                with metrics.timer('extract'):
+                    try:
+                        page.parse(budget)
+                    except ExtractionTimeout:
+                        metrics.event('extraction_timeout', page.path)
+                with metrics.timer('resolve'):
+                    links = sorted(page.resolved_links(resolver))
+                with metrics.timer('insert'):
+                    pagegraph.add_node(page.path, object=page)
+                    if page.skipped:
+                        pagegraph.nodes[page.path]['skipped'] = True
+                    pagegraph.add_edges_from([(page.path, link, {'rule': rule})
+                                              for link, rule in links])
+                if media_index is not None:
+                    with metrics.timer('media'):
+                        media_index.add_page(page)
+                if metrics.enabled:
+                    metrics.count('pages')
+                    metrics.count('bytes', len(page.src.encode('UTF-8')))
+                    metrics.count('links', len(page.links))
+                    metrics.count('media', len(page.media))
+                    metrics.count('wanted', sum(
+                        rule == 'wanted' for _, rule in links))
+                done += 1
+                metrics.progress('pages', done, total)
 
     return pagegraph
 
@@ -112,11 +160,31 @@ def rank_hits(pagegraph: nx.DiGraph) -> Tuple[List, List]:
 
 
 if __name__ == "__main__":
-    rootns = build_namespace_tree(PAGESDIR)
-
-    G = build_page_graph(rootns)
-    pr = rank_pagerank(G)
-    h, a = rank_hits(G)
+    import sys
+
+    metrics = Metrics(progress=print_progress)
+    rootns = build_namespace_tree(PAGESDIR, metrics=metrics)
+
+    if "--use-meta" in sys.argv:
+        # links and media from dokuwiki's metadata where it is fresh
+        from dokuwiki_meta import build_page_graph_meta
+
+        with metrics.activate(), metrics.timer('meta'):
+            G, parsed = build_page_graph_meta(rootns)
+        print("{} of {} pages parsed, the others taken from metadata".format(
+            parsed, G.number_of_nodes()))
+    else:
+        G = build_page_graph(rootns, metrics=metrics)
+    with metrics.timer('pagerank'):
+        pr = rank_pagerank(G)
+    with metrics.timer('hits'):
+        h, a = rank_hits(G)
+    metrics.dump(os.path.join(DATADIR, 'metrics.json'))
+
+    skipped = [n for n, s in G.nodes(data='skipped') if s]
+    if skipped:
+        print("Skipped (took longer than {}s to parse) ->".format(PAGE_BUDGET))
+        print(skipped)
 
     # get links to page with
     print("Links to :start ->")
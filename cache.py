@@ -0,0 +1,136 @@
+import json
+import os
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple
+
+from anytree import PreOrderIter
+
+from classes import PAGE_BUDGET, PAGESDIR, Namespace, Wikipage
+from duplicates import signature
+from metrics import NULL, NullMetrics
+
+if TYPE_CHECKING:
+    from search import SearchIndex
+
+# entries of an older parser version are parsed again, raise it when
+# the parser extracts something new (2: plain {{gallery>ns}} embeds)
+PARSER_VERSION = 2
+
+
+class ParseCache:
+    """
+    Keeps the parsed links, media, headings and MinHash signature (see
+    duplicates.py) of every page, keyed by its wikipath, together with
+    the size and mtime of its file.
+    refresh() only re-reads pages whose file changed since the last run,
+    or that were skipped for taking too long to parse, so downstream
+    tools can update incrementally.
+    The cache is stored as a JSON file.
+    """
+
+    def __init__(self, filename: str, pagesdir: str = PAGESDIR):
+        self.filename = filename
+        self.pagesdir = pagesdir
+        self.entries = {}  # type: Dict[str, Dict]
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='UTF-8') as f:
+                self.entries = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.entries
+
+    def save(self) -> None:
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='UTF-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.filename)
+
+    def refresh(self, tree_rootns: Namespace,
+                metrics: NullMetrics = NULL,
+                search_index: 'SearchIndex' = None,
+                budget: float = PAGE_BUDGET) -> Tuple[List[str], List[str]]:
+        """
+        Bring the cache up to date with the pages in the tree.
+        Hits and misses are counted in metrics as cache_hits/cache_misses.
+        Pages taking longer than budget seconds to parse are cached without
+        links, media and headings, as skipped, with an extraction_timeout
+        event in metrics.
+        If a search_index is given, the pages read are indexed in the same
+        pass, as well as pages missing from the index. It is not saved.
+        Returns a tuple of (changed, removed) wikipaths, where changed
+        includes new pages.
+        """
+        changed = []
+        seen = set()
+        with metrics.activate():
+            for namespace in PreOrderIter(tree_rootns):
+                for page_name, page_file_path in namespace.pages:
+                    page = Wikipage(page_name, page_file_path,
+                                    pagesdir=self.pagesdir)
+                    seen.add(page.path)
+                    st = os.stat(os.path.join(self.pagesdir, page_file_path))
+                    entry = self.entries.get(page.path)
+                    if entry is not None \
+                            and entry['mtime'] == st.st_mtime_ns \
+                            and entry['size'] == st.st_size \
+                            and entry['file_path'] == page_file_path \
+                            and entry.get('parser') == PARSER_VERSION \
+                            and not entry.get('skipped') \
+                            and (search_index is None
+                                 or page.path in search_index):
+                        metrics.count('cache_hits')
+                        continue
+                    metrics.count('cache_misses')
+                    page.populate(budget)
+                    self.entries[page.path] = {
+                        'name': page.name,
+                        'file_path': page.file_path,
+                        'mtime': st.st_mtime_ns,
+                        'size': st.st_size,
+                        'links': sorted(page.links),
+                        'media': sorted(page.media),
+                        'headings': page.headings,
+                        'minhash': signature(page.src or ""),
+                        'parser': PARSER_VERSION,
+                        'skipped': page.skipped,
+                    }
+                    if search_index is not None:
+                        search_index.add_page(page)
+                    changed.append(page.path)
+        removed = sorted(set(self.entries) - seen)
+        for path in removed:
+            del self.entries[path]
+        if search_index is not None:
+            for path in set(search_index.ids) - seen:
+                search_index.remove(path)
+        return (changed, removed)
+
+    def page(self, path: str) -> Wikipage:
+        """
+        Returns the cached page as a Wikipage with links, media and
+        headings, but without source.
+        """
+        entry = self.entries[path]
+        page = Wikipage(entry['name'], entry['file_path'],
+                        pagesdir=self.pagesdir)
+        page.links = {tuple(link) for link in entry['links']}
+        page.media = set(entry['media'])
+        page.headings = [tuple(heading) for heading in entry['headings']]
+        page.skipped = entry.get('skipped', False)
+        return page
+
+    def pages(self) -> Iterator[Wikipage]:
+        for path in self.entries:
+            yield self.page(path)
+
+    def skipped(self) -> List[str]:
+        """ The pages that took longer than their budget to parse """
+        return sorted(path for path, entry in self.entries.items()
+                      if entry.get('skipped'))
+
+    def signatures(self) -> Dict[str, List[int]]:
+        """ The MinHash signatures of all pages with words """
+        return {path: entry['minhash'] for path, entry in self.entries.items()
+                if entry.get('minhash')}
@@ -1,11 +1,20 @@
 import os
 import re
-from typing import Set, Tuple
-from anytree import Node
+import time
+from typing import Iterable, List, Optional, Set, Tuple
+from urllib.parse import unquote
+from anytree import Node, PreOrderIter
+
+import metrics
+from pageids import clean_media_id, clean_page_id
 
 # TODO: this is defined in more than one place
 DATADIR = os.path.join(os.getcwd(), 'data')
 PAGESDIR = os.path.join(DATADIR, 'pages')
+MEDIADIR = os.path.join(DATADIR, 'media')
+FALLBACK_ENCODING = 'ISO-8859-1'
+# seconds a page may take to extract its links, media and headings
+PAGE_BUDGET = 2.0
 
 # REGEX
 # matches any links, except signatures
@@ -14,6 +23,147 @@ RE_LINK = re.compile(r'\[\[(?!.*\@ka-raceing\.de.*)(.*?)\]\]')
 # RE_EMBEDDEDMEDIA=re.compile(r'\{\{(.*?)\}\}')
 # matches any embedded media, only filename
 RE_EMBEDDEDMEDIA = re.compile(r'\{\{(.*?)[\||\?|}].*?\}\}')
+# matches headings, e.g. '====== Title ======' (level 1) to '== Title ==' (5)
+RE_HEADING = re.compile(r'^[ \t]*(={2,6})(.+?)={2,}[ \t]*$', re.MULTILINE)
+# leading dots of a relative link that are not followed by ':', e.g. '..ns'
+RE_LEADING_DOTS = re.compile(r'^(\.+)(?=[^:\.])')
+# links on a line before a signature are not matched by RE_LINK
+SIGNATURE = "@ka-raceing.de"
+# characters that end the media id in RE_EMBEDDEDMEDIA
+MEDIA_ID_END = "|?}"
+# media of the wiki itself, embedded by url
+MEDIA_URL = "https://wiki.ka-raceing.de/_media/"
+# a gallery embed, {{gallery>namespace?options|title}}
+GALLERY = "{{gallery>"
+
+
+class ExtractionTimeout(Exception):
+    """ Extracting the links of a page took longer than its budget """
+
+
+def _check_deadline(deadline: Optional[float]) -> None:
+    if deadline is not None and time.perf_counter() > deadline:
+        raise ExtractionTimeout()
+
+
+def find_links(source: str, deadline: float = None) -> List[str]:
+    """
+    Same as RE_LINK.findall(source), in linear time. The regex backtracks
+    quadratically on long lines with many unclosed '[['.
+    Neither can match across lines, so the source is scanned line by line
+    and ExtractionTimeout is raised once time.perf_counter() passes the
+    deadline.
+    """
+    found = []
+    for line in source.split("\n"):
+        _check_deadline(deadline)
+        # the lookahead rejects any '[[' followed by a signature
+        first = max(0, line.rfind(SIGNATURE) - 1)
+        pos = 0
+        while True:
+            start = line.find("[[", max(pos, first))
+            if start == -1:
+                break
+            end = line.find("]]", start + 2)
+            if end == -1:
+                break
+            found.append(line[start + 2:end])
+            pos = end + 2
+    return found
+
+
+def find_media(source: str, deadline: float = None) -> List[str]:
+    """
+    Same as RE_EMBEDDEDMEDIA.findall(source), in linear time. The regex
+    backtracks cubically on long lines with many '{{' and '|'.
+    Like the regex, the id ends at the first of MEDIA_ID_END that has a
+    '}}' after it, so '{{img.png}}' alone is not matched.
+    """
+    found = []
+    for line in source.split("\n"):
+        _check_deadline(deadline)
+        last_close = line.rfind("}}")
+        # next position of every character of MEDIA_ID_END, -1 if none
+        ends = [-2] * len(MEDIA_ID_END)
+        pos = 0
+        while True:
+            start = line.find("{{", pos)
+            if start == -1:
+                break
+            for i, char in enumerate(MEDIA_ID_END):
+                if ends[i] != -1 and ends[i] < start + 2:
+                    ends[i] = line.find(char, start + 2)
+            id_end = min((e for e in ends if e != -1), default=-1)
+            if id_end == -1 or id_end + 1 > last_close:
+                break
+            found.append(line[start + 2:id_end])
+            pos = line.find("}}", id_end + 1) + 2
+    return found
+
+
+def find_galleries(source: str, deadline: float = None) -> List[str]:
+    """
+    The namespaces of all {{gallery>ns}} embeds, with or without options
+    and title. find_media misses the plain form, like RE_EMBEDDEDMEDIA.
+    """
+    found = []
+    for line in source.split("\n"):
+        _check_deadline(deadline)
+        pos = 0
+        while True:
+            start = line.find(GALLERY, pos)
+            if start == -1:
+                break
+            end = line.find("}}", start + len(GALLERY))
+            if end == -1:
+                break
+            embed = line[start + len(GALLERY):end]
+            found.append(embed.split("?", 1)[0].split("|", 1)[0])
+            pos = end + 2
+    return found
+
+
+def find_headings(source: str,
+                  deadline: float = None) -> List[Tuple[str, str]]:
+    """
+    Same as RE_HEADING.findall(source), in linear time. The regex
+    backtracks quadratically on long runs of '='.
+    Unlike the regex, lines of nothing but '=' are not headings.
+    """
+    found = []
+    for line in source.split("\n"):
+        _check_deadline(deadline)
+        line = line.strip(" \t")
+        if not line.startswith("=="):
+            continue
+        text = line.rstrip("=")
+        if not text or len(line) - len(text) < 2:
+            continue
+        marks = min(6, len(line) - len(line.lstrip("=")))
+        found.append((line[:marks], text[marks:]))
+    return found
+
+
+def medialink_cleanup(inp: str) -> Optional[str]:
+    """
+    Cleans up dokuwiki media links, making the same changes dokuwiki
+    makes from link to file, e.g. replace umlauts.
+    Returns the media path without leading ':',
+    or None for galleries and external media.
+    """
+    media = inp.strip()
+    if "gallery>" in media:
+        metrics.event("gallery", media)
+    elif 'http' in media or 'www.' in media:
+        if media.startswith(MEDIA_URL):
+            # '/_media/a/b.jpg?w=50' and '/_media/a:b.jpg' are 'a:b.jpg'
+            media = unquote(media[len(MEDIA_URL):].split("?", 1)[0])
+            return clean_media_id(media.replace("/", ":"))
+        else:
+            metrics.event("external_media", media)
+    else:
+        return clean_media_id(media)
+    return None
 
 
 class Namespace(Node):
@@ -45,10 +195,14 @@ class Wikipage:
                  encoding="UTF-8",
                  # encoding="ISO-8859-1",
                  # encoding="1252",
-                 populate_immediately=False):
+                 populate_immediately=False,
+                 pagesdir=PAGESDIR):
         self.name = name
         self.file_path = file_path
         self.encoding = encoding
+        self.pagesdir = pagesdir
+        # parsing took longer than its budget, see parse
+        self.skipped = False
 
         if populate_immediately:
             self.populate()
@@ -56,17 +210,49 @@ class Wikipage:
             self.src = None
             self.links = set()
             self.media = set()
+            self.headings = []
 
     def read_src(self) -> str:
-        with open(os.path.join(PAGESDIR, self.file_path), 'r',
-                  encoding=self.encoding) as f:
-            source = f.read()
-        return source
+        filename = os.path.join(self.pagesdir, self.file_path)
+        try:
+            with open(filename, 'r', encoding=self.encoding) as f:
+                return f.read()
+        except UnicodeDecodeError:
+            # some old pages were saved as latin-1
+            metrics.event("encoding_fallback", self.file_path)
+            with open(filename, 'r', encoding=FALLBACK_ENCODING) as f:
+                return f.read()
 
-    def populate(self) -> None:
+    def populate(self, budget: float = PAGE_BUDGET) -> None:
+        """
+        Read and parse the page. If parsing takes longer than budget
+        seconds, the page is skipped (see parse) and an
+        extraction_timeout event is reported.
+        """
         self.src = self.read_src()
-        self.links = __class__.get_links(self.src)
-        self.media = __class__.get_media(self.src)
+        try:
+            self.parse(budget)
+        except ExtractionTimeout:
+            metrics.event("extraction_timeout", self.path)
+
+    def parse(self, budget: float = None) -> None:
+        """
+        Extract links, media and headings from the source.
+        Raises ExtractionTimeout if this takes longer than budget seconds,
+        the page then has no links, media and headings and is skipped.
+        """
+        deadline = None
+        if budget is not None:
+            deadline = time.perf_counter() + budget
+        try:
+            self.links = __class__.get_links(self.src, deadline)
+            self.media = __class__.get_media(self.src, deadline)
+            self.headings = __class__.get_headings(self.src, deadline)
+            self.skipped = False
+        except ExtractionTimeout:
+            self.links, self.media, self.headings = set(), set(), []
+            self.skipped = True
+            raise
 
     def __repr__(self):
         if self.src:
@@ -86,6 +272,12 @@ class Wikipage:
         pth, _ = os.path.splitext(self.file_path)
         return ":" + pth.replace("/", ":")
 
+    @property
+    def title(self) -> str:
+        if self.headings:
+            return self.headings[0][1]
+        return self.name
+
     @property
     def internal_links(self) -> Set:
         """
@@ -95,15 +287,22 @@ class Wikipage:
         internal = set()
         for raw_link, _ in self.links:
             link, typ = __class__.parse_raw_link(raw_link)
-            if typ == "relative":
-                if ".." in link:
-                    print("RELATIVE LINK WITH '..' : " + str(link))
-                abs_link = self.namespace + ":".join(link.split(":")[1:])
-                internal.add(abs_link)
-            if typ == "absolute":
-                internal.add(link)
+            if typ == "relative" or typ == "absolute":
+                internal.add(LinkResolver.absolute(link, self.namespace))
         return internal
 
+    def resolved_links(self, resolver: 'LinkResolver') -> Set[Tuple[str, str]]:
+        """
+        Get all internal wikilinks resolved against the existing pages,
+        as tuples of (absolute path, rule), see LinkResolver.resolve
+        """
+        resolved = set()
+        for raw_link, _ in self.links:
+            result = resolver.resolve(raw_link, self.namespace)
+            if result is not None:
+                resolved.add(result)
+        return resolved
+
     @property
     def external_links(self) -> Set:
         """
@@ -117,12 +316,13 @@ class Wikipage:
         return external
 
     @staticmethod
-    def get_links(source: str) -> Set[Tuple[str, str]]:
+    def get_links(source: str,
+                  deadline: float = None) -> Set[Tuple[str, str]]:
         """
         Parse links from source
         Returns set of tuples (link, title)
          """
-        srclinks = RE_LINK.findall(source)
+        srclinks = find_links(source, deadline)
         links = set()
 
         for match in srclinks:
@@ -135,12 +335,24 @@ class Wikipage:
         return links
 
     @staticmethod
-    def get_media(source: str) -> Set[str]:
+    def get_media(source: str, deadline: float = None) -> Set[str]:
         """
         Parse embedded media from source
-        Returns set of str: {'mediafile'
+        Returns set of str: {'mediafile', 'gallery>namespace'}
          """
-        return set(RE_EMBEDDEDMEDIA.findall(source))
+        return set(find_media(source, deadline)) | {
+            "gallery>" + namespace
+            for namespace in find_galleries(source, deadline)}
+
+    @staticmethod
+    def get_headings(source: str,
+                     deadline: float = None) -> List[Tuple[int, str]]:
+        """
+        Parse headings from source, in order of appearance
+        Returns list of tuples (level, text), level 1 is the top level
+         """
+        return [(7 - len(marks), text.strip())
+                for marks, text in find_headings(source, deadline)]
 
     @staticmethod
     def parse_raw_link(rawlink: str) -> str:
@@ -176,23 +388,13 @@ class Wikipage:
 
         if typ == "internal":
             # Process internal links
-            link = link.lower()
-            link = ":".join([piece.strip() for piece in link.split(":")])
-            link = link.replace("ä", "ae")
-            link = link.replace("ö", "oe")
-            link = link.replace("ü", "ue")
-            link = link.replace("ß", "ss")
-            link = link.replace("\"", "")
-            for s in ["&", "\"", "+", "'", " ", "__", "___"]:
-                link = link.replace(s, "_")
-            if not link.startswith("/"):
-                link = link.replace("/", "_")
+            link = clean_page_id(link)
             if link.endswith(".") or link.endswith("]"):
                 link = link[:-1]
 
             if "#" in link:
                 if link.count("#") > 1:
-                    print("MULTIPLE SECTION LINK: " + str(link))
+                    metrics.event("multiple_section_link", link)
                 else:
                     link = link.split("#")[0]
 
@@ -225,3 +427,86 @@ class Wikipage:
 
         assert not typ == "internal"
         return (link.strip(), typ)
+
+
+class LinkResolver:
+    """
+    Resolves internal links to pages the way dokuwiki does, see
+    https://www.dokuwiki.org/namespaces and https://www.dokuwiki.org/pagename
+    Links are checked against a hashed index of all existing page paths,
+    so every link takes a constant number of lookups.
+    The rule that matched is reported along with the target:
+        * page       -> the linked page exists
+        * start      -> namespace link, resolved to ns:start
+        * ns_page    -> namespace link, resolved to ns:ns
+        * ns_as_page -> namespace link, resolved to the page ns
+        * wanted     -> the target does not exist
+    """
+
+    def __init__(self, pages: Iterable[str], startpage: str = "start"):
+        self.pages = set(pages)
+        self.startpage = startpage
+
+    @classmethod
+    def from_tree(cls, tree_rootns: Namespace, **kwargs) -> 'LinkResolver':
+        """
+        Build the index from a tree returned by build_namespace_tree.
+        Only pages in the tree are known, so build the tree with
+        exclude_templates=False to resolve links to templates as well.
+        """
+        pages = []
+        for namespace in PreOrderIter(tree_rootns):
+            for _, page_file_path in namespace.pages:
+                pth, _ = os.path.splitext(page_file_path)
+                pages.append(":" + pth.replace("/", ":"))
+        return cls(pages, **kwargs)
+
+    @staticmethod
+    def absolute(link: str, namespace: str) -> str:
+        """
+        Turn a link as returned by Wikipage.parse_raw_link into an
+        absolute path, resolving '.' and '..' against the namespace
+        of the linking page, e.g. ':kit14:fahrwerk'.
+        """
+        if link.startswith("."):
+            # '..ns:page' is the same as '..:ns:page'
+            link = RE_LEADING_DOTS.sub(r"\1:", link)
+            link = namespace + ":" + link
+        pieces = []
+        for piece in link.split(":"):
+            if piece == "" or piece == ".":
+                continue
+            if piece == "..":
+                if pieces:
+                    pieces.pop()
+                continue
+            pieces.append(piece)
+        return ":" + ":".join(pieces)
+
+    def resolve(self, rawlink: str,
+                namespace: str) -> Optional[Tuple[str, str]]:
+        """
+        Resolve a raw link found on a page in the given namespace.
+        Returns a tuple of (absolute path, rule),
+        or None if the link is not an internal link.
+        """
+        link, typ = Wikipage.parse_raw_link(rawlink)
+        if typ != "relative" and typ != "absolute":
+            return None
+        target = self.absolute(link, namespace)
+
+        if not rawlink.split("#")[0].strip().endswith(":"):
+            return (target, "page" if target in self.pages else "wanted")
+
+        # namespace links, parse_raw_link added the start page
+        ns = target[:target.rfind(":")]
+        start = ns + ":" + self.startpage
+        if start in self.pages:
+            return (start, "start")
+        if ns:
+            ns_page = ns + ns[ns.rfind(":"):]
+            if ns_page in self.pages:
+                return (ns_page, "ns_page")
+            if ns in self.pages:
+                return (ns, "ns_as_page")
+        return (start, "wanted")
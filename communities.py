@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+import random
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+from compact import CompactGraph
+
+
+def namespace_of(path: str, depth: int = 1) -> str:
+    """
+    Returns the namespace of a wikipath, cut off after depth levels.
+    e.g. namespace_of(':kit14:fahrwerk:start') -> ':kit14'
+    Pages in the root namespace are in ':'.
+    """
+    pieces = path.split(":")[1:-1]
+    return ":" + ":".join(pieces[:depth])
+
+
+def label_propagation(graph: CompactGraph, max_iter: int = 20,
+                      seed: int = 0) -> List[int]:
+    """
+    Detect communities with asynchronous label propagation.
+    Links are treated as undirected. Every page starts in its own
+    community and repeatedly adopts the most frequent community among its
+    neighbours, until nothing changes or max_iter rounds have passed.
+    Each round is linear in the number of links.
+    Returns a list with the community label of every node.
+    """
+    reverse = graph.reverse()
+    labels = list(range(len(graph)))
+    order = list(range(len(graph)))
+    rng = random.Random(seed)
+
+    for _ in range(max_iter):
+        rng.shuffle(order)
+        changed = 0
+        for i in order:
+            counts = defaultdict(int)  # type: Dict[int, int]
+            for j in graph.successors(i):
+                if j != i:
+                    counts[labels[j]] += 1
+            for j in reverse.successors(i):
+                if j != i:
+                    counts[labels[j]] += 1
+            if not counts:
+                continue
+            best = max(counts.values())
+            # keep the current label on ties, so the process settles
+            if counts.get(labels[i]) == best:
+                continue
+            labels[i] = min(l for l, c in counts.items() if c == best)
+            changed += 1
+        if not changed:
+            break
+    return labels
+
+
+def communities(graph: CompactGraph, labels: List[int]) -> List[List[str]]:
+    """
+    Group the nodes by label.
+    Returns lists of wikipaths, largest community first.
+    """
+    groups = defaultdict(list)  # type: Dict[int, List[str]]
+    for i, label in enumerate(labels):
+        groups[label].append(graph.nodes[i])
+    return sorted((sorted(g) for g in groups.values()),
+                  key=len, reverse=True)
+
+
+def compare_with_namespaces(clusters: List[List[str]], depth: int = 1
+                            ) -> List[Tuple[str, float, int, List[str]]]:
+    """
+    Compare detected communities with the namespace hierarchy.
+    Returns a tuple for every community with
+    (dominant namespace, share of pages in it, size, other namespaces).
+    A share well below 1 means the community spans several namespaces.
+    """
+    report = []
+    for cluster in clusters:
+        counts = Counter(namespace_of(path, depth) for path in cluster)
+        dominant, count = counts.most_common(1)[0]
+        others = sorted(ns for ns in counts if ns != dominant)
+        report.append((dominant, count / len(cluster), len(cluster), others))
+    return report
+
+
+def misplaced_pages(graph: CompactGraph, depth: int = 1,
+                    threshold: float = 0.5, min_links: int = 3
+                    ) -> List[Tuple[str, str, float]]:
+    """
+    Find pages whose links mostly point into another namespace.
+    Only pages with at least min_links outgoing links to other pages
+    are considered.
+    Returns a list of (page, namespace most linked to, share of links),
+    highest share first.
+    """
+    namespaces = [namespace_of(path, depth) for path in graph.nodes]
+    misplaced = []
+    for i, path in enumerate(graph.nodes):
+        counts = Counter(namespaces[j] for j in graph.successors(i) if j != i)
+        total = sum(counts.values())
+        if total < min_links:
+            continue
+        target, count = counts.most_common(1)[0]
+        share = count / total
+        if target != namespaces[i] and share > threshold:
+            misplaced.append((path, target, share))
+    return sorted(misplaced, key=lambda m: (-m[2], m[0]))
+
+
+if __name__ == "__main__":
+    from build_graph import PAGESDIR, build_namespace_tree, build_page_graph
+
+    rootns = build_namespace_tree(PAGESDIR)
+    G = CompactGraph.from_digraph(build_page_graph(rootns))
+    clusters = communities(G, label_propagation(G))
+
+    print("Communities ->")
+    for ns, share, size, others in compare_with_namespaces(clusters):
+        if size > 1:
+            print("{:5d} pages, {:4.0%} in {} (also: {})".format(
+                size, share, ns, ", ".join(others[:5])))
+    print("Pages linking mostly into another namespace ->")
+    for path, ns, share in misplaced_pages(G):
+        print("{} -> {} ({:.0%})".format(path, ns, share))
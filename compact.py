@@ -0,0 +1,106 @@
+from array import array
+from typing import Iterable, List, Tuple
+
+import networkx as nx
+
+
+class CompactGraph:
+    """
+    A read-only, integer indexed copy of a page graph.
+    Nodes (wikipaths) are numbered 0..n-1 and edges are stored in
+    compressed sparse row form: the successors of node i are
+    targets[offsets[i]:offsets[i + 1]].
+    This uses a fraction of the memory of a networkx graph and makes
+    whole-graph passes (ranking, clustering) cheap.
+    """
+
+    def __init__(self, nodes: List[str], offsets: array, targets: array):
+        self.nodes = nodes
+        self.offsets = offsets
+        self.targets = targets
+        self.index = {node: i for i, node in enumerate(nodes)}
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __repr__(self):
+        return "CompactGraph({} nodes, {} edges)".format(len(self.nodes),
+                                                        len(self.targets))
+
+    @classmethod
+    def from_edges(cls, nodes: Iterable[str],
+                   edges: Iterable[Tuple[str, str]]) -> 'CompactGraph':
+        """
+        Build a compact graph from a node list and (source, target) pairs.
+        Targets that are not in nodes are added, like networkx does.
+        Duplicate edges and self loops are kept as given.
+        """
+        nodes = list(nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        adjacency = [[] for _ in nodes]  # type: List[List[int]]
+        for source, target in edges:
+            for node in (source, target):
+                if node not in index:
+                    index[node] = len(nodes)
+                    nodes.append(node)
+                    adjacency.append([])
+            adjacency[index[source]].append(index[target])
+        return cls._from_adjacency(nodes, adjacency)
+
+    @classmethod
+    def from_digraph(cls, pagegraph: nx.DiGraph) -> 'CompactGraph':
+        """
+        Build a compact graph from a page graph as returned by
+        build_graph.build_page_graph.
+        """
+        nodes = list(pagegraph)
+        index = {node: i for i, node in enumerate(nodes)}
+        adjacency = [[index[t] for t in pagegraph.successors(node)]
+                     for node in nodes]
+        return cls._from_adjacency(nodes, adjacency)
+
+    @classmethod
+    def _from_adjacency(cls, nodes: List[str],
+                        adjacency: List[List[int]]) -> 'CompactGraph':
+        offsets = array('l', [0])
+        targets = array('l')
+        for successors in adjacency:
+            targets.extend(successors)
+            offsets.append(len(targets))
+        return cls(nodes, offsets, targets)
+
+    def successors(self, i: int) -> array:
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+
+    def out_degree(self, i: int) -> int:
+        return self.offsets[i + 1] - self.offsets[i]
+
+    def reverse(self) -> 'CompactGraph':
+        """
+        Returns the graph with all edges reversed, i.e. the
+        successors of a node in the result are its predecessors here.
+        """
+        counts = [0] * (len(self.nodes) + 1)
+        for t in self.targets:
+            counts[t + 1] += 1
+        for i in range(len(self.nodes)):
+            counts[i + 1] += counts[i]
+        offsets = array('l', counts)
+        targets = array('l', bytes(offsets.itemsize * len(self.targets)))
+        fill = counts[:-1]
+        for source in range(len(self.nodes)):
+            for t in self.successors(source):
+                targets[fill[t]] = source
+                fill[t] += 1
+        return CompactGraph(self.nodes, offsets, targets)
+
+    def edges(self) -> Iterable[Tuple[str, str]]:
+        for source, node in enumerate(self.nodes):
+            for t in self.successors(source):
+                yield (node, self.nodes[t])
+
+    def to_digraph(self) -> nx.DiGraph:
+        pagegraph = nx.DiGraph()
+        pagegraph.add_nodes_from(self.nodes)
+        pagegraph.add_edges_from(self.edges())
+        return pagegraph
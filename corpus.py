@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Generate a synthetic, dokuwiki-like data directory for tests and
+benchmarks, since the real data/pages can not be shared.
+
+The same arguments always give the same wiki. Pages have headings,
+absolute, relative, '..' and namespace links (with umlauts and odd
+spelling), external links, signatures, code blocks, embedded media and
+galleries. A few templates are mixed in.
+
+    python corpus.py outdir [pages] [seed]
+"""
+
+import os
+import random
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+from pageids import fold_umlauts
+
+SYLLABLES = ["kit", "mo", "tor", "fahr", "werk", "rah", "men", "la",
+             "ger", "brem", "se", "räd", "er", "grö", "ße", "spon", "so",
+             "ren", "team", "ak", "ku", "elek", "tro", "nik"]
+
+
+def _word(rng: random.Random, n: int = 3) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, n)))
+
+
+def _namespaces(rng: random.Random, depth: int, fanout: int) -> List[str]:
+    """ Namespace paths like 'kit12/fahrwerk', including the root '' """
+    namespaces = [""]
+    level = [""]
+    for d in range(depth):
+        children = []
+        for parent in level:
+            # dokuwiki stores namespace directories without umlauts
+            names = {"kit{}".format(12 + i) for i in range(fanout)} \
+                if d == 0 else {fold_umlauts(_word(rng))
+                                for _ in range(fanout)}
+            for name in sorted(names):
+                children.append(os.path.join(parent, name).strip("/"))
+        namespaces.extend(children)
+        level = children
+    return namespaces
+
+
+def _link(rng: random.Random, target: str, source_ns: str) -> str:
+    """ A link to target (a page path like 'kit12/motor') from source_ns """
+    ns, page = os.path.split(target)
+    kind = rng.random()
+    if kind < 0.25 and ns == source_ns:
+        text = page
+    elif kind < 0.35 and ns == source_ns:
+        text = ".:" + page
+    elif kind < 0.45 and ns and os.path.dirname(source_ns) == \
+            os.path.dirname(ns) and source_ns:
+        text = "..:" + os.path.basename(ns) + ":" + page
+    elif kind < 0.5 and ns:
+        text = ns.replace("/", ":") + ":"
+    else:
+        text = ":" + target.replace("/", ":")
+    if rng.random() < 0.2:
+        # dokuwiki ignores case and turns spaces into underscores
+        text = text.upper() if rng.random() < 0.5 else text.replace("_", " ")
+    if rng.random() < 0.3:
+        text += "#" + _word(rng)
+    title = _word(rng, 4).capitalize() if rng.random() < 0.6 else ""
+    return "[[{}|{}]]".format(text, title) if title else "[[{}]]".format(text)
+
+
+def generate_corpus(datadir: str, pages: int = 1000, depth: int = 3,
+                    fanout: int = 4, links_per_page: int = 8,
+                    media_per_page: int = 2, wanted: float = 0.05,
+                    seed: int = 0) -> List[str]:
+    """
+    Write pages to datadir/pages and media files to datadir/media.
+    Returns the paths of the generated pages (without templates).
+    """
+    rng = random.Random(seed)
+    namespaces = _namespaces(rng, depth, fanout)
+    paths = []  # type: List[str]
+    # how links spell a page, with umlauts where the file name has none
+    spelled = {}  # type: Dict[str, str]
+    for i in range(pages):
+        if i < len(namespaces):
+            ns, word = namespaces[i], "start"
+        else:
+            ns, word = rng.choice(namespaces), _word(rng)
+        name = fold_umlauts(word)
+        if word != "start":
+            name, word = "{}_{}".format(name, i), "{}_{}".format(word, i)
+        paths.append(os.path.join(ns, name))
+        spelled[paths[-1]] = os.path.join(ns, word)
+    by_namespace = defaultdict(list)  # type: Dict[str, List[str]]
+    for path in paths:
+        by_namespace[os.path.dirname(path)].append(path)
+
+    media = ["infovault:bilder:{}:{}_{}.jpg".format(
+        2010 + rng.randrange(8), _word(rng), i)
+        for i in range(max(1, pages * media_per_page // 2))]
+    for m in media:
+        # links keep the umlauts, dokuwiki stores the file without them
+        filename = os.path.join(datadir, "media", *fold_umlauts(m).split(":"))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "wb") as f:
+            f.write(bytes(rng.randrange(256) for _ in range(rng.randint(
+                16, 512))))
+
+    for path in paths:
+        ns = os.path.dirname(path)
+        local = by_namespace[ns]
+        lines = ["====== {} ======".format(_word(rng, 4).capitalize()), ""]
+        for _ in range(rng.randint(0, 2 * links_per_page)):
+            if rng.random() < wanted:
+                target = os.path.join(ns, "neu_" + _word(rng))
+            else:
+                target = rng.choice(local if rng.random() < 0.6 else paths)
+            words = " ".join(_word(rng) for _ in range(rng.randint(3, 12)))
+            link = _link(rng, spelled.get(target, target), ns)
+            lines.append("{} {} {}".format(words, link, _word(rng)))
+            if rng.random() < 0.1:
+                lines.append("===== {} =====".format(_word(rng).title()))
+        for _ in range(rng.randint(0, 2 * media_per_page)):
+            lines.append("{{{{:{}?{}|{}}}}}".format(
+                rng.choice(media), rng.choice([100, 200, 400]), _word(rng)))
+        if rng.random() < 0.05:
+            lines.append("{{{{gallery>:{}?crop}}}}".format(
+                rng.choice(media).rsplit(":", 1)[0]))
+        if rng.random() < 0.2:
+            lines.append("[[https://www.{}.de/{}|{}]]".format(
+                _word(rng), _word(rng), _word(rng)))
+        if rng.random() < 0.2:
+            lines += ["<code>", "if (a[[0]] > b) {{ x }}", "</code>"]
+        if rng.random() < 0.3:
+            lines.append("--- //[[{}@ka-raceing.de|{}]] 2016/05/0{} 12:00//"
+                         .format(_word(rng), _word(rng).title(),
+                                 rng.randint(1, 9)))
+        _write(datadir, path, "\n".join(lines) + "\n")
+
+    for i in range(max(1, pages // 100)):
+        _write(datadir, os.path.join(rng.choice(namespaces),
+                                     "fr_vorlage_{}".format(i)),
+               "====== @PAGE@ ======\n[[start]]\n")
+    return [":" + p.replace("/", ":") for p in paths]
+
+
+def adversarial_pages(n: int = 10000) -> Dict[str, str]:
+    """
+    Pathological page sources for the extractors, each about n units
+    long: unclosed brackets, long lines full of separators, pasted CSV
+    tables and signatures at the end of long lines.
+    """
+    row = " | ".join("{}".format(i) for i in range(20))
+    return {
+        "unclosed_links": "[[" * n,
+        "unclosed_link_text": "[[" + "a" * 10 * n,
+        "unclosed_media": "{{" + "|" * 10 * n,
+        "media_separators": "{{|" * n,
+        "media_no_close": "{{a?b|c}" * n,
+        "signature_at_end": "[[a]] " * n + "--- //[[x@ka-raceing.de|X]]//",
+        "csv_table": "\n".join("| " + row + " |" for _ in range(n // 10)),
+        "csv_one_line": "^ " + " ^ ".join("h{}".format(i) for i in range(n)),
+        "long_line": ("text [[link|title]] {{:bild.jpg?200|x}} " * n),
+        "heading_marks": "==" + "= =" * n,
+        "heading_equals": "=" * n + "x",
+        "brackets": "[{]}|?" * n,
+    }
+
+
+def _write(datadir: str, path: str, source: str) -> None:
+    filename = os.path.join(datadir, "pages", path + ".txt")
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w", encoding="UTF-8") as f:
+        f.write(source)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    generate_corpus(sys.argv[1], n, seed=seed)
@@ -0,0 +1,179 @@
+"""
+Delete (or quarantine) files according to a plan, with a journal.
+
+The journal is a JSON lines file. Its first record holds the plan and is
+written before anything is touched, every following record lists a batch
+of files that has been handled, and a last record marks the run complete.
+An interrupted run is resumed by running it again with the same journal
+and plan, and a quarantined run can be restored. The journal of a
+complete run is kept until the next run, which archives it.
+"""
+
+import json
+import os
+import shutil
+import time
+from typing import Iterable, List, Optional, Set
+
+
+def make_plan(rootdir: str, keep: Iterable[str],
+              skip_dirs: Iterable[str] = ()) -> List[str]:
+    """
+    Returns the paths of all files below rootdir (relative to it)
+    that are not in keep, in sorted order.
+    Directories in skip_dirs (e.g. a quarantine) are not entered.
+    """
+    keep = {os.path.normpath(path) for path in keep}
+    skip_dirs = {os.path.abspath(path) for path in skip_dirs}
+    plan = []
+    for root, dirs, files in os.walk(rootdir):
+        dirs[:] = [d for d in dirs
+                   if os.path.abspath(os.path.join(root, d)) not in skip_dirs]
+        relpath = os.path.relpath(root, rootdir)
+        for file in files:
+            filepath = os.path.normpath(os.path.join(relpath, file))
+            if filepath not in keep:
+                plan.append(filepath)
+    return sorted(plan)
+
+
+def read_journal(journal: str) -> Optional[dict]:
+    """
+    Returns the header of the journal, with the handled files
+    in 'done', the restored files in 'restored' and whether the run
+    was completed in 'complete', or None if there is no journal.
+    """
+    if not os.path.exists(journal):
+        return None
+    with open(journal, 'r', encoding='UTF-8') as f:
+        header = json.loads(f.readline())
+        header['done'] = set()
+        header['restored'] = set()
+        header['complete'] = False
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last record of an interrupted run may be cut off
+                break
+            header['done'].update(record.get('done', []))
+            header['restored'].update(record.get('restored', []))
+            header['complete'] |= record.get('complete', False)
+    return header
+
+
+def _append(journal: str, record: dict) -> None:
+    with open(journal, 'a', encoding='UTF-8') as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _check_resume(header: dict, plan: List[str], rootdir: str,
+                  quarantine: Optional[str]) -> None:
+    """
+    Raises ValueError unless plan, rootdir and quarantine continue the
+    journaled run. The plan of a resumed run was made after some files
+    were handled, so it may lack those, but no others.
+    """
+    if header['rootdir'] != os.path.abspath(rootdir):
+        raise ValueError("the journal is for {}, not {}".format(
+            header['rootdir'], os.path.abspath(rootdir)))
+    if header['quarantine'] != (quarantine and os.path.abspath(quarantine)):
+        raise ValueError("the journaled run {}, run it again the same "
+                         "way".format("moves files to " + header['quarantine']
+                                      if header['quarantine'] else
+                                      "deletes files"))
+    journaled = set(header['plan'])
+    pending = {path for path in journaled - header['done']
+               if os.path.lexists(os.path.join(header['rootdir'], path))}
+    if not pending <= set(plan) <= journaled:
+        raise ValueError("the plan differs from the journaled one in {} "
+                         "files".format(len(set(plan) ^ pending)))
+
+
+def execute(plan: List[str], rootdir: str, journal: str,
+            quarantine: Optional[str] = None, batch_size: int = 500,
+            pause: float = 0.0, dry_run: bool = False) -> List[str]:
+    """
+    Remove the files in plan (paths relative to rootdir) in batches,
+    sleeping pause seconds after each batch.
+    If quarantine is given, files are moved there instead of deleted,
+    so the run can be undone with restore().
+    If the journal holds an interrupted run, it is resumed: files already
+    handled are skipped, and ValueError is raised if plan, rootdir or
+    quarantine differ from the journaled ones. The journal of a complete
+    run is renamed to journal.<time> and a new one is started.
+    With dry_run, nothing is written or removed.
+    Returns the files handled by this call.
+    """
+    header = read_journal(journal)
+    if header is not None and header['complete']:
+        if not dry_run:
+            os.rename(journal, journal + time.strftime(".%Y%m%d-%H%M%S"))
+        header = None
+    if header is None:
+        header = {'rootdir': os.path.abspath(rootdir), 'plan': plan,
+                  'quarantine': quarantine and os.path.abspath(quarantine),
+                  'done': set()}
+        if not dry_run:
+            _append(journal, {k: header[k]
+                              for k in ('rootdir', 'plan', 'quarantine')})
+    else:
+        _check_resume(header, plan, rootdir, quarantine)
+    todo = [path for path in header['plan'] if path not in header['done']]
+    if dry_run:
+        return todo
+
+    handled = []
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+        for path in batch:
+            _remove(header['rootdir'], path, header['quarantine'])
+        _append(journal, {'done': batch})
+        handled.extend(batch)
+        if pause:
+            time.sleep(pause)
+    _append(journal, {'complete': True})
+    return handled
+
+
+def _remove(rootdir: str, path: str, quarantine: Optional[str]) -> None:
+    source = os.path.join(rootdir, path)
+    if not os.path.lexists(source):
+        # handled by an interrupted run, before its batch was recorded
+        return
+    if quarantine is None:
+        os.unlink(source)
+    else:
+        target = os.path.join(quarantine, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(source, target)
+
+
+def restore(journal: str, batch_size: int = 500) -> List[str]:
+    """
+    Move the quarantined files of a journaled run back to where they were.
+    Returns the restored files.
+    """
+    header = read_journal(journal)
+    if header is None or header['quarantine'] is None:
+        raise ValueError("{} has no quarantine to restore from".format(
+            journal))
+    todo = sorted(header['done'] - header['restored'])
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+        for path in batch:
+            source = os.path.join(header['quarantine'], path)
+            if os.path.lexists(source):
+                target = os.path.join(header['rootdir'], path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(source, target)
+        _append(journal, {'restored': batch})
+    return todo
+
+
+def remaining(journal: str) -> Set[str]:
+    """ Files of the journaled plan that have not been handled yet """
+    header = read_journal(journal)
+    return set(header['plan']) - header['done']
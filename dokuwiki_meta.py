@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Read links and media from the metadata dokuwiki keeps itself,
+instead of parsing the page sources:
+
+data/meta/<ns>/<page>.meta   PHP serialized metadata per page, its
+                             ['current']['relation'] holds the pages
+                             ('references') and 'media' of the page
+data/index/page.idx          one page id per line
+data/index/relation_*_w.idx  values of the metadata index, one per line
+data/index/relation_*_i.idx  for every value, the ids of the pages
+
+    python dokuwiki_meta.py          cross-check regexes against metadata
+    python build_graph.py --use-meta build the graph from fresh metadata
+"""
+
+import os
+from collections import defaultdict
+from typing import Any, Dict, List, Set, Tuple
+
+import networkx as nx
+from anytree import PreOrderIter
+
+from classes import DATADIR, PAGE_BUDGET, PAGESDIR, LinkResolver, \
+    Namespace, Wikipage, medialink_cleanup
+from media import MediaIndex
+
+METADIR = os.path.join(DATADIR, 'meta')
+INDEXDIR = os.path.join(DATADIR, 'index')
+
+
+def php_unserialize(data: bytes) -> Any:
+    """
+    Parse the output of PHP's serialize().
+    Arrays and objects become dicts, strings are decoded as UTF-8.
+    """
+    value, pos = _unserialize(data, 0)
+    return value
+
+
+def _unserialize(data: bytes, pos: int) -> Tuple[Any, int]:
+    typ = data[pos:pos + 1]
+    if typ == b'N':
+        return (None, pos + 2)
+    if typ in (b'b', b'i', b'd'):
+        end = data.index(b';', pos)
+        raw = data[pos + 2:end]
+        if typ == b'b':
+            return (raw == b'1', end + 1)
+        if typ == b'i':
+            return (int(raw), end + 1)
+        return (float(raw.replace(b'INF', b'inf')), end + 1)
+    if typ == b's':
+        colon = data.index(b':', pos + 2)
+        start = colon + 2
+        end = start + int(data[pos + 2:colon])
+        return (data[start:end].decode('UTF-8', 'replace'), end + 2)
+    if typ == b'O':
+        # O:<len>:"<class>":<n>:{...}, continue as an array
+        colon = data.index(b':', pos + 2)
+        pos = colon + int(data[pos + 2:colon]) + 2
+        typ = b'a'
+    if typ == b'a':
+        colon = data.index(b':', pos + 2)
+        n = int(data[pos + 2:colon])
+        pos = colon + 2
+        result = {}
+        for _ in range(n):
+            key, pos = _unserialize(data, pos)
+            result[key], pos = _unserialize(data, pos)
+        return (result, pos + 1)
+    raise ValueError("cannot unserialize {!r} at {}".format(typ, pos))
+
+
+def meta_file(page_file_path: str, metadir: str = METADIR) -> str:
+    """ The .meta file belonging to a page file, e.g. kit14/start.txt """
+    return os.path.join(metadir, os.path.splitext(page_file_path)[0] + '.meta')
+
+
+def read_relations(filename: str) -> Tuple[Set[str], Set[str]]:
+    """
+    Returns the (pages, media) a .meta file lists as referenced by the page,
+    as absolute wikipaths and media ids without leading ':'.
+    """
+    with open(filename, 'rb') as f:
+        meta = php_unserialize(f.read())
+    relation = (meta.get('current') or {}).get('relation') or {}
+    references = relation.get('references') or {}
+    media = relation.get('media') or {}
+    # numeric ids like '2016' come back as int keys
+    return ({":" + str(page) for page in references},
+            {str(m).lstrip(":") for m in media})
+
+
+def is_fresh(page_file_path: str, pagesdir: str = PAGESDIR,
+             metadir: str = METADIR) -> bool:
+    """ Whether the .meta file was written after the page was last changed """
+    try:
+        meta_mtime = os.stat(meta_file(page_file_path, metadir)).st_mtime
+    except FileNotFoundError:
+        return False
+    return meta_mtime >= os.stat(
+        os.path.join(pagesdir, page_file_path)).st_mtime
+
+
+def build_page_graph_meta(tree_rootns: Namespace, pagesdir: str = PAGESDIR,
+                          metadir: str = METADIR,
+                          media_index: MediaIndex = None,
+                          budget: float = PAGE_BUDGET
+                          ) -> Tuple[nx.DiGraph, int]:
+    """
+    Like build_graph.build_page_graph, but take links and media from
+    dokuwiki's metadata where it is fresh, so those pages are not read.
+    Pages with stale or missing metadata are parsed as usual.
+    Edges from metadata have rule 'page' or 'wanted', since dokuwiki only
+    stores the resolved target. The page objects of those pages get the
+    targets as absolute links and the media from the metadata, but no
+    source and no headings; their nodes have the attribute meta=True.
+    Parsed pages taking longer than budget
+    seconds are added without links, with the node attribute skipped=True
+    and an extraction_timeout event.
+    Returns the graph and the number of pages that had to be parsed.
+    """
+    pagegraph = nx.DiGraph()
+    resolver = LinkResolver.from_tree(tree_rootns)
+    parsed = 0
+
+    for namespace in PreOrderIter(tree_rootns):
+        for page_name, page_file_path in namespace.pages:
+            page = Wikipage(page_name, page_file_path, pagesdir=pagesdir)
+            if is_fresh(page_file_path, pagesdir, metadir):
+                references, media = read_relations(
+                    meta_file(page_file_path, metadir))
+                page.links = {(target, "") for target in references}
+                page.media = media
+                links = [(target, "page" if target in resolver.pages
+                          else "wanted") for target in references]
+                if media_index is not None:
+                    for m in media:
+                        media_index.references[m].add(page.path)
+            else:
+                page.populate(budget)
+                parsed += 1
+                links = page.resolved_links(resolver)
+                if media_index is not None:
+                    media_index.add_page(page)
+            pagegraph.add_node(page.path, object=page)
+            if page.src is None:
+                pagegraph.nodes[page.path]['meta'] = True
+            if page.skipped:
+                pagegraph.nodes[page.path]['skipped'] = True
+            pagegraph.add_edges_from([(page.path, link, {'rule': rule})
+                                      for link, rule in sorted(links)])
+    return (pagegraph, parsed)
+
+
+def cross_check(tree_rootns: Namespace, pagesdir: str = PAGESDIR,
+                metadir: str = METADIR
+                ) -> List[Tuple[str, Set[str], Set[str], Set[str], Set[str]]]:
+    """
+    Compare the links and media our regexes extract with dokuwiki's
+    metadata, for all pages that have a .meta file and parse within
+    their budget.
+    Returns a tuple for every page where they disagree:
+    (path, links only we found, links only dokuwiki found,
+     media only we found, media only dokuwiki found)
+    """
+    resolver = LinkResolver.from_tree(tree_rootns)
+    disagreements = []
+    for namespace in PreOrderIter(tree_rootns):
+        for page_name, page_file_path in namespace.pages:
+            filename = meta_file(page_file_path, metadir)
+            if not os.path.exists(filename):
+                continue
+            page = Wikipage(page_name, page_file_path,
+                            populate_immediately=True, pagesdir=pagesdir)
+            if page.skipped:
+                continue
+            links = {link for link, _ in page.resolved_links(resolver)}
+            media = {medialink_cleanup(m) for m in page.media} - {None}
+            meta_links, meta_media = read_relations(filename)
+            if links != meta_links or media != meta_media:
+                disagreements.append((page.path, links - meta_links,
+                                      meta_links - links, media - meta_media,
+                                      meta_media - media))
+    return disagreements
+
+
+def _read_lines(filename: str) -> List[str]:
+    with open(filename, 'r', encoding='UTF-8') as f:
+        return f.read().split("\n")
+
+
+def read_page_index(indexdir: str = INDEXDIR) -> List[str]:
+    """ All pages dokuwiki knows, as absolute wikipaths """
+    return [":" + page for page in _read_lines(
+        os.path.join(indexdir, 'page.idx')) if page]
+
+
+def read_relation_index(name: str, indexdir: str = INDEXDIR
+                        ) -> Dict[str, Set[str]]:
+    """
+    Read a metadata index, e.g. 'relation_references' (backlinks) or
+    'relation_media'. Returns a dict from value (page or media id) to
+    the set of wikipaths of the pages referencing it.
+    """
+    pages = [":" + page for page in _read_lines(
+        os.path.join(indexdir, 'page.idx'))]
+    values = _read_lines(os.path.join(indexdir, name + '_w.idx'))
+    rows = _read_lines(os.path.join(indexdir, name + '_i.idx'))
+    index = defaultdict(set)  # type: Dict[str, Set[str]]
+    for value, row in zip(values, rows):
+        for entry in row.split(":"):
+            if entry:
+                index[value].add(pages[int(entry.split("*")[0])])
+    return index
+
+
+if __name__ == "__main__":
+    from build_graph import build_namespace_tree
+
+    rootns = build_namespace_tree(PAGESDIR)
+    for path, ours, theirs, our_media, their_media in cross_check(rootns):
+        print(path)
+        for label, items in (("  only regex:     ", ours),
+                             ("  only dokuwiki:  ", theirs),
+                             ("  media regex:    ", our_media),
+                             ("  media dokuwiki: ", their_media)):
+            if items:
+                print(label + ", ".join(sorted(items)))
@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Find near-duplicate pages, like the pages of one season copied to the
+next (kit12 -> kit13).
+
+Every page gets a MinHash signature of its word shingles when it is
+parsed (see ParseCache.refresh). The signatures are kept in the parse
+cache, so only changed pages are hashed again. Locality-sensitive
+hashing splits the signatures into BANDS bands; only pages agreeing in
+all rows of a band are compared, so pages are never compared pairwise.
+Pages at least THRESHOLD similar are clustered.
+
+    python duplicates.py wiki.sqlite [threshold]
+"""
+
+import hashlib
+import random
+import re
+import sqlite3
+from collections import defaultdict
+from typing import IO, Dict, List, Optional
+
+from search import tokenize
+
+# length of a signature, in BANDS bands of NUM_HASHES // BANDS rows:
+# pages 80% similar share a band with a probability of 99.9%, pages
+# 30% similar with 12%
+NUM_HASHES = 64
+BANDS = 16
+# words per shingle
+SHINGLE = 3
+THRESHOLD = 0.8
+# every hash function is the shingle hash XOR a random mask
+MASKS = [random.Random(i).getrandbits(64) for i in range(NUM_HASHES)]
+# 'kit12' and 'kit13' (or 2016 and 2017) count as the same word,
+# since copied pages mostly differ in those
+RE_DIGITS = re.compile(r'\d+')
+
+
+def shingles(text: str) -> List[str]:
+    """ Overlapping SHINGLE word sequences of text, without duplicates """
+    words = [RE_DIGITS.sub("0", word) for word in tokenize(text)]
+    if len(words) <= SHINGLE:
+        return [" ".join(words)] if words else []
+    return sorted({" ".join(words[i:i + SHINGLE])
+                   for i in range(len(words) - SHINGLE + 1)})
+
+
+def signature(text: str) -> Optional[List[int]]:
+    """ The MinHash signature of text, None if it has no words """
+    hashes = [int.from_bytes(hashlib.blake2b(
+        shingle.encode(), digest_size=8).digest(), 'little')
+        for shingle in shingles(text)]
+    if not hashes:
+        return None
+    # 32 bits keep the cache small, and rarely collide
+    return [min(map(mask.__xor__, hashes)) & 0xffffffff for mask in MASKS]
+
+
+def similarity(a: List[int], b: List[int]) -> float:
+    """ Estimated Jaccard similarity of the shingles of two pages """
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def clusters(signatures: Dict[str, List[int]],
+             threshold: float = THRESHOLD) -> List[List[str]]:
+    """
+    Groups of pages at least threshold similar to another page of the
+    group, largest first. Within a bucket, a page is only compared with
+    one page of every group found there, so copies of a template do not
+    make a bucket quadratic.
+    """
+    parent = {}  # type: Dict[str, str]
+
+    def find(path: str) -> str:
+        while parent.get(path, path) != path:
+            parent[path] = parent.get(parent[path], parent[path])
+            path = parent[path]
+        return path
+
+    rows = NUM_HASHES // BANDS
+    for band in range(BANDS):
+        buckets = defaultdict(list)  # type: Dict[tuple, List[str]]
+        for path in sorted(signatures):
+            buckets[tuple(signatures[path][band * rows:(band + 1) * rows])
+                    ].append(path)
+        for bucket in buckets.values():
+            leaders = bucket[:1]
+            for path in bucket[1:]:
+                for leader in leaders:
+                    if find(leader) == find(path):
+                        break
+                    if similarity(signatures[leader],
+                                  signatures[path]) >= threshold:
+                        parent[find(path)] = find(leader)
+                        break
+                else:
+                    leaders.append(path)
+    groups = defaultdict(list)  # type: Dict[str, List[str]]
+    for path in set(parent) | set(parent.values()):
+        groups[find(path)].append(path)
+    return sorted((sorted(group) for group in groups.values()),
+                  key=lambda group: (-len(group), group[0]))
+
+
+def print_clusters(groups: List[List[str]],
+                   signatures: Dict[str, List[int]],
+                   conn: sqlite3.Connection = None,
+                   rank: Dict[str, float] = None, f: IO[str] = None) -> None:
+    """
+    Every group with the similarity of its pages to the first one, and
+    with a snapshot (see store.py), the number of pages linking to them
+    and their rank, e.g. the pagerank, to tell the original from the copy
+    """
+    backlinks = {}  # type: Dict[str, int]
+    if conn is not None:
+        backlinks = dict(conn.execute(
+            "SELECT target, count(DISTINCT source) FROM links "
+            "WHERE source != target GROUP BY target"))
+    for group in groups:
+        print("{} pages ->".format(len(group)), file=f)
+        for path in group:
+            line = "  {:4.0%} {}".format(similarity(
+                signatures[group[0]], signatures[path]), path)
+            if conn is not None:
+                line += "  {} backlinks".format(backlinks.get(path, 0))
+            if rank:
+                line += "  rank {:.5f}".format(rank.get(path, 0))
+            print(line, file=f)
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    import store
+    from cache import ParseCache
+
+    dbfile = sys.argv[1] if len(sys.argv) > 1 else "wiki.sqlite"
+    cache = ParseCache(os.path.splitext(dbfile)[0] + ".cache.json")
+    signatures = cache.signatures()
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else THRESHOLD
+    print_clusters(clusters(signatures, threshold), signatures,
+                   store.connect(dbfile))
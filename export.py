@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Stream the extraction results to disk, one JSON record per page:
+    {"path", "namespace", "title", "links", "external", "media", "skipped"}
+and optionally a plain edge list ("source target" per line).
+Pages are read one at a time, so memory does not grow with the wiki.
+Pages taking too long to parse (see Wikipage.populate) are written
+without links and media, with "skipped": true.
+Files ending in .gz, .bz2 or .xz are compressed on the fly.
+
+    python export.py pages.jsonl.gz [edges.txt.gz]
+"""
+
+import bz2
+import gzip
+import json
+import lzma
+import sys
+from typing import IO, Iterator, Optional
+
+from anytree import PreOrderIter
+
+from build_graph import PAGESDIR, build_namespace_tree
+from classes import LinkResolver, Namespace, Wikipage, medialink_cleanup
+
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+
+def open_output(filename: str) -> IO[str]:
+    """ Open filename for writing text, compressed by its extension """
+    for extension, opener in OPENERS.items():
+        if filename.endswith(extension):
+            return opener(filename, 'wt', encoding='UTF-8')
+    return open(filename, 'w', encoding='UTF-8')
+
+
+def iter_pages(tree_rootns: Namespace,
+               pagesdir: str = PAGESDIR) -> Iterator[Wikipage]:
+    """ Yields the populated pages of the tree, one at a time """
+    for namespace in PreOrderIter(tree_rootns):
+        for page_name, page_file_path in namespace.pages:
+            yield Wikipage(page_name, page_file_path,
+                           populate_immediately=True, pagesdir=pagesdir)
+
+
+def page_record(page: Wikipage, resolver: LinkResolver) -> dict:
+    media = (medialink_cleanup(m) for m in page.media)
+    return {
+        'path': page.path,
+        'namespace': page.namespace,
+        'title': page.title,
+        'links': sorted(link for link, _ in page.resolved_links(resolver)),
+        'external': sorted(page.external_links),
+        'media': sorted(m for m in media if m is not None),
+        'skipped': page.skipped,
+    }
+
+
+def export(tree_rootns: Namespace, pages_file: IO[str],
+           edges_file: Optional[IO[str]] = None,
+           pagesdir: str = PAGESDIR, flush_every: int = 1000) -> int:
+    """
+    Write a record for every page to pages_file and, if given, its links
+    to edges_file. The files are flushed every flush_every pages.
+    Returns the number of pages written.
+    """
+    resolver = LinkResolver.from_tree(tree_rootns)
+    count = 0
+    for count, page in enumerate(iter_pages(tree_rootns, pagesdir), 1):
+        record = page_record(page, resolver)
+        pages_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if edges_file is not None:
+            for link in record['links']:
+                edges_file.write("{} {}\n".format(page.path, link))
+        if count % flush_every == 0:
+            pages_file.flush()
+            if edges_file is not None:
+                edges_file.flush()
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    rootns = build_namespace_tree(PAGESDIR)
+    with open_output(sys.argv[1]) as pages_file:
+        if len(sys.argv) > 2:
+            with open_output(sys.argv[2]) as edges_file:
+                n = export(rootns, pages_file, edges_file)
+        else:
+            n = export(rootns, pages_file)
+    print("exported {} pages".format(n))
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Build the page graph without holding the pages or a networkx graph in
+memory, for wiki archives that do not fit into RAM.
+
+Pages are parsed one at a time and their resolved links are collected
+in a buffer. Whenever the buffer exceeds the memory budget it is sorted
+and written to disk as a run. The runs are then merged (external merge
+sort) into a sorted edge list and a sorted reverse edge list, from which
+the compact graph and its reverse are written as flat binary arrays and
+memory mapped. Apart from the budget, only the index of page and node
+names is kept in memory.
+
+    python external.py workdir [budget in MB]
+"""
+
+import heapq
+import json
+import mmap
+import os
+import sys
+from array import array
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from anytree import PreOrderIter
+
+from build_graph import PAGESDIR, build_namespace_tree
+from classes import LinkResolver, Wikipage
+from compact import CompactGraph
+
+# rough per edge overhead of the tuple and strings in the buffer, in bytes
+EDGE_OVERHEAD = 200
+
+
+def _write_run(records: List[Tuple[str, str, str]], filename: str) -> None:
+    records.sort()
+    with open(filename, 'w', encoding='UTF-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def _read_run(filename: str) -> Iterator[Tuple[str, str, str]]:
+    with open(filename, 'r', encoding='UTF-8') as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+def spool_edges(tree_rootns, workdir: str, pagesdir: str = PAGESDIR,
+                budget: int = 64 * 2**20) -> Tuple[List[str], List[str]]:
+    """
+    Parse all pages and write their links as sorted runs to workdir,
+    each holding at most `budget` bytes worth of edges. Pages taking
+    too long to parse have no links, see Wikipage.populate.
+    Returns the file names of the forward runs, sorted by
+    (source, target, rule), and of the reverse runs, sorted by
+    (target, source, rule).
+    """
+    resolver = LinkResolver.from_tree(tree_rootns)
+    forward, reverse = [], []
+    buffer = []  # type: List[Tuple[str, str, str]]
+    used = 0
+
+    def flush():
+        n = len(forward)
+        forward.append(os.path.join(workdir, "run-{:05d}.fwd".format(n)))
+        _write_run(buffer, forward[-1])
+        reverse.append(os.path.join(workdir, "run-{:05d}.rev".format(n)))
+        _write_run([(t, s, r) for s, t, r in buffer], reverse[-1])
+        buffer.clear()
+
+    for namespace in PreOrderIter(tree_rootns):
+        for page_name, page_file_path in namespace.pages:
+            page = Wikipage(page_name, page_file_path,
+                            populate_immediately=True, pagesdir=pagesdir)
+            for link, rule in page.resolved_links(resolver):
+                buffer.append((page.path, link, rule))
+                used += len(page.path) + len(link) + EDGE_OVERHEAD
+            if used > budget:
+                flush()
+                used = 0
+    if buffer or not forward:
+        flush()
+    return (forward, reverse)
+
+
+def merge_runs(runs: List[str]) -> Iterator[Tuple[str, str, str]]:
+    """
+    Merge sorted runs into one sorted stream without duplicate
+    (first, second) pairs. Like networkx, the last rule of a pair wins.
+    """
+    merged = heapq.merge(*[_read_run(run) for run in runs])
+    for _, group in groupby(merged, key=lambda record: record[:2]):
+        *_, last = group
+        yield last
+
+
+def _write_csr(records: Iterable[Tuple[str, str, str]],
+               index: Dict[str, int], prefix: str) -> None:
+    """ Write offsets and targets of a sorted edge stream """
+    offsets = array('l', [0])
+    with open(prefix + ".targets", 'wb') as f:
+        chunk = array('l')
+        count = 0
+        for first, second, _ in records:
+            i = index[first]
+            while len(offsets) <= i:
+                offsets.append(count)
+            chunk.append(index[second])
+            count += 1
+            if len(chunk) >= 65536:
+                chunk.tofile(f)
+                chunk = array('l')
+        chunk.tofile(f)
+    while len(offsets) <= len(index):
+        offsets.append(count)
+    with open(prefix + ".offsets", 'wb') as f:
+        offsets.tofile(f)
+
+
+def _map_array(filename: str):
+    if os.path.getsize(filename) == 0:
+        return array('l')
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast('l')
+
+
+def load_compact(workdir: str, name: str = "graph") -> CompactGraph:
+    """ Load a compact graph written by build_external, memory mapped """
+    with open(os.path.join(workdir, "nodes.txt"), 'r', encoding='UTF-8') as f:
+        nodes = f.read().split("\n")[:-1]
+    prefix = os.path.join(workdir, name)
+    return CompactGraph(nodes, _map_array(prefix + ".offsets"),
+                        _map_array(prefix + ".targets"))
+
+
+def iter_edges(workdir: str) -> Iterator[Tuple[str, str, str]]:
+    """ Yields the (source, target, rule) edges of a finished build """
+    return _read_run(os.path.join(workdir, "edges.jsonl"))
+
+
+def build_external(pagesdir: str, workdir: str,
+                   budget: int = 64 * 2**20) -> Tuple[CompactGraph,
+                                                      CompactGraph]:
+    """
+    Build the page graph of pagesdir in workdir with peak memory for edges
+    bounded by `budget` bytes. The result has the same nodes and edges as
+    build_graph.build_page_graph.
+    Returns the compact graph and its reverse (the backlink index),
+    both memory mapped from workdir.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    tree_rootns = build_namespace_tree(pagesdir)
+    forward, reverse = spool_edges(tree_rootns, workdir, pagesdir, budget)
+
+    # nodes are all pages plus all link targets, in sorted order
+    pages = sorted(LinkResolver.from_tree(tree_rootns).pages)
+    targets = (target for target, _ in groupby(
+        record[0] for record in merge_runs(reverse)))
+    nodes = [node for node, _ in groupby(heapq.merge(pages, targets))]
+    with open(os.path.join(workdir, "nodes.txt"), 'w', encoding='UTF-8') as f:
+        for node in nodes:
+            f.write(node + "\n")
+    index = {node: i for i, node in enumerate(nodes)}
+    del nodes, pages
+
+    with open(os.path.join(workdir, "edges.jsonl"), 'w',
+              encoding='UTF-8') as f:
+        for record in merge_runs(forward):
+            f.write(json.dumps(record) + "\n")
+    _write_csr(iter_edges(workdir), index, os.path.join(workdir, "graph"))
+    _write_csr(merge_runs(reverse), index, os.path.join(workdir, "reverse"))
+    del index
+
+    for run in forward + reverse:
+        os.remove(run)
+    return (load_compact(workdir, "graph"), load_compact(workdir, "reverse"))
+
+
+if __name__ == "__main__":
+    workdir = sys.argv[1] if len(sys.argv) > 1 else "graph"
+    budget = int(sys.argv[2]) * 2**20 if len(sys.argv) > 2 else 64 * 2**20
+    G, R = build_external(PAGESDIR, workdir, budget)
+    print(G)
@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+The history of the wiki, from the files dokuwiki keeps for it:
+
+data/meta/<ns>/<page>.changes        changelog of the page, one line per
+                                     revision: date, ip, type, id, user,
+                                     summary, extra, size change
+data/attic/<ns>/<page>.<date>.txt.gz the page as of that revision
+
+The changelogs are read line by line and give the edit activity of every
+page. The revisions of every page are decompressed one after another in
+a worker process, and only the links that changed from one revision to
+the next are kept, so a worker never holds more than one revision. The
+link deltas of all pages replay the link graph at any date.
+
+Link targets are absolute paths like Wikipage.internal_links, they are
+not resolved against the pages that existed at the time.
+
+    python history.py [DATADIR] [years]   pages unlinked or unedited for years
+"""
+
+import gzip
+import os
+import time
+from collections import Counter, namedtuple
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Set, Tuple
+
+from classes import DATADIR, FALLBACK_ENCODING, Wikipage
+
+ATTICDIR = os.path.join(DATADIR, 'attic')
+METADIR = os.path.join(DATADIR, 'meta')
+PAGESDIR = os.path.join(DATADIR, 'pages')
+# change types
+CREATE, EDIT, MINOR_EDIT, DELETE, REVERT = 'C', 'E', 'e', 'D', 'R'
+
+Change = namedtuple('Change', ['date', 'ip', 'type', 'id', 'user',
+                               'summary', 'extra', 'sizechange'])
+Activity = namedtuple('Activity', ['created', 'last_edit', 'edits',
+                                   'minor_edits', 'editors', 'deleted'])
+# a link added (+1) or removed (-1) by the revision of source at date
+Delta = namedtuple('Delta', ['date', 'source', 'target', 'change'])
+
+
+def read_changes(filename: str) -> Iterator[Change]:
+    """ The changes in a .changes file, skipping lines that are broken """
+    with open(filename, 'r', encoding='UTF-8', errors='replace') as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4 or not fields[0].isdigit():
+                continue
+            fields += [""] * (8 - len(fields))
+            yield Change(int(fields[0]), *fields[1:8])
+
+
+def changelogs(metadir: str = METADIR) -> Iterator[Tuple[str, str]]:
+    """ Yields (wikipath, filename) of every page changelog """
+    for dirpath, dirnames, filenames in os.walk(metadir):
+        dirnames.sort()
+        namespace = os.path.relpath(dirpath, metadir)
+        for filename in sorted(filenames):
+            # _dokuwiki.changes is the changelog of the whole wiki
+            if not filename.endswith(".changes") or filename.startswith("_"):
+                continue
+            file_path = os.path.normpath(os.path.join(namespace, filename))
+            yield (":" + file_path[:-len(".changes")].replace(os.sep, ":"),
+                   os.path.join(dirpath, filename))
+
+
+def revision_file(path: str, date: int, atticdir: str = ATTICDIR) -> str:
+    """ e.g. ':kit14:motor' -> attic/kit14/motor.1458000000.txt.gz """
+    return os.path.join(atticdir, *path.lstrip(":").split(":")) + \
+        ".{}.txt.gz".format(date)
+
+
+def read_revision(filename: str) -> str:
+    with gzip.open(filename, 'rb') as f:
+        data = f.read()
+    try:
+        return data.decode('UTF-8')
+    except UnicodeDecodeError:
+        return data.decode(FALLBACK_ENCODING)
+
+
+def activity(changes: List[Change]) -> Activity:
+    """ The edit activity of a page from its changes """
+    return Activity(
+        created=changes[0].date,
+        last_edit=changes[-1].date,
+        edits=sum(1 for c in changes if c.type != DELETE),
+        minor_edits=sum(1 for c in changes if c.type == MINOR_EDIT),
+        editors=len({c.user or c.ip for c in changes}),
+        deleted=changes[-1].type == DELETE)
+
+
+def link_deltas(path: str, changes: List[Tuple[int, str]],
+                atticdir: str = ATTICDIR,
+                pagesdir: str = PAGESDIR) -> Tuple[List[Delta], int]:
+    """
+    The links added and removed by every revision of the page, given as
+    (date, change type). Revisions missing from the attic are skipped,
+    except the last one, which may only be in pagesdir.
+    Returns the deltas and the number of revisions skipped.
+    """
+    file_path = path.lstrip(":").replace(":", "/") + ".txt"
+    page = Wikipage(path.rsplit(":", 1)[-1], file_path, pagesdir=pagesdir)
+    deltas = []  # type: List[Delta]
+    links = set()  # type: Set[str]
+    skipped = 0
+    for i, (date, typ) in enumerate(changes):
+        if typ == DELETE:
+            page.links = set()
+        else:
+            try:
+                source = read_revision(revision_file(path, date, atticdir))
+            except (OSError, EOFError):
+                if i < len(changes) - 1 or not os.path.exists(
+                        os.path.join(pagesdir, file_path)):
+                    skipped += 1
+                    continue
+                source = page.read_src()
+            page.links = Wikipage.get_links(source)
+        current = page.internal_links
+        deltas.extend(Delta(date, path, target, 1)
+                      for target in sorted(current - links))
+        deltas.extend(Delta(date, path, target, -1)
+                      for target in sorted(links - current))
+        links = current
+    return (deltas, skipped)
+
+
+def _deltas_worker(args: Tuple[str, List[Tuple[int, str]], str, str]
+                   ) -> Tuple[List[Delta], int]:
+    return link_deltas(*args)
+
+
+def analyze(datadir: str = DATADIR, processes: int = None
+            ) -> Tuple[Dict[str, Activity], List[Delta], int]:
+    """
+    Read the history of all pages in datadir, the revisions in a pool
+    of processes (all cores by default, 1 for none).
+    Returns the activity of every page, the link deltas of all pages
+    ordered by date, and the number of revisions missing from the attic.
+    """
+    metadir = os.path.join(datadir, 'meta')
+    atticdir = os.path.join(datadir, 'attic')
+    pagesdir = os.path.join(datadir, 'pages')
+    activities = {}  # type: Dict[str, Activity]
+
+    def tasks() -> Iterator[Tuple[str, List[Tuple[int, str]], str, str]]:
+        for path, filename in changelogs(metadir):
+            changes = sorted(read_changes(filename), key=lambda c: c.date)
+            if changes:
+                activities[path] = activity(changes)
+                yield (path, [(c.date, c.type) for c in changes], atticdir,
+                       pagesdir)
+
+    if processes == 1:
+        results = list(map(_deltas_worker, tasks()))
+    else:
+        with Pool(processes) as pool:
+            results = list(pool.imap_unordered(_deltas_worker, tasks(),
+                                               chunksize=8))
+    deltas = sorted(delta for page_deltas, _ in results
+                    for delta in page_deltas)
+    skipped = sum(page_skipped for _, page_skipped in results)
+    return (activities, deltas, skipped)
+
+
+def links_at(deltas: List[Delta], date: int) -> Set[Tuple[str, str]]:
+    """ The (source, target) links of the wiki as of date """
+    links = set()  # type: Set[Tuple[str, str]]
+    for delta in deltas:
+        if delta.date > date:
+            break
+        if delta.change > 0:
+            links.add((delta.source, delta.target))
+        else:
+            links.discard((delta.source, delta.target))
+    return links
+
+
+def link_counts(deltas: List[Delta]) -> List[Tuple[int, int]]:
+    """ (year, number of links at the end of the year) """
+    counts = Counter()  # type: Counter
+    for delta in deltas:
+        counts[time.gmtime(delta.date).tm_year] += delta.change
+    total = 0
+    result = []
+    for year in sorted(counts):
+        total += counts[year]
+        result.append((year, total))
+    return result
+
+
+def unlinked_since(deltas: List[Delta]) -> Dict[str, int]:
+    """
+    Pages that were linked from other pages but are not anymore, with the
+    date their last link was removed
+    """
+    inbound = Counter()  # type: Counter
+    since = {}  # type: Dict[str, int]
+    for delta in deltas:
+        if delta.source == delta.target:
+            continue
+        inbound[delta.target] += delta.change
+        if inbound[delta.target] == 0:
+            since[delta.target] = delta.date
+        else:
+            since.pop(delta.target, None)
+    return since
+
+
+def unedited_since(activities: Dict[str, Activity],
+                   before: int) -> List[Tuple[str, Activity]]:
+    """ Existing pages last edited before the date, oldest first """
+    return sorted(((path, a) for path, a in activities.items()
+                   if not a.deleted and a.last_edit < before),
+                  key=lambda item: (item[1].last_edit, item[0]))
+
+
+def print_report(activities: Dict[str, Activity], deltas: List[Delta],
+                 years: float = 2, now: float = None) -> None:
+    before = (now or time.time()) - years * 365.25 * 24 * 3600
+
+    def day(date: int) -> str:
+        return time.strftime("%Y-%m-%d", time.gmtime(date))
+
+    print("Links per year ->")
+    for year, n in link_counts(deltas):
+        print("{} {:8d}".format(year, n))
+    print("Not linked since {} years ->".format(years))
+    unlinked = unlinked_since(deltas)
+    for path in sorted(unlinked, key=lambda p: (unlinked[p], p)):
+        if unlinked[path] < before and path in activities and \
+                not activities[path].deleted:
+            print("{} {}".format(day(unlinked[path]), path))
+    print("Not edited since {} years ->".format(years))
+    for path, a in unedited_since(activities, before):
+        print("{} {} ({} edits, {} editors)".format(
+            day(a.last_edit), path, a.edits, a.editors))
+
+
+if __name__ == "__main__":
+    import sys
+
+    datadir = sys.argv[1] if len(sys.argv) > 1 else DATADIR
+    activities, deltas, skipped = analyze(datadir)
+    print("{} pages, {} link changes, {} revisions missing".format(
+        len(activities), len(deltas), skipped), file=sys.stderr)
+    print_report(activities, deltas,
+                 float(sys.argv[2]) if len(sys.argv) > 2 else 2)
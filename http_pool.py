@@ -0,0 +1,263 @@
+"""
+Asynchronous HTTP helpers for talking to the wiki and to external sites,
+using only the standard library:
+
+AsyncHTTPClient  pooled keep-alive connections per host, a global and a
+                 per-host concurrency limit, retries with exponential
+                 backoff, cookies per host and optional redirect tracking
+RateLimiter      adaptive spacing between requests, slowing down when the
+                 server pushes back and speeding up again while it doesn't
+ResultCache      a JSON file of results with a time to live, used both as
+                 cache and as checkpoint of long runs
+"""
+
+import asyncio
+import http.client
+import json
+import os
+import random
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urljoin, urlsplit
+
+Response = namedtuple('Response', ['status', 'headers', 'body', 'url',
+                                   'history'])
+
+# statuses worth retrying, the server is busy or temporarily broken
+RETRY_STATUS = {429, 500, 502, 503, 504}
+REDIRECT_STATUS = {301, 302, 303, 307, 308}
+
+
+class RateLimiter:
+    """
+    Spaces out requests by `delay` seconds. The delay doubles whenever
+    slow_down() is called (e.g. on 429 or 503) and shrinks by 10% on
+    every speed_up(), within [min_delay, max_delay].
+    """
+
+    def __init__(self, delay: float = 0.0, min_delay: float = 0.0,
+                 max_delay: float = 30.0):
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._next = 0.0
+        self._lock = None  # type: Optional[asyncio.Lock]
+
+    async def wait(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.delay
+
+    def slow_down(self) -> None:
+        self.delay = min(self.max_delay, max(self.delay * 2, 0.1))
+
+    def speed_up(self) -> None:
+        self.delay = max(self.min_delay, self.delay * 0.9)
+
+
+class AsyncHTTPClient:
+    """
+    Runs http.client requests in a thread pool, reusing one keep-alive
+    connection per worker and host. At most max_connections requests run
+    at once, and at most per_host against a single host. A request waits
+    for its host before it takes a global slot, so a slow host never
+    holds slots that requests to other hosts could use.
+    Cookies are kept per host (netloc) and only sent back to that host.
+    Failed requests and RETRY_STATUS responses are retried up to
+    `retries` times, waiting backoff * 2**attempt seconds (with jitter).
+    """
+
+    def __init__(self, max_connections: int = 8, per_host: int = None,
+                 timeout: float = 10.0, retries: int = 3,
+                 backoff: float = 0.5, rate_limiter: RateLimiter = None,
+                 user_agent: str = "wikiminer"):
+        self.max_connections = max_connections
+        self.per_host = per_host or max_connections
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limiter = rate_limiter
+        self.user_agent = user_agent
+        # {netloc: {name: value}}
+        self.cookies = defaultdict(dict)  # type: Dict[str, Dict[str, str]]
+        self.requests = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_connections)
+        self._idle = defaultdict(list)  # type: Dict[Tuple, List]
+        self._semaphore = None  # type: Optional[asyncio.Semaphore]
+        self._host_semaphores = {}  # type: Dict[str, asyncio.Semaphore]
+
+    async def __aenter__(self) -> 'AsyncHTTPClient':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        for connections in self._idle.values():
+            for conn in connections:
+                conn.close()
+        self._idle.clear()
+
+    def _connection(self, key: Tuple[str, str]) -> http.client.HTTPConnection:
+        try:
+            return self._idle[key].pop()
+        except IndexError:
+            scheme, netloc = key
+            if scheme == 'https':
+                return http.client.HTTPSConnection(netloc,
+                                                   timeout=self.timeout)
+            return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _send(self, method: str, url: str, body: Optional[bytes],
+              headers: Dict[str, str]) -> Response:
+        """ Blocking request, runs in the thread pool """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        conn = self._connection(key)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self._idle[key].append(conn)
+        return Response(resp.status, resp.headers, data, url, [])
+
+    def _headers(self, url: str,
+                 headers: Optional[Dict[str, str]]) -> Dict[str, str]:
+        result = {'User-Agent': self.user_agent}
+        cookies = self.cookies.get(urlsplit(url).netloc)
+        if cookies:
+            result['Cookie'] = "; ".join(
+                "{}={}".format(k, v) for k, v in cookies.items())
+        result.update(headers or {})
+        return result
+
+    def _store_cookies(self, response: Response) -> None:
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            name, _, value = cookie.split(';', 1)[0].partition('=')
+            self.cookies[urlsplit(response.url).netloc][name.strip()] = \
+                value.strip()
+
+    async def _request_once(self, method: str, url: str,
+                            body: Optional[bytes],
+                            headers: Optional[Dict[str, str]]) -> Response:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host)
+        async with self._host_semaphores[host], self._semaphore:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.wait()
+            self.requests += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, self._send, method, url, body,
+                self._headers(url, headers))
+
+    async def request(self, method: str, url: str, body: bytes = None,
+                      headers: Dict[str, str] = None,
+                      follow_redirects: bool = False) -> Response:
+        """
+        Send a request, retrying as described above. With follow_redirects,
+        up to 5 redirects are followed and the visited urls are returned
+        in Response.history. Raises the last error if all attempts fail.
+        """
+        history = []
+        for _ in range(6):
+            response = await self._retrying(method, url, body, headers)
+            self._store_cookies(response)
+            location = response.headers.get('Location')
+            if not follow_redirects or location is None \
+                    or response.status not in REDIRECT_STATUS:
+                return response._replace(history=history)
+            history.append(url)
+            url = urljoin(url, location)
+            if response.status == 303:
+                method, body = 'GET', None
+        return response._replace(history=history)
+
+    async def _retrying(self, method: str, url: str, body: Optional[bytes],
+                        headers: Optional[Dict[str, str]]) -> Response:
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = await self._request_once(method, url, body,
+                                                    headers)
+            except (OSError, http.client.HTTPException):
+                if last:
+                    raise
+                response = None
+            if response is not None and response.status not in RETRY_STATUS:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.speed_up()
+                return response
+            if response is not None and last:
+                return response
+            if self.rate_limiter is not None:
+                self.rate_limiter.slow_down()
+            wait = self.backoff * 2**attempt * (1 + random.random())
+            retry_after = response and response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                wait = max(wait, int(retry_after))
+            await asyncio.sleep(wait)
+        raise AssertionError("unreachable")
+
+    async def get(self, url: str, **kwargs) -> Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post_form(self, url: str, data: Dict[str, str]) -> Response:
+        return await self.request(
+            'POST', url, body=urlencode(data).encode('UTF-8'),
+            headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+
+class ResultCache:
+    """
+    Results stored in a JSON file as {key: [timestamp, value]}.
+    Entries older than ttl seconds count as missing. Saving is atomic,
+    so the file doubles as checkpoint for resuming interrupted runs.
+    """
+
+    def __init__(self, filename: str, ttl: float = 7 * 24 * 3600):
+        self.filename = filename
+        self.ttl = ttl
+        self.entries = {}  # type: Dict[str, List]
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='UTF-8') as f:
+                self.entries = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: str, now: float = None) -> Any:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if (now or time.time()) - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def set(self, key: str, value: Any, now: float = None) -> None:
+        self.entries[key] = [now or time.time(), value]
+
+    def save(self) -> None:
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='UTF-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.filename)
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Check the external links of all pages and report the dead ones,
+together with the pages containing them.
+
+Every distinct url is checked once, with HEAD and, if the server does
+not support HEAD, with GET. Results are cached with a time to live, so
+reruns only check urls whose result has expired. Failures that may be
+temporary (no connection, 429, 5xx) are not cached, so the next run
+checks those urls again.
+
+    python linkcheck.py
+"""
+
+import asyncio
+import http.client
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+from classes import Wikipage
+from http_pool import AsyncHTTPClient, ResultCache
+
+# statuses of servers that do not like HEAD requests
+HEAD_UNSUPPORTED = {400, 403, 404, 405, 501}
+# too many requests, the url may be fine
+TOO_MANY_REQUESTS = 429
+
+
+def normalize_url(link: str) -> str:
+    """ External links like www.example.com are opened as http:// """
+    if link.startswith("www."):
+        return "http://" + link
+    return link
+
+
+def external_links(pages: Iterable[Wikipage]) -> Dict[str, Set[str]]:
+    """
+    Map every distinct checkable url to the paths of the pages containing
+    it. mailto links and other schemes are left out.
+    """
+    urls = defaultdict(set)  # type: Dict[str, Set[str]]
+    for page in pages:
+        for link in page.external_links:
+            url = normalize_url(link)
+            if url.startswith("http://") or url.startswith("https://"):
+                urls[url].add(page.path)
+    return urls
+
+
+async def check_url(client: AsyncHTTPClient, url: str) -> Dict:
+    """
+    Returns {'status', 'final_url', 'redirects', 'error'} for the url.
+    status is 0 if the server could not be reached.
+    """
+    try:
+        response = await client.request('HEAD', url, follow_redirects=True)
+        if response.status in HEAD_UNSUPPORTED:
+            response = await client.request('GET', url,
+                                            follow_redirects=True)
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        return {'status': 0, 'final_url': url, 'redirects': [],
+                'error': "{}: {}".format(type(e).__name__, e)}
+    return {'status': response.status, 'final_url': response.url,
+            'redirects': response.history, 'error': None}
+
+
+def is_dead(result: Dict) -> bool:
+    return result['status'] == 0 or result['status'] >= 400
+
+
+def is_temporary(result: Dict) -> bool:
+    """ Whether a failure may be gone by the next run """
+    return result['status'] in (0, TOO_MANY_REQUESTS) or \
+        result['status'] >= 500
+
+
+async def check_links(urls: Iterable[str], client: AsyncHTTPClient,
+                      cache: ResultCache,
+                      checkpoint_every: int = 100) -> Dict[str, Dict]:
+    """
+    Check all urls without a fresh result in the cache, and cache the
+    results that are not temporary.
+    Returns the results for all urls.
+    """
+    results = {}
+    todo = []
+    for url in urls:
+        cached = cache.get(url)
+        if cached is None:
+            todo.append(url)
+        else:
+            results[url] = cached
+
+    written = 0
+
+    async def check(url):
+        nonlocal written
+        results[url] = await check_url(client, url)
+        if is_temporary(results[url]):
+            return
+        cache.set(url, results[url])
+        written += 1
+        if written % checkpoint_every == 0:
+            cache.save()
+
+    try:
+        await asyncio.gather(*[check(url) for url in todo])
+    finally:
+        cache.save()
+    return results
+
+
+def dead_links(results: Dict[str, Dict], urls: Dict[str, Set[str]]
+               ) -> List[Tuple[str, Dict, List[str]]]:
+    """
+    Returns (url, result, pages containing it) for every dead url,
+    the url found on most pages first.
+    """
+    dead = [(url, result, sorted(urls[url]))
+            for url, result in results.items() if is_dead(result)]
+    return sorted(dead, key=lambda d: (-len(d[2]), d[0]))
+
+
+async def _main() -> None:
+    from build_graph import PAGESDIR, build_namespace_tree
+    from export import iter_pages
+
+    urls = external_links(iter_pages(build_namespace_tree(PAGESDIR)))
+    cache = ResultCache("linkcheck.json", ttl=14 * 24 * 3600)
+    # at most 2 requests per site, waiting for a slow site does not take
+    # slots from the others, and cookies stay with their site
+    async with AsyncHTTPClient(max_connections=32, per_host=2,
+                               retries=1) as client:
+        results = await check_links(urls, client, cache)
+    for url, result, pages in dead_links(results, urls):
+        print("{} {} ({})".format(result['status'] or result['error'], url,
+                                  ", ".join(pages)))
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,125 @@
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Set
+
+from anytree import PreOrderIter
+
+from classes import PAGESDIR, Namespace, Wikipage, clean_media_id, \
+    medialink_cleanup
+
+
+class MediaIndex:
+    """
+    An inverted index from media files to the pages embedding them.
+    Media are normalized with medialink_cleanup, i.e. they are
+    paths like 'infovault:bilder:2016:team.jpg' without leading ':'.
+    Pages are represented by their absolute wikipath.
+    Build it while parsing the pages, then every lookup is a hash lookup.
+    {{gallery>ns}} embeds are kept separately in galleries,
+    mapping the namespace to the pages showing it.
+    """
+
+    def __init__(self):
+        self.references = defaultdict(set)  # type: Dict[str, Set[str]]
+        self.galleries = defaultdict(set)  # type: Dict[str, Set[str]]
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[Wikipage]) -> 'MediaIndex':
+        index = cls()
+        for page in pages:
+            index.add_page(page)
+        return index
+
+    @classmethod
+    def from_tree(cls, tree_rootns: Namespace,
+                  pagesdir: str = PAGESDIR) -> 'MediaIndex':
+        """
+        Parse all pages in the tree once and index their media. Pages
+        taking too long to parse are left out, see Wikipage.populate.
+        """
+        index = cls()
+        for namespace in PreOrderIter(tree_rootns):
+            for page_name, page_file_path in namespace.pages:
+                index.add_page(Wikipage(page_name, page_file_path,
+                                        populate_immediately=True,
+                                        pagesdir=pagesdir))
+        return index
+
+    def __len__(self) -> int:
+        return len(self.references)
+
+    def __contains__(self, media: str) -> bool:
+        return media in self.references
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.references)
+
+    def __repr__(self):
+        return "MediaIndex({} media)".format(len(self.references))
+
+    def add_page(self, page: Wikipage) -> None:
+        for raw in page.media:
+            if "gallery>" in raw:
+                namespace = clean_media_id(raw.split("gallery>", 1)[1])
+                self.galleries[namespace].add(page.path)
+                continue
+            media = medialink_cleanup(raw)
+            if media is not None:
+                self.references[media].add(page.path)
+
+    def pages_containing(self, media: str) -> Set[str]:
+        """
+        Returns the paths of all pages embedding the media file,
+        e.g. 'infovault:bilder:2016:team.jpg'
+        """
+        return self.references.get(media.lstrip(":"), set())
+
+
+class MediaTree:
+    """
+    A sorted array of media ids for namespace queries.
+    All media in a namespace are adjacent in sorted order, so finding
+    them takes two binary searches plus the size of the result.
+    """
+
+    def __init__(self, media: Iterable[str]):
+        self.media = sorted(set(media))
+
+    def __len__(self) -> int:
+        return len(self.media)
+
+    def __repr__(self):
+        return "MediaTree({} media)".format(len(self.media))
+
+    def _range(self, namespace: str) -> range:
+        namespace = namespace.strip(":")
+        if not namespace:
+            return range(len(self.media))
+        # ';' is the character following ':'
+        start = bisect_left(self.media, namespace + ":")
+        stop = bisect_left(self.media, namespace + ";", start)
+        return range(start, stop)
+
+    def under(self, namespace: str) -> List[str]:
+        """
+        Returns all media in the namespace and its subnamespaces,
+        e.g. under('infovault:bilder:2016')
+        """
+        r = self._range(namespace)
+        return self.media[r.start:r.stop]
+
+    def covered(self, galleries: Iterable[str]) -> Dict[str, str]:
+        """
+        Returns the media shown by {{gallery>ns}} embeds, i.e. all media
+        below one of the gallery namespaces (or the file itself, if a
+        gallery points to a single file), mapped to that namespace.
+        """
+        covered = {}
+        for namespace in galleries:
+            namespace = namespace.strip(":")
+            for media in self.under(namespace):
+                covered.setdefault(media, namespace)
+            i = bisect_left(self.media, namespace)
+            if i < len(self.media) and self.media[i] == namespace:
+                covered.setdefault(namespace, namespace)
+        return covered
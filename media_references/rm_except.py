@@ -2,29 +2,55 @@
 
 """
 unlinks (deletes) all files that are not listed in ./dont-delete.txt
+
+Run from the media directory:
+    rm_except.py                       dry run, list files to remove
+    rm_except.py --delete              delete them
+    rm_except.py --quarantine DIR      move them to DIR instead
+    rm_except.py --restore             move quarantined files back
+An interrupted run is resumed from rm_except.journal by running it again
+the same way. The journal of a finished run is archived by the next one.
 """
 
 import os
-import time
-no_remove = set()
-with open('./dont-delete.txt') as f:
-     for line in f:
-         no_remove.add(line.strip())
-         no_remove.add('dont-delete.txt')
-         no_remove.add('rm_except.py')
-
-for root, dirs, files in os.walk('.'):
-        relpath = os.path.relpath(root)
-        print(relpath)
-        for f in files:
-            if relpath == '.':
-                filepath = f
-            else:
-                filepath = os.path.join(relpath, f)
-            if filepath not in no_remove:
-                print('unlink:' + filepath ) 
-                #os.unlink(filepath)
-            else:
-                print("\n Skipping {} \n".format(filepath))
-            time.sleep(0.025)
+import sys
+
+# the shared modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deletion import execute, make_plan, restore  # noqa: E402
+
+JOURNAL = 'rm_except.journal'
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if '--restore' in args:
+        restored = restore(JOURNAL)
+        print("restored {} files".format(len(restored)))
+        sys.exit()
+
+    no_remove = {'dont-delete.txt', 'rm_except.py', JOURNAL}
+    with open('./dont-delete.txt') as f:
+        for line in f:
+            if line.strip():
+                no_remove.add(line.strip())
+
+    quarantine = None
+    if '--quarantine' in args:
+        quarantine = args[args.index('--quarantine') + 1]
+    dry_run = quarantine is None and '--delete' not in args
 
+    plan = [path for path in make_plan(
+        '.', no_remove, skip_dirs=[quarantine] if quarantine else [])
+        if not path.startswith(JOURNAL)]  # archived journals
+    try:
+        handled = execute(plan, '.', JOURNAL, quarantine=quarantine,
+                          batch_size=500, pause=0.5, dry_run=dry_run)
+    except ValueError as e:
+        sys.exit("cannot resume {}: {}".format(JOURNAL, e))
+    for filepath in handled:
+        print(('unlink: ' if dry_run else 'done: ') + filepath)
+    print("{} files {}".format(len(handled),
+                               "to remove (dry run)" if dry_run else
+                               "moved to " + quarantine if quarantine else
+                               "removed"))
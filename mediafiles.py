@@ -0,0 +1,384 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Compare the media files in data/media with the media embedded in pages.
+
+    python mediafiles.py                   full report
+    python mediafiles.py du [namespace]    disk usage per namespace
+    python mediafiles.py du --refresh ...  rescan instead of using the cache
+
+The disk usage is cached in data/media_usage.json, together with the
+mtimes of the media directories and the number of pages and the newest
+one, and computed again once a media file was added, removed or
+replaced, or pages changed.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import sys
+from collections import defaultdict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, \
+    Optional, Set, Tuple
+
+from classes import DATADIR, MEDIADIR, PAGESDIR, clean_media_id
+from media import MediaIndex, MediaTree
+
+# a file in the media directory, path is its normalized media id and
+# file_path its path on disk, relative to the media directory, e.g.
+# MediaFile('bilder:team.jpg', 123456, 1467367200.0, 'bilder/team.jpg')
+MediaFile = namedtuple('MediaFile', ['path', 'size', 'mtime', 'file_path'])
+
+# the cached DiskUsage in the data directory
+USAGE = "media_usage.json"
+# files at least this large are hashed through mmap, smaller ones are read
+MMAP_THRESHOLD = 4 * 2**20
+READ_BUFFER = 2**20
+
+
+def _scan_dir(mediadir: str,
+              relpath: str) -> Tuple[List[MediaFile], List[str]]:
+    """ Returns the files and the subdirectories of one directory """
+    files, dirs = [], []
+    with os.scandir(os.path.join(mediadir, relpath)) as it:
+        for entry in it:
+            entrypath = os.path.join(relpath, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entrypath)
+            elif entry.is_file():
+                st = entry.stat()
+                media = clean_media_id(entrypath.replace(os.sep, ":"))
+                files.append(MediaFile(media, st.st_size, st.st_mtime,
+                                       entrypath))
+    return (files, dirs)
+
+
+def scan_media(mediadir: str = MEDIADIR,
+               workers: int = 8) -> Iterator[MediaFile]:
+    """
+    Walk the media directory with os.scandir and yield every file.
+    Directories are scanned in a thread pool, since stat calls on
+    large (network) directories mostly wait for I/O.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_scan_dir, mediadir, '')}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                yield from files
+                pending.update(pool.submit(_scan_dir, mediadir, d)
+                               for d in dirs)
+
+
+def media_dirs(mediadir: str = MEDIADIR) -> Dict[str, int]:
+    """
+    The mtime of every directory below mediadir, by its relative path.
+    It changes whenever a file in it is added, removed or replaced, and
+    only the directories are stat'ed, not the files.
+    """
+    mtimes = {}
+    pending = ['']
+    while pending:
+        relpath = pending.pop()
+        path = os.path.join(mediadir, relpath)
+        mtimes[relpath] = os.stat(path).st_mtime_ns
+        with os.scandir(path) as it:
+            pending.extend(os.path.join(relpath, entry.name) for entry in it
+                           if entry.is_dir(follow_symlinks=False))
+    return mtimes
+
+
+def reconcile(mediafiles: Iterable[MediaFile], referenced: Iterable[str]
+              ) -> Tuple[Dict[str, MediaFile], List[str],
+                         Dict[str, MediaFile]]:
+    """
+    Split the media in one pass over the files on disk into
+        * present:      referenced and on disk
+        * missing:      referenced, but not on disk
+        * unreferenced: on disk, but not referenced
+    referenced are cleaned up media links, e.g. the keys of a MediaIndex.
+    Returns a tuple of (present, missing, unreferenced), where present and
+    unreferenced map media ids to their MediaFile.
+    """
+    referenced = set(referenced)
+    present, unreferenced = {}, {}
+    for mediafile in mediafiles:
+        if mediafile.path in referenced:
+            present[mediafile.path] = mediafile
+        else:
+            unreferenced[mediafile.path] = mediafile
+    missing = sorted(referenced.difference(present))
+    return (present, missing, unreferenced)
+
+
+def by_size(mediafiles: Iterable[MediaFile]) -> List[MediaFile]:
+    """ Largest files first, to prioritise by reclaimable bytes """
+    return sorted(mediafiles, key=lambda m: (-m.size, m.path))
+
+
+def file_digest(filename: str) -> str:
+    """ Returns the blake2b hex digest of the file contents """
+    h = hashlib.blake2b()
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                h.update(m)
+        else:
+            buffer = bytearray(READ_BUFFER)
+            view = memoryview(buffer)
+            n = f.readinto(buffer)
+            while n:
+                h.update(view[:n])
+                n = f.readinto(buffer)
+    return h.hexdigest()
+
+
+class DigestCache:
+    """
+    Remembers the digest of every media file together with its size and
+    mtime, so unchanged files are not hashed again on the next run.
+    The cache is stored as a JSON file.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.entries = {}  # type: Dict[str, List]
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='UTF-8') as f:
+                self.entries = json.load(f)
+
+    def get(self, mediafile: MediaFile) -> Optional[str]:
+        entry = self.entries.get(mediafile.path)
+        if entry is not None and entry[0] == mediafile.size \
+                and entry[1] == mediafile.mtime:
+            return entry[2]
+        return None
+
+    def set(self, mediafile: MediaFile, digest: str) -> None:
+        self.entries[mediafile.path] = [mediafile.size, mediafile.mtime,
+                                        digest]
+
+    def save(self) -> None:
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='UTF-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.filename)
+
+
+def find_duplicates(mediafiles: Iterable[MediaFile],
+                    mediadir: str = MEDIADIR,
+                    cache: Optional[DigestCache] = None,
+                    workers: int = 4) -> List[List[MediaFile]]:
+    """
+    Find media files with identical contents.
+    Files are bucketed by size first, only files sharing their size with
+    another file are hashed, in a thread pool (hashlib releases the GIL).
+    Digests of unchanged files are taken from the cache, if given.
+    Returns groups of duplicates, the group wasting most bytes first.
+    """
+    sizes = defaultdict(list)  # type: Dict[int, List[MediaFile]]
+    for mediafile in mediafiles:
+        sizes[mediafile.size].append(mediafile)
+    candidates = [m for bucket in sizes.values() if len(bucket) > 1
+                  for m in bucket if m.size > 0]
+
+    digests = {}  # type: Dict[MediaFile, str]
+    tohash = []
+    for mediafile in candidates:
+        digest = cache.get(mediafile) if cache is not None else None
+        if digest is None:
+            tohash.append(mediafile)
+        else:
+            digests[mediafile] = digest
+
+    filenames = [os.path.join(mediadir, m.file_path) for m in tohash]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for mediafile, digest in zip(tohash, pool.map(file_digest,
+                                                      filenames)):
+            digests[mediafile] = digest
+            if cache is not None:
+                cache.set(mediafile, digest)
+
+    groups = defaultdict(list)  # type: Dict[Tuple[int, str], List]
+    for mediafile, digest in digests.items():
+        groups[(mediafile.size, digest)].append(mediafile)
+    duplicates = [sorted(g) for g in groups.values() if len(g) > 1]
+    return sorted(duplicates, key=lambda g: (-g[0].size * (len(g) - 1),
+                                             g[0].path))
+
+
+def canonical_copy(group: List[MediaFile], index: MediaIndex) -> MediaFile:
+    """
+    The copy links should be repointed to: the one referenced by most
+    pages in the MediaIndex, then the one with the shortest path.
+    """
+    return min(group, key=lambda m: (-len(index.pages_containing(m.path)),
+                                     len(m.path), m.path))
+
+
+class DiskUsage:
+    """
+    File sizes summed up over the media namespace hierarchy, split into
+    referenced and unreferenced bytes. Every namespace ('' is the root)
+    maps to [referenced bytes, unreferenced bytes,
+             referenced files, unreferenced files]
+    including all its subnamespaces.
+    Computed once from a scan, so every query is a dict lookup.
+    It can be saved and loaded as a JSON file, together with a key telling
+    what it was computed from (see cached_usage).
+    """
+
+    def __init__(self, totals: Dict[str, List[int]] = None, key: Any = None):
+        self.totals = totals if totals is not None else {}
+        self.key = key
+
+    @classmethod
+    def from_files(cls, mediafiles: Iterable[MediaFile],
+                   referenced: Iterable[str]) -> 'DiskUsage':
+        referenced = set(referenced)
+        totals = {}  # type: Dict[str, List[int]]
+        for mediafile in mediafiles:
+            pieces = mediafile.path.split(":")[:-1]
+            column = 0 if mediafile.path in referenced else 1
+            for depth in range(len(pieces) + 1):
+                namespace = ":".join(pieces[:depth])
+                total = totals.get(namespace)
+                if total is None:
+                    total = totals[namespace] = [0, 0, 0, 0]
+                total[column] += mediafile.size
+                total[column + 2] += 1
+        return cls(totals)
+
+    @classmethod
+    def load(cls, filename: str) -> 'DiskUsage':
+        with open(filename, 'r', encoding='UTF-8') as f:
+            data = json.load(f)
+        if not isinstance(data.get('totals'), dict):
+            # saved without a key
+            return cls(data)
+        return cls(data['totals'], data['key'])
+
+    def save(self, filename: str) -> None:
+        with open(filename, 'w', encoding='UTF-8') as f:
+            json.dump({'key': self.key, 'totals': self.totals}, f)
+
+    def __getitem__(self, namespace: str) -> List[int]:
+        return self.totals.get(namespace.strip(":"), [0, 0, 0, 0])
+
+    def children(self, namespace: str) -> List[Tuple[str, List[int]]]:
+        """
+        The direct subnamespaces of namespace with their totals,
+        most unreferenced bytes first.
+        """
+        namespace = namespace.strip(":")
+        prefix = namespace + ":" if namespace else ""
+        depth = prefix.count(":") + 1
+        children = [(ns, total) for ns, total in self.totals.items()
+                    if ns.startswith(prefix) and ns
+                    and ns.count(":") + 1 == depth]
+        return sorted(children, key=lambda c: (-c[1][1], c[0]))
+
+
+def cached_usage(filename: str, key: Any,
+                 compute: Callable[[], DiskUsage]) -> DiskUsage:
+    """
+    The disk usage saved in filename, if it was computed for the same key,
+    e.g. media_dirs() and the state of the pages. Otherwise it is computed
+    again with compute() and saved with the key.
+    """
+    try:
+        usage = DiskUsage.load(filename)
+        if usage.key == key:
+            return usage
+    except (OSError, ValueError):
+        pass
+    usage = compute()
+    usage.key = key
+    usage.save(filename)
+    return usage
+
+
+def referenced_media(mediafiles: List[MediaFile],
+                     index: MediaIndex) -> Set[str]:
+    """
+    All media ids referenced by a page of the MediaIndex,
+    directly or through a gallery.
+    """
+    tree = MediaTree(m.path for m in mediafiles)
+    return set(index).union(tree.covered(index.galleries))
+
+
+def print_usage(usage: DiskUsage, namespace: str) -> None:
+    def line(ns, total):
+        return "{:>14,d} {:>14,d} {:>8d} {:>8d}  {}".format(
+            total[0], total[1], total[2], total[3], ":" + ns)
+
+    print("{:>14} {:>14} {:>8} {:>8}".format("referenced", "unreferenced",
+                                             "files", "unused"))
+    print(line(namespace.strip(":"), usage[namespace]))
+    for ns, total in usage.children(namespace):
+        print(line(ns, total))
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["du"]:
+    from anytree import PreOrderIter
+
+    from build_graph import build_namespace_tree
+
+    def compute() -> DiskUsage:
+        index = MediaIndex.from_tree(tree)
+        mediafiles = list(scan_media())
+        return DiskUsage.from_files(mediafiles,
+                                    referenced_media(mediafiles, index))
+
+    usage_file = os.path.join(DATADIR, USAGE)
+    args = [a for a in sys.argv[2:] if a != "--refresh"]
+    if "--refresh" in sys.argv and os.path.exists(usage_file):
+        os.remove(usage_file)
+    tree = build_namespace_tree(PAGESDIR)
+    mtimes = [os.stat(os.path.join(PAGESDIR, file_path)).st_mtime_ns
+              for namespace in PreOrderIter(tree)
+              for _, file_path in namespace.pages]
+    usage = cached_usage(usage_file, {
+        'media': media_dirs(), 'pages': [len(mtimes), max(mtimes, default=0)]
+    }, compute)
+    print_usage(usage, args[0] if args else "")
+
+elif __name__ == "__main__":
+    from build_graph import build_namespace_tree
+
+    index = MediaIndex.from_tree(build_namespace_tree(PAGESDIR))
+    present, missing, unreferenced = reconcile(scan_media(), index)
+    in_gallery = MediaTree(unreferenced).covered(index.galleries)
+    for media in in_gallery:
+        present[media] = unreferenced.pop(media)
+
+    print("Referenced but missing ->")
+    for media in missing:
+        print("{} (on {})".format(media, ", ".join(
+            sorted(index.pages_containing(media)))))
+    print("Present but unreferenced ->")
+    for mediafile in by_size(unreferenced.values()):
+        print("{:12d} {}".format(mediafile.size, mediafile.path))
+    print("Duplicates ->")
+    cache = DigestCache(os.path.join(DATADIR, 'media_digests.json'))
+    duplicates = find_duplicates(
+        list(present.values()) + list(unreferenced.values()), cache=cache)
+    cache.save()
+    for group in duplicates:
+        keep = canonical_copy(group, index)
+        print("{} bytes x {}, keep {}".format(group[0].size, len(group),
+                                              keep.path))
+        for mediafile in group:
+            if mediafile != keep:
+                print("    {} (on {})".format(mediafile.path, ", ".join(
+                    sorted(index.pages_containing(mediafile.path)))))
+    print("{} referenced ({} bytes, {} by galleries), {} missing, "
+          "{} unreferenced ({} bytes reclaimable)".format(
+              len(present), sum(m.size for m in present.values()),
+              len(in_gallery), len(missing), len(unreferenced),
+              sum(m.size for m in unreferenced.values())))
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Find out where the memory of the page graph goes.
+
+MemoryMetrics records, besides the timers of metrics.Metrics, the peak
+and retained memory of every stage with tracemalloc. structure_sizes()
+then attributes the retained memory to the structures of the pipeline
+(page sources, link sets, networkx' dicts, the anytree nodes, ...), and
+namespace_sizes() to the namespaces the pages are in.
+
+    python memprofile.py [depth] [top]
+"""
+
+import contextlib
+import sys
+import tracemalloc
+import types
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+import networkx as nx
+from anytree import PreOrderIter
+
+from classes import Namespace, Wikipage
+from communities import namespace_of
+from metrics import Metrics
+
+# objects that belong to the program, not to the data
+_NOT_DATA = (type, types.ModuleType, types.FunctionType,
+             types.BuiltinFunctionType, types.MethodType)
+
+
+def deep_size(obj, seen: set = None, skip: Tuple = ()) -> int:
+    """
+    Size of obj and everything it references, in bytes.
+    Objects already in seen (ids) are not counted again, so structures
+    sharing objects can be measured one after another. Instances of the
+    types in skip are not followed.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _NOT_DATA) or isinstance(o, skip):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+    return size
+
+
+class MemoryMetrics(Metrics):
+    """
+    Metrics that also trace memory. For every timed stage, 'retained' is
+    the memory allocated in it and still alive afterwards (summed over
+    all calls), 'peak' the highest temporary use above the memory at its
+    start. Stages should not be nested, the inner one resets the peak.
+    Tracing starts with the object and slows the program down 2-4x.
+    """
+
+    def __init__(self, *args, frames: int = 1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.peak = defaultdict(int)  # type: Dict[str, int]
+        self.retained = defaultdict(int)  # type: Dict[str, int]
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            with super().timer(name):
+                yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak[name] = max(self.peak[name], peak - before)
+            self.retained[name] += current - before
+
+    def top_lines(self, n: int = 10) -> List[Tuple[str, int]]:
+        """ The n source lines whose allocations are alive the most """
+        stats = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__)]).statistics(
+                'lineno')
+        return [(str(s.traceback), s.size) for s in stats[:n]]
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+
+    def as_dict(self) -> Dict:
+        result = super().as_dict()
+        result['memory'] = {name: {'peak_bytes': self.peak[name],
+                                   'retained_bytes': self.retained[name]}
+                            for name in self.peak}
+        return result
+
+
+def _sampled(pagegraph: nx.DiGraph, sample: int) -> List[Wikipage]:
+    pages = [data['object'] for _, data in pagegraph.nodes(data=True)
+             if 'object' in data]
+    return pages[::sample]
+
+
+def structure_sizes(pagegraph: nx.DiGraph, tree_rootns: Namespace,
+                    sample: int = 1) -> Dict[str, int]:
+    """
+    Bytes held by each structure of the pipeline. The pages are measured
+    for every sample-th page only and extrapolated, the graph and the
+    tree completely. Objects shared by structures count for the first.
+    """
+    sizes = Counter()  # type: Counter
+    seen = set()  # type: set
+    for page in _sampled(pagegraph, sample):
+        sizes['Wikipage.src'] += deep_size(page.src, seen) * sample
+        sizes['Wikipage.links'] += deep_size(page.links, seen) * sample
+        sizes['Wikipage.media'] += deep_size(page.media, seen) * sample
+        sizes['Wikipage.headings'] += deep_size(page.headings, seen) * sample
+        sizes['Wikipage (rest)'] += deep_size(page, seen) * sample
+    sizes['networkx'] = deep_size(pagegraph, seen, skip=(Wikipage,))
+    sizes['anytree'] = sum(deep_size(ns, seen)
+                           for ns in PreOrderIter(tree_rootns))
+    return dict(sizes)
+
+
+def namespace_sizes(pagegraph: nx.DiGraph, depth: int = 1,
+                    sample: int = 1) -> List[Tuple[str, int]]:
+    """
+    Bytes held by the pages of every namespace (cut off after depth
+    levels), largest first. Edges are attributed to the linking page.
+    """
+    sizes = Counter()  # type: Counter
+    for page in _sampled(pagegraph, sample):
+        size = deep_size(page) + deep_size(dict(pagegraph.succ[page.path]))
+        sizes[namespace_of(page.path, depth)] += size * sample
+    return sizes.most_common()
+
+
+def print_report(report: Dict, top: int = 10) -> None:
+    print("{:<12} {:>10} {:>12} {:>10}".format(
+        "stage", "seconds", "retained MB", "peak MB"))
+    for name, mem in report['memory'].items():
+        print("{:<12} {:>10.3f} {:>12.1f} {:>10.1f}".format(
+            name, report['timers'][name], mem['retained_bytes'] / 2**20,
+            mem['peak_bytes'] / 2**20))
+    print("\nstructure              MB")
+    for name, size in sorted(report['structures'].items(),
+                             key=lambda s: -s[1]):
+        print("{:<18} {:>7.1f}".format(name, size / 2**20))
+    print("\nnamespace              MB")
+    for ns, size in report['namespaces'][:top]:
+        print("{:<18} {:>7.1f}".format(ns, size / 2**20))
+    print("\nallocated at")
+    for line, size in report['top_lines'][:top]:
+        print("{:>7.1f} MB {}".format(size / 2**20, line))
+
+
+if __name__ == "__main__":
+    import json
+    import os
+
+    from build_graph import DATADIR, PAGESDIR, build_namespace_tree, \
+        build_page_graph
+
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    metrics = MemoryMetrics()
+    rootns = build_namespace_tree(PAGESDIR, metrics=metrics)
+    G = build_page_graph(rootns, metrics=metrics)
+    report = metrics.as_dict()
+    report['top_lines'] = metrics.top_lines(top)
+    metrics.stop()
+    report['structures'] = structure_sizes(G, rootns)
+    report['namespaces'] = namespace_sizes(G, depth)
+    print_report(report, top)
+    with open(os.path.join(DATADIR, 'memprofile.json'), 'w') as f:
+        json.dump(report, f, indent=1)
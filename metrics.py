@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Timers, counters and events for the build pipeline.
+
+A Metrics object collects the time spent per stage, counters like files,
+bytes and links, and diagnostic events (templates, galleries, external
+media, ...) that used to be printed. Code deep in the parser reports
+events with metrics.event(), which goes to the Metrics object activated
+by the caller, or nowhere. Without metrics, NULL is used, so the
+instrumentation costs next to nothing.
+
+    m = Metrics(progress=print_progress)
+    G = build_page_graph(build_namespace_tree(PAGESDIR, metrics=m),
+                         metrics=m)
+    m.dump("metrics.json")
+"""
+
+import contextlib
+import json
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional
+
+# number of examples kept per event
+SAMPLES = 5
+
+
+class NullMetrics:
+    """ Metrics that are thrown away """
+
+    enabled = False
+    _timer = contextlib.nullcontext()
+
+    def timer(self, name: str):
+        return self._timer
+
+    def count(self, name: str, n: int = 1) -> None:
+        pass
+
+    def event(self, name: str, detail: str = None) -> None:
+        pass
+
+    def progress(self, stage: str, done: int, total: int) -> None:
+        pass
+
+    def activate(self):
+        return self._timer
+
+
+NULL = NullMetrics()
+_active = NULL  # type: NullMetrics
+
+
+def event(name: str, detail: str = None) -> None:
+    """ Report an event to the active Metrics, if any """
+    _active.event(name, detail)
+
+
+class Metrics(NullMetrics):
+    """
+    Collects per stage timers, counters and events.
+    progress is called as progress(stage, done, total, eta) at most every
+    progress_interval seconds, eta being the estimated seconds left.
+    """
+
+    enabled = True
+
+    def __init__(self, progress: Callable = None,
+                 progress_interval: float = 1.0):
+        self.timers = defaultdict(float)  # type: Dict[str, float]
+        self.counters = Counter()  # type: Counter
+        self.events = Counter()  # type: Counter
+        self.samples = defaultdict(list)  # type: Dict[str, List[str]]
+        self.started = time.perf_counter()
+        self._progress = progress
+        self._progress_interval = progress_interval
+        self._progress_last = 0.0
+        self._stage_started = {}  # type: Dict[str, float]
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] += time.perf_counter() - start
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def event(self, name: str, detail: str = None) -> None:
+        self.events[name] += 1
+        if detail is not None and len(self.samples[name]) < SAMPLES:
+            self.samples[name].append(detail)
+
+    def progress(self, stage: str, done: int, total: int) -> None:
+        if self._progress is None:
+            return
+        now = time.perf_counter()
+        started = self._stage_started.setdefault(stage, now)
+        if done < total and now - self._progress_last < \
+                self._progress_interval:
+            return
+        self._progress_last = now
+        eta = None  # type: Optional[float]
+        if done:
+            eta = (now - started) / done * (total - done)
+        self._progress(stage, done, total, eta)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """ Send events reported with metrics.event() here """
+        global _active
+        previous, _active = _active, self
+        try:
+            yield self
+        finally:
+            _active = previous
+
+    def as_dict(self) -> Dict:
+        return {
+            'total_seconds': time.perf_counter() - self.started,
+            'timers': dict(self.timers),
+            'counters': dict(self.counters),
+            'events': {name: {'count': n, 'samples': self.samples[name]}
+                       for name, n in sorted(self.events.items())},
+        }
+
+    def dump(self, filename: str) -> None:
+        with open(filename, 'w', encoding='UTF-8') as f:
+            json.dump(self.as_dict(), f, indent=1, ensure_ascii=False)
+
+
+def print_progress(stage: str, done: int, total: int,
+                   eta: Optional[float]) -> None:
+    """ A progress callback writing a status line to stderr """
+    left = "?" if eta is None else "{:.0f}s".format(eta)
+    sys.stderr.write("\r{}: {}/{} ({} left)".format(stage, done, total, left))
+    if done >= total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Verify orphan candidates against the wiki's backlink pages (?do=backlink).
+
+Only pages without any backlink in the local page graph are checked,
+pages that are linked locally are settled. Results are kept in a cache
+with a time to live, which is also saved regularly as a checkpoint,
+so an interrupted run continues where it stopped.
+
+    python orphans.py [user]
+"""
+
+import asyncio
+import getpass
+import http.client
+import sys
+from typing import Dict, Iterable, List
+from urllib.parse import quote
+
+import networkx as nx
+
+from http_pool import AsyncHTTPClient, RateLimiter, ResultCache
+
+WIKIURL = "https://wiki.ka-raceing.de"
+# texts on the backlink page, from the german dokuwiki translation
+NOTHING_FOUND = "Nichts gefunden"
+ACCESS_DENIED = "Zugang verweigert"
+LOGIN_FAILED = "Benutzername oder Passwort sind falsch."
+
+ORPHAN = "orphan"
+LINKED = "linked"
+DENIED = "denied"
+# no answer, or not a backlink page (error, redirect to the login)
+FAILED = "failed"
+
+
+def orphan_candidates(pagegraph: nx.DiGraph) -> List[str]:
+    """
+    Existing pages that no other page links to in the local graph.
+    All other pages have a backlink we know of, they need no check.
+    """
+    return sorted(node for node, data in pagegraph.nodes(data=True)
+                  if 'object' in data and not any(
+                      p != node for p in pagegraph.predecessors(node)))
+
+
+def backlink_url(path: str, wikiurl: str = WIKIURL) -> str:
+    return "{}/{}?do=backlink".format(wikiurl, quote(path.lstrip(":"),
+                                                     safe=":"))
+
+
+def classify(text: str) -> str:
+    if NOTHING_FOUND in text:
+        return ORPHAN
+    if ACCESS_DENIED in text:
+        return DENIED
+    return LINKED
+
+
+async def login(client: AsyncHTTPClient, user: str, password: str,
+                wikiurl: str = WIKIURL) -> bool:
+    """ Log in to the wiki, the session cookie is kept by the client """
+    response = await client.post_form(wikiurl + "/start?do=login",
+                                      {'u': user, 'p': password})
+    return LOGIN_FAILED not in response.body.decode('UTF-8', 'replace')
+
+
+async def verify_orphans(candidates: Iterable[str], client: AsyncHTTPClient,
+                         cache: ResultCache, wikiurl: str = WIKIURL,
+                         checkpoint_every: int = 50) -> Dict[str, str]:
+    """
+    Check every candidate's backlink page, unless the cache has a fresh
+    result for it. Only 200 responses are classified, every other status
+    and a request that fails after all retries give FAILED. FAILED and
+    DENIED results are not cached, so they are asked again next time.
+    Returns {path: ORPHAN | LINKED | DENIED | FAILED} for all candidates.
+    """
+    results = {}
+    todo = []
+    for path in candidates:
+        cached = cache.get(path)
+        if cached is None:
+            todo.append(path)
+        else:
+            results[path] = cached
+
+    written = 0
+
+    async def check(path):
+        nonlocal written
+        try:
+            response = await client.get(backlink_url(path, wikiurl))
+        except (OSError, http.client.HTTPException):
+            results[path] = FAILED
+            return
+        if response.status != 200:
+            results[path] = FAILED
+            return
+        result = classify(response.body.decode('UTF-8', 'replace'))
+        results[path] = result
+        if result != DENIED:
+            cache.set(path, result)
+            written += 1
+            if written % checkpoint_every == 0:
+                cache.save()
+
+    try:
+        await asyncio.gather(*[check(path) for path in todo])
+    finally:
+        cache.save()
+    return results
+
+
+async def verify(candidates: List[str], user: str,
+                 cachefile: str = "orphans.json",
+                 wikiurl: str = WIKIURL) -> None:
+    """ Log in, asking for the password, verify and print the orphans """
+    cache = ResultCache(cachefile)
+    async with AsyncHTTPClient(max_connections=4,
+                               rate_limiter=RateLimiter(0.25)) as client:
+        if not await login(client, user, getpass.getpass(
+                "PW for {}:".format(user)), wikiurl):
+            print(LOGIN_FAILED)
+            return
+        results = await verify_orphans(candidates, client, cache, wikiurl)
+    for path in sorted(results):
+        if results[path] == ORPHAN:
+            print(path)
+    print("{} orphans, {} requests".format(
+        sum(r == ORPHAN for r in results.values()), client.requests))
+    failed = sorted(p for p, r in results.items() if r == FAILED)
+    if failed:
+        print("{} pages could not be checked: {}".format(
+            len(failed), " ".join(failed)))
+
+
+async def _main(user: str) -> None:
+    from build_graph import PAGESDIR, build_namespace_tree, build_page_graph
+
+    G = build_page_graph(build_namespace_tree(PAGESDIR))
+    candidates = orphan_candidates(G)
+    print("{} of {} pages have no local backlinks".format(
+        len(candidates), G.number_of_nodes()))
+    await verify(candidates, user)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "testuser"))
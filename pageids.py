@@ -0,0 +1,44 @@
+"""
+Page and media ids, cleaned up the way dokuwiki does from link to file.
+Kept apart from classes.py, so that queries (see wikiminer.py) can
+clean ids without importing the parser.
+"""
+
+
+def fold_umlauts(text: str) -> str:
+    """ Replace lowercase umlauts the way dokuwiki does in ids """
+    text = text.replace("ä", "ae")
+    text = text.replace("ö", "oe")
+    text = text.replace("ü", "ue")
+    text = text.replace("ß", "ss")
+    return text
+
+
+def clean_page_id(link: str) -> str:
+    """
+    Normalizes the characters of an internal link like dokuwiki does for
+    page names, e.g. 'Kit14 : Große Räder' -> 'kit14:grosse_raeder'.
+    Leading ':', '.' and '/' and sections are left to the caller.
+    """
+    link = link.lower()
+    link = ":".join([piece.strip() for piece in link.split(":")])
+    link = fold_umlauts(link)
+    link = link.replace("\"", "")
+    for s in ["&", "\"", "+", "'", " ", "__", "___"]:
+        link = link.replace(s, "_")
+    if not link.startswith("/"):
+        link = link.replace("/", "_")
+    return link
+
+
+def clean_media_id(media: str) -> str:
+    """
+    Normalizes an internal media id like dokuwiki does for file names,
+    e.g. ':InfoVault:Bilder:Müller.JPG' -> 'infovault:bilder:mueller.jpg'
+    """
+    media = fold_umlauts(media.lower())
+    media = media.strip()
+    if media.startswith(":"):
+        return media[1:]
+    else:
+        return media
@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Full-text search over the page sources, ranked with BM25
+(https://en.wikipedia.org/wiki/Okapi_BM25), optionally weighted by
+the pagerank of the pages.
+
+The inverted index is kept in SQLite next to the snapshot of store.py:
+for every term, the ids of the pages containing it and the term
+frequencies, as varint encoded gaps. Pages are added while they are
+read anyway (see ParseCache.refresh). A changed page gets a new id,
+appended to the end of the postings; the old id is only marked deleted,
+and the postings are rewritten when more than half of the ids are dead.
+A query reads just the postings of its terms.
+
+    python search.py wiki.sqlite "query terms"
+"""
+
+import heapq
+import math
+import re
+import sqlite3
+from array import array
+from collections import Counter, defaultdict
+from typing import TYPE_CHECKING, Dict, Iterable, List, Tuple
+
+from pageids import fold_umlauts
+
+if TYPE_CHECKING:
+    from classes import Wikipage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_docs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS search_terms (
+    term TEXT PRIMARY KEY,
+    last INTEGER NOT NULL,
+    postings BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_meta (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+);
+"""
+
+# words, without the '_' dokuwiki puts in ids for spaces
+RE_TOKEN = re.compile(r'[^\W_]+')
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# length of deleted documents
+DELETED = -1
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase words with umlauts replaced, as parse_raw_link does for
+    links, so 'Größe' finds 'groesse' and [[kit14:größe]] alike.
+    """
+    return RE_TOKEN.findall(fold_umlauts(text.lower()))
+
+
+def encode(values: Iterable[int]) -> bytes:
+    """ Non-negative integers as varints, 7 bits per byte """
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append(value & 0x7f | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode(data: bytes) -> List[int]:
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+def postings(data: bytes) -> List[Tuple[int, int]]:
+    """ The (doc id, term frequency) pairs of encoded postings """
+    values = decode(data)
+    result = []
+    doc = 0
+    for i in range(0, len(values), 2):
+        doc += values[i]
+        result.append((doc, values[i + 1]))
+    return result
+
+
+class SearchIndex:
+    """
+    An inverted index of page sources in a SQLite database.
+    add_page() and remove() are buffered until save().
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        conn.executescript(SCHEMA)
+        row = conn.execute(
+            "SELECT value FROM search_meta WHERE key = 'lengths'").fetchone()
+        # length of every document by id, DELETED if it was removed
+        self.lengths = array('l', row[0] if row else b'')
+        self.ids = dict(conn.execute("SELECT path, id FROM search_docs"))
+        self._pending = defaultdict(list)  # type: Dict[str, List[int]]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.ids
+
+    def add_page(self, page: 'Wikipage') -> None:
+        """ Index the source of the page, replacing an older version """
+        self.add(page.path, page.src)
+
+    def add(self, path: str, text: str) -> None:
+        self.remove(path)
+        doc = len(self.lengths)
+        terms = tokenize(text)
+        self.lengths.append(len(terms))
+        self.ids[path] = doc
+        for term, tf in Counter(terms).items():
+            self._pending[term].extend((doc, tf))
+
+    def remove(self, path: str) -> None:
+        doc = self.ids.pop(path, None)
+        if doc is not None:
+            self.lengths[doc] = DELETED
+
+    def save(self) -> None:
+        """ Write the buffered changes in one transaction """
+        if sum(1 for n in self.lengths if n == DELETED) > len(self.ids):
+            self.optimize()
+            return
+        with self.conn:
+            self._write_pending()
+            self._write_docs()
+
+    def optimize(self) -> None:
+        """ Rewrite the index without the deleted documents """
+        live = sorted(self.ids.items(), key=lambda item: item[1])
+        renumber = {old: new for new, (_, old) in enumerate(live)}
+        terms = defaultdict(list)  # type: Dict[str, List[int]]
+        for term, data in self.conn.execute(
+                "SELECT term, postings FROM search_terms"):
+            for doc, tf in postings(data):
+                if doc in renumber:
+                    terms[term].extend((renumber[doc], tf))
+        for term, pending in self._pending.items():
+            for i in range(0, len(pending), 2):
+                if pending[i] in renumber:
+                    terms[term].extend((renumber[pending[i]], pending[i + 1]))
+        self.lengths = array('l', (self.lengths[old] for _, old in live))
+        self.ids = {path: renumber[old] for path, old in live}
+        self._pending = terms
+        with self.conn:
+            self.conn.execute("DELETE FROM search_terms")
+            self._write_pending()
+            self._write_docs()
+
+    def _write_pending(self) -> None:
+        for term, pending in sorted(self._pending.items()):
+            row = self.conn.execute(
+                "SELECT last, postings FROM search_terms WHERE term = ?",
+                (term,)).fetchone()
+            last, data = row if row else (0, b'')
+            gaps = []
+            for i in range(0, len(pending), 2):
+                gaps += [pending[i] - last, pending[i + 1]]
+                last = pending[i]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO search_terms VALUES (?, ?, ?)",
+                (term, last, data + encode(gaps)))
+        self._pending.clear()
+
+    def _write_docs(self) -> None:
+        self.conn.execute("DELETE FROM search_docs")
+        self.conn.executemany("INSERT INTO search_docs VALUES (?, ?)",
+                              ((doc, path) for path, doc in self.ids.items()))
+        self.conn.execute("INSERT OR REPLACE INTO search_meta VALUES (?, ?)",
+                          ('lengths', self.lengths.tobytes()))
+
+    def search(self, query: str, limit: int = 10,
+               prior: Dict[str, float] = None,
+               weight: float = 1.0) -> List[Tuple[str, float]]:
+        """
+        The best matching pages for the query as (path, score), best
+        first. With a prior, e.g. the pagerank of every page, the score
+        is bm25 + weight * log(1 + prior * number of pages).
+        Only saved changes are searched.
+        """
+        live = [n for n in self.lengths if n != DELETED]
+        if not live:
+            return []
+        n_docs = len(live)
+        avgdl = sum(live) / n_docs
+        scores = defaultdict(float)  # type: Dict[int, float]
+        for term in set(tokenize(query)):
+            row = self.conn.execute(
+                "SELECT postings FROM search_terms WHERE term = ?",
+                (term,)).fetchone()
+            if row is None:
+                continue
+            matches = [(doc, tf) for doc, tf in postings(row[0])
+                       if self.lengths[doc] != DELETED]
+            idf = math.log(1 + (n_docs - len(matches) + 0.5) /
+                           (len(matches) + 0.5))
+            for doc, tf in matches:
+                norm = K1 * (1 - B + B * self.lengths[doc] / avgdl)
+                scores[doc] += idf * tf * (K1 + 1) / (tf + norm)
+        paths = {doc: path for path, doc in self.ids.items()} \
+            if scores else {}
+        if prior:
+            for doc in scores:
+                scores[doc] += weight * math.log1p(
+                    prior.get(paths[doc], 0) * n_docs)
+        best = heapq.nlargest(limit, scores.items(),
+                              key=lambda item: (item[1], -item[0]))
+        return [(paths[doc], score) for doc, score in best]
+
+
+if __name__ == "__main__":
+    import sys
+
+    import store
+
+    conn = store.connect(sys.argv[1])
+    for path, score in SearchIndex(conn).search(" ".join(sys.argv[2:])):
+        print("{:7.2f} {}".format(score, path))
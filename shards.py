@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Build the page graph in two steps, so the work can be spread over
+several processes or hosts that share a filesystem:
+
+map:    parse the pages of a shard of top-level namespaces and write
+        a page table, a (raw) link table and a media table.
+reduce: merge the tables of all shards, resolve the links against the
+        global set of pages and build the page graph.
+
+Every run has an id, a timestamp and a hash of the shard plan, that all
+its map processes share. The map step records it with the number of
+shards in a manifest and in the marker of every finished shard, so
+reduce only merges the shards of that run, never leftovers of an
+earlier run.
+
+Run e.g.
+    python shards.py run 4                        (prints a new RUN id)
+    python shards.py map 0 4 RUN /shared/graph    (on every host, 0..3)
+    python shards.py reduce /shared/graph
+"""
+
+import hashlib
+import json
+import os
+import socket
+import sys
+from datetime import datetime
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Tuple
+
+import networkx as nx
+from anytree import PreOrderIter
+
+from build_graph import PAGESDIR, build_namespace_tree
+from classes import PAGE_BUDGET, LinkResolver, Namespace, Wikipage
+
+# key for the pages directly in the root namespace
+ROOTPAGES = ""
+MANIFEST = "manifest.json"
+
+
+def shard_namespaces(tree_rootns: Namespace, n_shards: int) -> List[List[str]]:
+    """
+    Split the top-level namespaces into n_shards groups with roughly the
+    same number of pages. Pages in the root namespace are put under
+    the key ROOTPAGES. The split only depends on the tree, so every host
+    computes the same one.
+    """
+    sizes = {ROOTPAGES: len(tree_rootns.pages)}
+    for child in tree_rootns.children:
+        sizes[child.name] = sum(len(ns.pages) for ns in PreOrderIter(child))
+
+    shards = [[] for _ in range(n_shards)]  # type: List[List[str]]
+    load = [0] * n_shards
+    for name in sorted(sizes, key=lambda k: (-sizes[k], k)):
+        smallest = load.index(min(load))
+        shards[smallest].append(name)
+        load[smallest] += sizes[name]
+    return [sorted(shard) for shard in shards]
+
+
+def new_run(shards: List[List[str]]) -> str:
+    """
+    A new id for a run of the shard plan, e.g.
+    '20170301-120000-123456-9f3a61c0'
+    """
+    plan = hashlib.sha1(json.dumps(shards).encode('UTF-8')).hexdigest()
+    return "{}-{}".format(datetime.now().strftime("%Y%m%d-%H%M%S-%f"),
+                          plan[:8])
+
+
+def shard_pages(tree_rootns: Namespace,
+                namespaces: List[str]) -> Iterator[Tuple[str, str]]:
+    """ Yields (page_name, page_file_path) for all pages in the shard """
+    if ROOTPAGES in namespaces:
+        yield from tree_rootns.pages
+    for child in tree_rootns.children:
+        if child.name in namespaces:
+            for namespace in PreOrderIter(child):
+                yield from namespace.pages
+
+
+def shard_prefix(outdir: str, shard_id: int) -> str:
+    return os.path.join(outdir, "shard-{:04d}".format(shard_id))
+
+
+def map_shard(tree_rootns: Namespace, namespaces: List[str], outdir: str,
+              shard_id: int, n_shards: int, run: str,
+              pagesdir: str = PAGESDIR, budget: float = PAGE_BUDGET) -> None:
+    """
+    Parse all pages of the given top-level namespaces and write
+    the partial tables for shard shard_id of n_shards of the run to outdir:
+        shard-NNNN.pages.jsonl -> [path, name, file_path, skipped]
+        shard-NNNN.links.jsonl -> [path, raw link, title]
+        shard-NNNN.media.jsonl -> [path, media]
+    Pages taking longer than budget seconds to parse are skipped, like in
+    build_graph.build_page_graph.
+    The manifest with run and n_shards is written first, and the .done
+    marker of an earlier run is removed. Every table is written to a
+    temporary file and renamed when complete, the shard-NNNN.done marker
+    is written last.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    _write_json(os.path.join(outdir, MANIFEST), {'run': run,
+                                                 'n_shards': n_shards})
+    prefix = shard_prefix(outdir, shard_id)
+    if os.path.exists(prefix + ".done"):
+        os.remove(prefix + ".done")
+    tables = {t: open("{}.{}.jsonl.tmp".format(prefix, t), "w",
+                      encoding="UTF-8")
+              for t in ("pages", "links", "media")}
+    try:
+        for page_name, page_file_path in shard_pages(tree_rootns, namespaces):
+            page = Wikipage(page_name, page_file_path, pagesdir=pagesdir)
+            page.populate(budget)
+            tables["pages"].write(json.dumps(
+                [page.path, page.name, page.file_path, page.skipped]) + "\n")
+            for link, title in sorted(page.links):
+                tables["links"].write(json.dumps(
+                    [page.path, link, title]) + "\n")
+            for media in sorted(page.media):
+                tables["media"].write(json.dumps([page.path, media]) + "\n")
+    finally:
+        for f in tables.values():
+            f.close()
+    for t in tables:
+        os.replace("{}.{}.jsonl.tmp".format(prefix, t),
+                   "{}.{}.jsonl".format(prefix, t))
+    _write_json(prefix + ".done", {'namespaces': namespaces,
+                                   'n_shards': n_shards, 'run': run})
+
+
+def _write_json(filename: str, value) -> None:
+    # every map process writes the manifest, on any host, so each needs
+    # its own tmp file. It is created with the umask, so that processes
+    # of other users can read the result
+    tmp = "{}.{}-{}.tmp".format(filename, socket.gethostname(), os.getpid())
+    with open(tmp, "w", encoding="UTF-8") as f:
+        json.dump(value, f)
+    os.replace(tmp, filename)
+
+
+def _read_json(filename: str):
+    try:
+        with open(filename, "r", encoding="UTF-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_table(filename: str) -> Iterator[List[str]]:
+    with open(filename, "r", encoding="UTF-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def reduce_shards(outdir: str, n_shards: int = None,
+                  pagesdir: str = PAGESDIR) -> nx.DiGraph:
+    """
+    Merge the tables of the shards 0..n_shards-1 in outdir into one page
+    graph, equal to what build_graph.build_page_graph returns for the
+    whole wiki. n_shards defaults to the one in the manifest of the map
+    step. Fails unless every shard is done, in the run of the manifest
+    with n_shards.
+    The page objects in the graph carry links and media, but no source.
+    """
+    manifest = _read_json(os.path.join(outdir, MANIFEST))
+    if not manifest:
+        raise RuntimeError("{} has no {}, run map first".format(
+            outdir, MANIFEST))
+    if n_shards is None:
+        n_shards = manifest['n_shards']
+    marker = {'n_shards': n_shards, 'run': manifest['run']}
+    prefixes = [shard_prefix(outdir, shard_id)
+                for shard_id in range(n_shards)]
+    done = []
+    for prefix in prefixes:
+        done_marker = _read_json(prefix + ".done") or {}
+        if all(done_marker.get(k) == v for k, v in marker.items()):
+            done.append(prefix)
+    if len(done) != n_shards:
+        raise RuntimeError("{} of {} shards are done in {}".format(
+            len(done), n_shards, outdir))
+
+    pages = {}  # type: Dict[str, Wikipage]
+    for prefix in prefixes:
+        for path, name, file_path, skipped in read_table(
+                prefix + ".pages.jsonl"):
+            pages[path] = Wikipage(name, file_path, pagesdir=pagesdir)
+            pages[path].skipped = skipped
+        for path, media in read_table(prefix + ".media.jsonl"):
+            pages[path].media.add(media)
+
+    pagegraph = nx.DiGraph()
+    for path, page in pages.items():
+        pagegraph.add_node(path, object=page)
+        if page.skipped:
+            pagegraph.nodes[path]['skipped'] = True
+
+    resolver = LinkResolver(pages)
+    for prefix in prefixes:
+        for path, link, title in read_table(prefix + ".links.jsonl"):
+            pages[path].links.add((link, title))
+    for path, page in pages.items():
+        pagegraph.add_edges_from([(path, link, {'rule': rule})
+                                  for link, rule
+                                  in sorted(page.resolved_links(resolver))])
+    return pagegraph
+
+
+def _map_worker(args: Tuple[str, List[str], str, int, int, str]) -> None:
+    pagesdir, namespaces, outdir, shard_id, n_shards, run = args
+    rootns = build_namespace_tree(pagesdir)
+    map_shard(rootns, namespaces, outdir, shard_id, n_shards, run, pagesdir)
+
+
+def build_page_graph_sharded(pagesdir: str, outdir: str,
+                             processes: int = 4) -> nx.DiGraph:
+    """
+    Run the map step for `processes` shards in a process pool on this
+    machine, then reduce. Same result as build_graph.build_page_graph.
+    """
+    rootns = build_namespace_tree(pagesdir)
+    shards = shard_namespaces(rootns, processes)
+    run = new_run(shards)
+    with Pool(processes) as pool:
+        pool.map(_map_worker, [(pagesdir, namespaces, outdir, shard_id,
+                                len(shards), run)
+                               for shard_id, namespaces in enumerate(shards)])
+    return reduce_shards(outdir, len(shards), pagesdir)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "run":
+        print(new_run(shard_namespaces(build_namespace_tree(PAGESDIR),
+                                       int(sys.argv[2]))))
+    elif len(sys.argv) == 6 and sys.argv[1] == "map":
+        shard_id, n_shards, run, outdir = sys.argv[2:]
+        rootns = build_namespace_tree(PAGESDIR)
+        namespaces = shard_namespaces(rootns, int(n_shards))[int(shard_id)]
+        map_shard(rootns, namespaces, outdir, int(shard_id), int(n_shards),
+                  run)
+    elif len(sys.argv) == 3 and sys.argv[1] == "reduce":
+        G = reduce_shards(sys.argv[2])
+        print("{} pages, {} links".format(G.number_of_nodes(),
+                                          G.number_of_edges()))
+    else:
+        print(__doc__)
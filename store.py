@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Persist pages, resolved links, media references and headings in a SQLite
+database, so ad-hoc questions become a SQL query instead of a new script.
+
+    python store.py wiki.sqlite    (export or update from data/pages)
+"""
+
+import os
+import sqlite3
+import sys
+from typing import TYPE_CHECKING, Iterable, List, Tuple
+
+# the queries need nothing but sqlite3, so they start fast (see
+# wikiminer.py), parsing pages is imported where needed
+if TYPE_CHECKING:
+    import networkx as nx
+    from cache import ParseCache
+    from classes import LinkResolver, Wikipage
+    from media import MediaIndex
+    from search import SearchIndex
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    path TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    title TEXT NOT NULL,
+    file_path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_namespace ON pages (namespace);
+CREATE TABLE IF NOT EXISTS links (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    rule TEXT NOT NULL,
+    raw TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS links_source ON links (source);
+CREATE INDEX IF NOT EXISTS links_target ON links (target);
+CREATE TABLE IF NOT EXISTS media (
+    page TEXT NOT NULL,
+    media TEXT NOT NULL,
+    raw TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_page ON media (page);
+CREATE INDEX IF NOT EXISTS media_media ON media (media);
+CREATE TABLE IF NOT EXISTS headings (
+    page TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS headings_page ON headings (page);
+CREATE TABLE IF NOT EXISTS galleries (
+    page TEXT NOT NULL,
+    namespace TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS galleries_page ON galleries (page);
+"""
+
+
+def connect(filename: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(filename)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def prefix_range(prefix: str) -> Tuple[str, str]:
+    """
+    Returns (low, high) such that low <= s < high exactly for the strings
+    s starting with prefix, so prefix queries can use an index.
+    """
+    return (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def _link_rows(page: 'Wikipage', resolver: 'LinkResolver') -> List[Tuple]:
+    rows = []
+    for raw_link, _ in sorted(page.links):
+        resolved = resolver.resolve(raw_link, page.namespace)
+        if resolved is not None:
+            rows.append((page.path, resolved[0], resolved[1], raw_link))
+    return rows
+
+
+def _write_pages(conn: sqlite3.Connection, pages: Iterable['Wikipage'],
+                 resolver: 'LinkResolver') -> None:
+    from classes import clean_media_id, medialink_cleanup
+
+    page_rows, link_rows, media_rows, heading_rows = [], [], [], []
+    gallery_rows = []
+    for page in pages:
+        page_rows.append((page.path, page.namespace, page.name, page.title,
+                          page.file_path))
+        link_rows.extend(_link_rows(page, resolver))
+        for raw in sorted(page.media):
+            if "gallery>" in raw:
+                gallery_rows.append((page.path, clean_media_id(
+                    raw.split("gallery>", 1)[1])))
+                continue
+            media = medialink_cleanup(raw)
+            if media is not None:
+                media_rows.append((page.path, media, raw))
+        heading_rows.extend((page.path, position, level, text)
+                            for position, (level, text)
+                            in enumerate(page.headings))
+    conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                     page_rows)
+    conn.executemany("INSERT INTO links VALUES (?, ?, ?, ?)", link_rows)
+    conn.executemany("INSERT INTO media VALUES (?, ?, ?)", media_rows)
+    conn.executemany("INSERT INTO headings VALUES (?, ?, ?, ?)",
+                     heading_rows)
+    conn.executemany("INSERT INTO galleries VALUES (?, ?)", gallery_rows)
+
+
+def _delete_pages(conn: sqlite3.Connection, paths: List[str]) -> None:
+    rows = [(path,) for path in paths]
+    conn.executemany("DELETE FROM pages WHERE path = ?", rows)
+    conn.executemany("DELETE FROM links WHERE source = ?", rows)
+    conn.executemany("DELETE FROM media WHERE page = ?", rows)
+    conn.executemany("DELETE FROM headings WHERE page = ?", rows)
+    conn.executemany("DELETE FROM galleries WHERE page = ?", rows)
+
+
+def export(conn: sqlite3.Connection, cache: 'ParseCache') -> None:
+    """
+    Replace the contents of the database with all pages in the cache,
+    in a single transaction.
+    """
+    from classes import LinkResolver
+
+    resolver = LinkResolver(cache.entries)
+    with conn:
+        for table in ("pages", "links", "media", "headings", "galleries"):
+            conn.execute("DELETE FROM {}".format(table))
+        _write_pages(conn, cache.pages(), resolver)
+
+
+def update(conn: sqlite3.Connection, cache: 'ParseCache',
+           changed: List[str], removed: List[str]) -> None:
+    """
+    Upsert the changed pages and delete the removed ones,
+    as returned by ParseCache.refresh, in a single transaction.
+    When pages were added or removed, the links of all pages are
+    resolved again, since their targets may have changed.
+    """
+    from classes import LinkResolver
+
+    resolver = LinkResolver(cache.entries)
+    added = [p for p in changed if conn.execute(
+        "SELECT 1 FROM pages WHERE path = ?", (p,)).fetchone() is None]
+    with conn:
+        _delete_pages(conn, changed + removed)
+        _write_pages(conn, (cache.page(path) for path in changed), resolver)
+        if added or removed:
+            conn.execute("DELETE FROM links")
+            for page in cache.pages():
+                conn.executemany("INSERT INTO links VALUES (?, ?, ?, ?)",
+                                 _link_rows(page, resolver))
+
+
+def sync(conn: sqlite3.Connection, cache: 'ParseCache',
+         pagesdir: str = None,
+         search_index: 'SearchIndex' = None) -> Tuple[List[str], List[str]]:
+    """
+    Refresh the parse cache from pagesdir (default data/pages) and apply
+    the changes to the database. An empty database is exported in full.
+    A search_index is updated in the same pass and saved.
+    Returns (changed, removed) as ParseCache.refresh.
+    """
+    from build_graph import PAGESDIR, build_namespace_tree
+
+    changed, removed = cache.refresh(
+        build_namespace_tree(pagesdir or PAGESDIR),
+        search_index=search_index)
+    if conn.execute("SELECT count(*) FROM pages").fetchone()[0] == 0:
+        export(conn, cache)
+    else:
+        update(conn, cache, changed, removed)
+    if search_index is not None:
+        search_index.save()
+    cache.save()
+    return (changed, removed)
+
+
+# canned queries
+
+def pages_embedding(conn: sqlite3.Connection, namespace: str,
+                    media_namespace: str) -> List[Tuple[str, str]]:
+    """
+    Pages in namespace that embed media from media_namespace
+    e.g. pages_embedding(conn, ':kit14', 'infovault:bilder:2016')
+    Returns (page, media) tuples.
+    """
+    low, high = prefix_range(namespace.rstrip(":") + ":")
+    mlow, mhigh = prefix_range(media_namespace.strip(":") + ":")
+    return conn.execute(
+        "SELECT page, media FROM media "
+        "WHERE page >= ? AND page < ? AND media >= ? AND media < ? "
+        "ORDER BY page, media", (low, high, mlow, mhigh)).fetchall()
+
+
+def pages_using_media(conn: sqlite3.Connection, media: str) -> List[str]:
+    """ Pages embedding the media file, e.g. 'infovault:bilder:logo.png' """
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT page FROM media WHERE media = ? ORDER BY page",
+        (media.lstrip(":"),))]
+
+
+def backlinks(conn: sqlite3.Connection, path: str) -> List[str]:
+    """ Pages linking to the page at path """
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT source FROM links WHERE target = ? ORDER BY source",
+        (path,))]
+
+
+def wanted_pages(conn: sqlite3.Connection) -> List[Tuple[str, int]]:
+    """ Link targets that do not exist, with the number of linking pages """
+    return conn.execute(
+        "SELECT target, count(DISTINCT source) AS n FROM links "
+        "WHERE rule = 'wanted' GROUP BY target "
+        "ORDER BY n DESC, target").fetchall()
+
+
+def page_exists(conn: sqlite3.Connection, path: str) -> bool:
+    return conn.execute("SELECT 1 FROM pages WHERE path = ?",
+                        (path,)).fetchone() is not None
+
+
+def page_graph(conn: sqlite3.Connection) -> 'nx.DiGraph':
+    """
+    The page graph of build_graph.build_page_graph, without the Wikipage
+    objects, but also without parsing a single page
+    """
+    import networkx as nx
+
+    graph = nx.DiGraph()
+    graph.add_nodes_from(row[0] for row in conn.execute(
+        "SELECT path FROM pages ORDER BY path"))
+    graph.add_edges_from((source, target, {'rule': rule})
+                         for source, target, rule in conn.execute(
+                             "SELECT source, target, rule FROM links "
+                             "ORDER BY source, target"))
+    return graph
+
+
+def media_index(conn: sqlite3.Connection) -> 'MediaIndex':
+    """ The MediaIndex of all pages, including their galleries """
+    from media import MediaIndex
+
+    index = MediaIndex()
+    for page, media in conn.execute("SELECT page, media FROM media"):
+        index.references[media].add(page)
+    for page, namespace in conn.execute(
+            "SELECT page, namespace FROM galleries"):
+        index.galleries[namespace].add(page)
+    return index
+
+
+def orphans(conn: sqlite3.Connection) -> List[str]:
+    """ Pages no other page links to """
+    return [row[0] for row in conn.execute(
+        "SELECT path FROM pages WHERE NOT EXISTS ("
+        "SELECT 1 FROM links WHERE target = path AND source != path) "
+        "ORDER BY path")]
+
+
+if __name__ == "__main__":
+    from cache import ParseCache
+
+    dbfile = sys.argv[1] if len(sys.argv) > 1 else "wiki.sqlite"
+    conn = connect(dbfile)
+    cache = ParseCache(os.path.splitext(dbfile)[0] + ".cache.json")
+    changed, removed = sync(conn, cache)
+    print("{}: {} pages changed, {} removed".format(
+        dbfile, len(changed), len(removed)))
+    conn.close()
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Suggest existing pages for wanted links ("did you mean ..."), to fix
+typos, umlaut variants and links to moved pages.
+
+The normalized names and titles of all pages go into a character
+trigram index. A page similar enough to the name of a wanted target
+must share one of its rarest trigrams (prefix filtering), so only the
+pages in the postings of those are compared, and most of them are
+dismissed by the number of trigrams they share there. No target is
+compared with every page. Candidates are ranked by trigram similarity
+(Jaccard), then by how close they are to the namespace of the linking
+page.
+
+The result is a rewrite plan with one line per link to review, not a
+change to the wiki.
+
+    python suggest.py wiki.sqlite [plan.tsv]
+"""
+
+import heapq
+import math
+import sqlite3
+import sys
+from collections import Counter, defaultdict
+from typing import Dict, FrozenSet, IO, Iterable, List, Tuple
+
+from pageids import fold_umlauts
+
+# lowest similarity of a suggestion
+MIN_SIMILARITY = 0.3
+# similarities searched before MIN_SIMILARITY, see TrigramIndex.similar
+THRESHOLDS = (0.5,)
+
+
+def normalize(text: str) -> str:
+    """
+    A page name or title as comparable key, e.g. 'Größe Räder' ->
+    'groesseraeder'. Spaces and underscores are dropped, since links
+    use them inconsistently.
+    """
+    text = fold_umlauts(text.lower())
+    return "".join(c for c in text if c.isalnum())
+
+
+def trigrams(key: str) -> FrozenSet[str]:
+    padded = "  " + key + " "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def namespaces(path: str) -> List[str]:
+    """ ':a:b:page' -> [':a:', ':a:b:'] """
+    parts = path.split(":")[1:-1]
+    return [":" + ":".join(parts[:i]) + ":" for i in range(1, len(parts) + 1)]
+
+
+def common_depth(path: str, namespaces: List[str]) -> int:
+    """ Number of the namespaces (from namespaces()) path is in """
+    depth = 0
+    for namespace in namespaces:
+        if not path.startswith(namespace):
+            break
+        depth += 1
+    return depth
+
+
+class TrigramIndex:
+    """
+    Maps trigrams to the normalized page names and titles containing them,
+    and those to their pages. Names like 'start' are in many namespaces,
+    but indexed once.
+    """
+
+    def __init__(self):
+        self.keys = {}  # type: Dict[str, int]
+        self.paths = []  # type: List[List[str]]
+        self.grams = []  # type: List[FrozenSet[str]]
+        self.sizes = []  # type: List[int]
+        self.postings = defaultdict(list)  # type: Dict[str, List[int]]
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[Tuple[str, str]]) -> 'TrigramIndex':
+        """ pages are (path, title) """
+        index = cls()
+        for path, title in pages:
+            name = path.rsplit(":", 1)[-1]
+            index.add(path, name)
+            if title and normalize(title) != normalize(name):
+                index.add(path, title)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, path: str, text: str) -> None:
+        key = normalize(text)
+        entry = self.keys.get(key)
+        if entry is None:
+            entry = self.keys[key] = len(self.paths)
+            self.paths.append([])
+            self.grams.append(trigrams(key))
+            self.sizes.append(len(self.grams[entry]))
+            for gram in self.grams[entry]:
+                self.postings[gram].append(entry)
+        self.paths[entry].append(path)
+
+    def similar(self, text: str, limit: int = 3,
+                min_similarity: float = MIN_SIMILARITY) -> Dict[str, float]:
+        """
+        {path: similarity} of the limit pages whose name or title is most
+        similar (more on ties), at least min_similarity.
+        Tries the higher THRESHOLDS first, since a high threshold needs to
+        compare far fewer pages, and most targets have close matches.
+        """
+        query = trigrams(normalize(text))
+        # rarest first
+        ordered = sorted(query, key=lambda gram: len(
+            self.postings.get(gram, ())))
+        for threshold in [t for t in THRESHOLDS if t > min_similarity] + \
+                [min_similarity]:
+            found = self._above(query, ordered, threshold)
+            if len(found) >= limit or threshold == min_similarity:
+                break
+        if len(found) > limit:
+            cutoff = heapq.nlargest(limit, found.values())[-1]
+            found = {path: similarity for path, similarity in found.items()
+                     if similarity >= cutoff}
+        return found
+
+    def _above(self, query: FrozenSet[str], ordered: List[str],
+               threshold: float) -> Dict[str, float]:
+        """ {path: similarity} of all entries at least threshold similar """
+        # an entry this similar shares at least `needed` trigrams, so one
+        # of the len(query) - needed + 1 rarest (prefix filtering)
+        needed = max(1, math.ceil(threshold * len(query) - 1e-9))
+        prefix = len(query) - needed + 1
+        counts = Counter()  # type: Counter
+        for gram in ordered[:prefix]:
+            counts.update(self.postings.get(gram, ()))
+        # and has between threshold * len(query) and len(query) / threshold
+        # trigrams, at least threshold / (1 + threshold) of them shared
+        low, high = threshold * len(query), len(query) / threshold
+        ratio = threshold / (1 + threshold)
+        sizes = self.sizes
+        found = {}  # type: Dict[str, float]
+        for entry, count in counts.items():
+            size = sizes[entry]
+            # at most needed - 1 more shared trigrams after the prefix
+            if size < low or size > high or \
+                    count + needed - 1 < ratio * (len(query) + size):
+                continue
+            shared = len(query.intersection(self.grams[entry]))
+            similarity = shared / (len(query) + size - shared)
+            if similarity >= threshold:
+                for path in self.paths[entry]:
+                    if similarity > found.get(path, 0):
+                        found[path] = similarity
+        return found
+
+
+def rank(found: Dict[str, float], target: str, source: str,
+         limit: int = 3) -> List[Tuple[str, float]]:
+    """
+    The best limit suggestions: most similar, then closest to the
+    namespace of the linking page, then closest to the namespace of the
+    target.
+    """
+    source_ns, target_ns = namespaces(source), namespaces(target)
+    return heapq.nsmallest(limit, found.items(), key=lambda item: (
+        -round(item[1], 6), -common_depth(item[0], source_ns),
+        -common_depth(item[0], target_ns), item[0]))
+
+
+def wanted_links(conn: sqlite3.Connection
+                 ) -> Dict[str, List[Tuple[str, str]]]:
+    """ {target: [(source, raw link)]} of the wanted links in a snapshot """
+    wanted = defaultdict(list)  # type: Dict[str, List[Tuple[str, str]]]
+    for target, source, raw in conn.execute(
+            "SELECT target, source, raw FROM links WHERE rule = 'wanted' "
+            "ORDER BY target, source, raw"):
+        wanted[target].append((source, raw))
+    return wanted
+
+
+def rewrite_plan(conn: sqlite3.Connection, limit: int = 3,
+                 min_similarity: float = MIN_SIMILARITY) -> List[Tuple]:
+    """
+    Returns (source, raw link, target, suggestion, similarity,
+    alternatives) for every wanted link with a suggestion.
+    """
+    index = TrigramIndex.from_pages(
+        conn.execute("SELECT path, title FROM pages ORDER BY path"))
+    by_name = {}  # type: Dict[str, Dict[str, float]]
+    plan = []
+    for target, links in wanted_links(conn).items():
+        name = target.rsplit(":", 1)[-1]
+        if name not in by_name:
+            by_name[name] = index.similar(name, limit, min_similarity)
+        if not by_name[name]:
+            continue
+        for source, raw in links:
+            ranked = rank(by_name[name], target, source, limit)
+            plan.append((source, raw, target, ranked[0][0], ranked[0][1],
+                         [path for path, _ in ranked[1:]]))
+    return plan
+
+
+def write_plan(plan: List[Tuple], f: IO[str]) -> None:
+    """
+    Tab separated, one line per link. Delete the lines you do not want
+    to apply, or replace the suggestion with one of the alternatives.
+    """
+    f.write("source\tlink\ttarget\tsuggestion\tsimilarity\talternatives\n")
+    for source, raw, target, suggestion, similarity, alternatives in plan:
+        f.write("{}\t[[{}]]\t{}\t{}\t{:.2f}\t{}\n".format(
+            source, raw, target, suggestion, similarity,
+            " ".join(alternatives)))
+
+
+if __name__ == "__main__":
+    import store
+
+    conn = store.connect(sys.argv[1] if len(sys.argv) > 1 else "wiki.sqlite")
+    plan = rewrite_plan(conn)
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w', encoding='UTF-8') as f:
+            write_plan(plan, f)
+    else:
+        write_plan(plan, sys.stdout)
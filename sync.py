@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+Keep a local copy of data/pages up to date with the wiki, using the
+JSON-RPC API of dokuwiki (https://www.dokuwiki.org/devel:jsonrpc).
+
+Only pages changed since the last sync are fetched, concurrently. They are
+written to the local tree only after all of them have been fetched, each
+file is replaced atomically, and the sync timestamp is advanced last.
+Afterwards the parse cache is refreshed, so downstream tools update
+incrementally.
+
+    WIKI_TOKEN=... python sync.py
+"""
+
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from cache import ParseCache
+from classes import DATADIR, PAGESDIR
+from http_pool import AsyncHTTPClient
+
+RPCURL = "https://wiki.ka-raceing.de/lib/exe/jsonrpc.php"
+STATEFILE = os.path.join(DATADIR, 'sync.json')
+
+
+class RPCError(Exception):
+    """ An error returned by the wiki's API """
+
+
+class WikiRPC:
+    """ Calls to dokuwiki's JSON-RPC API over an AsyncHTTPClient """
+
+    def __init__(self, client: AsyncHTTPClient, url: str = RPCURL,
+                 token: str = None):
+        self.client = client
+        self.url = url
+        self.headers = {'Content-Type': 'application/json'}
+        if token:
+            self.headers['Authorization'] = 'Bearer ' + token
+        self._id = 0
+
+    async def call(self, method: str, **params):
+        self._id += 1
+        body = json.dumps({'jsonrpc': '2.0', 'id': self._id,
+                           'method': method, 'params': params})
+        response = await self.client.request(
+            'POST', self.url, body=body.encode('UTF-8'),
+            headers=self.headers)
+        if response.status != 200:
+            raise RPCError("{} returned {}".format(method, response.status))
+        result = json.loads(response.body.decode('UTF-8'))
+        if result.get('error'):
+            raise RPCError("{}: {}".format(method, result['error']))
+        return result['result']
+
+    async def recent_page_changes(self, timestamp: int) -> List[Dict]:
+        return await self.call('core.getRecentPageChanges',
+                               timestamp=timestamp)
+
+    async def recent_media_changes(self, timestamp: int) -> List[Dict]:
+        return await self.call('core.getRecentMediaChanges',
+                               timestamp=timestamp)
+
+    async def page(self, page_id: str) -> str:
+        return await self.call('core.getPage', page=page_id)
+
+
+def page_file(page_id: str, pagesdir: str = PAGESDIR) -> str:
+    """ The local file of a page id, e.g. kit14:motor -> kit14/motor.txt """
+    return os.path.join(pagesdir, *page_id.split(":")) + '.txt'
+
+
+def read_state(statefile: str = STATEFILE) -> Dict:
+    if os.path.exists(statefile):
+        with open(statefile, 'r', encoding='UTF-8') as f:
+            return json.load(f)
+    return {'timestamp': 0, 'media': {}}
+
+
+def write_state(state: Dict, statefile: str = STATEFILE) -> None:
+    tmp = statefile + '.tmp'
+    with open(tmp, 'w', encoding='UTF-8') as f:
+        json.dump(state, f)
+    os.replace(tmp, statefile)
+
+
+def latest_changes(changes: List[Dict]) -> Dict[str, Dict]:
+    """ The most recent change of every page (or media file) """
+    latest = {}
+    for change in sorted(changes, key=lambda c: c['revision']):
+        latest[change['id']] = change
+    return latest
+
+
+def apply_pages(pages: Dict[str, Optional[str]],
+                pagesdir: str = PAGESDIR) -> None:
+    """
+    Write fetched pages to the local tree, replacing each file atomically.
+    Pages mapped to None were deleted in the wiki and are removed.
+    """
+    for page_id, text in sorted(pages.items()):
+        filename = page_file(page_id, pagesdir)
+        if text is None:
+            if os.path.exists(filename):
+                os.remove(filename)
+            continue
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = filename + '.sync'
+        with open(tmp, 'w', encoding='UTF-8') as f:
+            f.write(text)
+        os.replace(tmp, filename)
+
+
+async def sync(rpc: WikiRPC, pagesdir: str = PAGESDIR,
+               statefile: str = STATEFILE,
+               cache: ParseCache = None) -> Tuple[List[str], List[str]]:
+    """
+    Fetch the pages changed since the last sync and apply them.
+    Also records the latest change of every media file in the state.
+    If a parse cache is given, it is refreshed afterwards.
+    Returns the (updated, deleted) page ids.
+    """
+    state = read_state(statefile)
+    since = state['timestamp']
+    page_changes = latest_changes(await rpc.recent_page_changes(since))
+    media_changes = latest_changes(await rpc.recent_media_changes(since))
+
+    deleted = sorted(i for i, c in page_changes.items() if c['type'] == 'D')
+    updated = sorted(i for i, c in page_changes.items() if c['type'] != 'D')
+    texts = await asyncio.gather(*[rpc.page(i) for i in updated])
+
+    pages = dict(zip(updated, texts))  # type: Dict[str, Optional[str]]
+    pages.update((i, None) for i in deleted)
+    apply_pages(pages, pagesdir)
+
+    for media_id, change in media_changes.items():
+        state['media'][media_id] = change
+    revisions = [c['revision'] for c in page_changes.values()] + \
+        [c['revision'] for c in media_changes.values()]
+    if revisions:
+        state['timestamp'] = max(revisions) + 1
+    write_state(state, statefile)
+
+    if cache is not None:
+        from build_graph import build_namespace_tree
+        cache.refresh(build_namespace_tree(pagesdir))
+        cache.save()
+    return (updated, deleted)
+
+
+async def _main() -> None:
+    async with AsyncHTTPClient(max_connections=8) as client:
+        rpc = WikiRPC(client, token=os.environ.get('WIKI_TOKEN'))
+        cache = ParseCache(os.path.join(DATADIR, 'parse_cache.json'))
+        updated, deleted = await sync(rpc, cache=cache)
+    print("{} pages updated, {} deleted".format(len(updated), len(deleted)))
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
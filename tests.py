@@ -1,4 +1,48 @@
-from classes import Node, Wikipage
+import asyncio
+import bench
+import contextlib
+import gzip
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import networkx as nx
+import pytest
+
+from build_graph import build_namespace_tree, build_page_graph
+from classes import RE_EMBEDDEDMEDIA, RE_HEADING, RE_LINK, \
+    ExtractionTimeout, LinkResolver, Node, Wikipage, find_galleries, \
+    find_headings, find_links, find_media, medialink_cleanup
+from communities import communities, label_propagation, misplaced_pages
+from cache import ParseCache
+from compact import CompactGraph
+from corpus import adversarial_pages, generate_corpus
+import deletion
+import duplicates
+import dokuwiki_meta
+import export
+import history
+import linkcheck
+import memprofile
+import metrics
+import orphans
+from external import build_external, iter_edges
+from http_pool import AsyncHTTPClient, RateLimiter, ResultCache
+from media import MediaIndex, MediaTree
+from mediafiles import DigestCache, DiskUsage, cached_usage, \
+    canonical_copy, find_duplicates, media_dirs, reconcile, \
+    referenced_media, scan_media
+import search
+import store
+import suggest
+import sync
+import wikiminer
+from shards import build_page_graph_sharded, map_shard, new_run, \
+    reduce_shards, shard_namespaces
 
 
 def test_parse_raw_link():
@@ -16,6 +60,1168 @@ def test_parse_raw_link():
             result, expected)
 
 
+def test_compact_graph():
+    g = nx.DiGraph([(":a", ":b"), (":a", ":c"), (":c", ":a")])
+    cg = CompactGraph.from_digraph(g)
+    assert len(cg) == 3
+    assert sorted(cg.edges()) == sorted(g.edges())
+    rev = cg.reverse()
+    assert sorted(rev.edges()) == sorted((t, s) for s, t in g.edges())
+
+
+def test_communities():
+    edges = []
+    for ns in ["kit12", "kit13"]:
+        pages = [":{}:p{}".format(ns, i) for i in range(5)]
+        edges += [(a, b) for a in pages for b in pages if a != b]
+    edges.append((":kit12:p0", ":kit13:p0"))
+    # a page in kit12 that only links into kit13
+    edges += [(":kit12:lost", ":kit13:p{}".format(i)) for i in range(4)]
+    cg = CompactGraph.from_edges([], edges)
+    clusters = communities(cg, label_propagation(cg))
+    assert len(clusters) == 2
+    assert {p.split(":")[1] for p in clusters[1]} in ({"kit12"}, {"kit13"})
+    assert misplaced_pages(cg) == [(":kit12:lost", ":kit13", 1.0)]
+
+
+def write_pages(pagesdir, pages):
+    """ Write a dict of {'ns/page.txt': source} below pagesdir """
+    for file_path, source in pages.items():
+        path = os.path.join(str(pagesdir), file_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='UTF-8') as f:
+            f.write(source)
+
+
+def test_link_resolver():
+    resolver = LinkResolver([":start", ":kit14:start", ":kit14:fahrwerk",
+                             ":kit15:kit15", ":kit16", ":kit14:a:b"])
+    tests = {
+        "fahrwerk": (":kit14:fahrwerk", "page"),
+        ".:fahrwerk": (":kit14:fahrwerk", "page"),
+        "..:start": (":start", "page"),
+        "..kit14:fahrwerk": (":kit14:fahrwerk", "page"),
+        "a:b": (":a:b", "wanted"),
+        ".:a:b": (":kit14:a:b", "page"),
+        "kit14:": (":kit14:start", "start"),
+        ":kit15:": (":kit15:kit15", "ns_page"),
+        "kit16:": (":kit16", "ns_as_page"),
+        "kit17:": (":kit17:start", "wanted"),
+        "..:": (":start", "start"),
+        "https://example.com": None,
+    }
+    for t, expected in tests.items():
+        result = resolver.resolve(t, ":kit14")
+        assert result == expected, "{}: got: {}, expected: {}".format(
+            t, result, expected)
+
+
+def test_build_page_graph(tmp_path):
+    write_pages(tmp_path, {
+        "start.txt": "[[kit14:]] [[kit14:motor]]",
+        "kit14/start.txt": "[[motor]] [[..:start]]",
+        "kit14/motor.txt": "[[fahrwerk#setup]]",
+    })
+    G = build_page_graph(build_namespace_tree(str(tmp_path)), str(tmp_path))
+    assert set(G.successors(":start")) == {":kit14:start", ":kit14:motor"}
+    assert set(G.predecessors(":start")) == {":kit14:start"}
+    assert G.edges[":kit14:motor", ":kit14:fahrwerk"]["rule"] == "wanted"
+
+
+def test_sharded_build(tmp_path):
+    pagesdir = tmp_path / "pages"
+    write_pages(pagesdir, {
+        "start.txt": "[[kit14:]] [[kit15:motor]] {{logo.png?100}}",
+        "kit14/start.txt": "[[motor]] [[..:kit15:]] [[:start]]",
+        "kit14/motor.txt": "[[..:kit15:motor|Motor]]",
+        "kit15/kit15.txt": "[[:kit14:]]",
+        "kit15/motor.txt": "[[kit14:motor]] [[fahrwerk]]",
+    })
+    rootns = build_namespace_tree(str(pagesdir))
+    G = build_page_graph(rootns, str(pagesdir))
+    shards = shard_namespaces(rootns, 2)
+    assert sorted(sum(shards, [])) == ["", "kit14", "kit15"]
+    # leftovers of earlier runs with three and with two shards
+    out = str(tmp_path / "out")
+    for shard_id, namespaces in enumerate(shard_namespaces(rootns, 3)):
+        map_shard(rootns, namespaces, out, shard_id, 3, "old3",
+                  str(pagesdir))
+    with open(os.path.join(out, "shard-0002.pages.jsonl"), "a") as f:
+        f.write('[":old", "old", "old.txt", false]\n')
+    for shard_id, namespaces in enumerate(shards):
+        map_shard(rootns, namespaces, out, shard_id, 2, "old2",
+                  str(pagesdir))
+    run = new_run(shards)
+    assert run != new_run(shards)
+    map_shard(rootns, shards[0], out, 0, 2, run, str(pagesdir))
+    # shard 1 is still from the earlier run with as many shards
+    with pytest.raises(RuntimeError):
+        reduce_shards(out, pagesdir=str(pagesdir))
+    map_shard(rootns, shards[1], out, 1, 2, run, str(pagesdir))
+    merged = reduce_shards(out, pagesdir=str(pagesdir))
+    # readable by map and reduce processes of other users
+    umask = os.umask(0o022)
+    os.umask(umask)
+    for name in ["manifest.json", "shard-0000.done"]:
+        assert os.stat(os.path.join(out, name)).st_mode & 0o777 == \
+            0o666 & ~umask
+    assert set(reduce_shards(out, 2, str(pagesdir)).nodes) == set(G.nodes)
+    assert set(merged.nodes) == set(G.nodes)
+    assert sorted(merged.edges(data=True)) == sorted(G.edges(data=True))
+    assert merged.nodes[":start"]["object"].media == {"logo.png"}
+    # pages over budget are skipped like in build_page_graph
+    for shard_id, namespaces in enumerate(shards):
+        map_shard(rootns, namespaces, out, shard_id, 2, "slow",
+                  str(pagesdir), budget=-1)
+    skipped = reduce_shards(out, pagesdir=str(pagesdir))
+    assert skipped.number_of_edges() == 0
+    assert dict(skipped.nodes(data="skipped")) == dict.fromkeys(
+        [":start", ":kit14:start", ":kit14:motor", ":kit15:kit15",
+         ":kit15:motor"], True)
+
+    pooled = build_page_graph_sharded(str(pagesdir), str(tmp_path / "pool"),
+                                      processes=2)
+    assert sorted(pooled.edges(data=True)) == sorted(G.edges(data=True))
+
+
+def test_sqlite_store(tmp_path):
+    pagesdir = tmp_path / "pages"
+    write_pages(pagesdir, {
+        "start.txt": "====== Willkommen ======\n[[kit14:]]",
+        "kit14/start.txt": "{{infovault:bilder:2016:team.jpg?200}} [[motor]]",
+        "kit14/motor.txt": "== Motor ==\n{{:infovault:bilder:2015:a.jpg}}}",
+    })
+    conn = store.connect(str(tmp_path / "wiki.sqlite"))
+    cache = ParseCache(str(tmp_path / "cache.json"), str(pagesdir))
+    changed, removed = store.sync(conn, cache, str(pagesdir))
+    assert len(changed) == 3 and removed == []
+    assert store.pages_embedding(conn, ":kit14", "infovault:bilder:2016") == [
+        (":kit14:start", "infovault:bilder:2016:team.jpg")]
+    assert store.backlinks(conn, ":kit14:start") == [":start"]
+    assert store.wanted_pages(conn) == []
+    assert conn.execute("SELECT title FROM pages WHERE path = ':start'"
+                        ).fetchone() == ("Willkommen",)
+
+    write_pages(pagesdir, {"kit14/motor.txt": "[[getriebe]] [[start]]"})
+    os.remove(str(pagesdir / "start.txt"))
+    cache = ParseCache(str(tmp_path / "cache.json"), str(pagesdir))
+    changed, removed = store.sync(conn, cache, str(pagesdir))
+    assert changed == [":kit14:motor"] and removed == [":start"]
+    assert store.wanted_pages(conn) == [(":kit14:getriebe", 1)]
+    assert store.backlinks(conn, ":kit14:start") == [":kit14:motor"]
+    assert store.orphans(conn) == []
+    assert store.pages_using_media(conn, "infovault:bilder:2015:a.jpg") == []
+
+
+def test_external_build(tmp_path):
+    pagesdir = tmp_path / "pages"
+    write_pages(pagesdir, {
+        "start.txt": "[[kit14:]] [[kit14:motor]] [[kit14:start]]",
+        "kit14/start.txt": "[[motor]] [[..:start]] [[fahrwerk]]",
+        "kit14/motor.txt": "[[fahrwerk]] [[:kit15:start]]",
+        "kit15/start.txt": "",
+    })
+    G = build_page_graph(build_namespace_tree(str(pagesdir)), str(pagesdir))
+    workdir = str(tmp_path / "graph")
+    # a tiny budget makes a run per page
+    forward, reverse = build_external(str(pagesdir), workdir, budget=1)
+    assert set(forward.nodes) == set(G.nodes)
+    assert set(forward.edges()) == set(G.edges())
+    assert set(reverse.edges()) == {(t, s) for s, t in G.edges()}
+    assert set(iter_edges(workdir)) == {
+        (s, t, d["rule"]) for s, t, d in G.edges(data=True)}
+    assert [p for p in os.listdir(workdir) if p.startswith("run-")] == []
+
+
+def test_export(tmp_path):
+    pagesdir = tmp_path / "pages"
+    write_pages(pagesdir, {
+        "start.txt": "====== Start ======\n[[kit14:]] [[https://a.de]]",
+        "kit14/start.txt": "{{:infovault:Bild.JPG?100}} [[motor|Motor]]",
+    })
+    rootns = build_namespace_tree(str(pagesdir))
+    pages_file = str(tmp_path / "pages.jsonl.gz")
+    with export.open_output(pages_file) as pf, \
+            export.open_output(str(tmp_path / "edges.txt")) as ef:
+        assert export.export(rootns, pf, ef, str(pagesdir)) == 2
+    with gzip.open(pages_file, "rt", encoding="UTF-8") as f:
+        records = [json.loads(line) for line in f]
+    assert records[0] == {
+        "path": ":start", "namespace": ":", "title": "Start",
+        "links": [":kit14:start"], "external": ["https://a.de"],
+        "media": [], "skipped": False}
+    assert records[1]["media"] == ["infovault:bild.jpg"]
+    G = nx.read_edgelist(str(tmp_path / "edges.txt"),
+                         create_using=nx.DiGraph)
+    assert set(G.edges()) == {(":start", ":kit14:start"),
+                              (":kit14:start", ":kit14:motor")}
+
+
+def test_media_index(tmp_path):
+    write_pages(tmp_path, {
+        "start.txt": "{{:infovault:Bilder:Team.jpg?200}} {{gallery>:a}}",
+        "kit14/start.txt": "{{infovault:bilder:team.jpg|Team}}",
+        "kit14/motor.txt": "{{https://wiki.ka-raceing.de/_media/b.png?50}}",
+    })
+    rootns = build_namespace_tree(str(tmp_path))
+    index = MediaIndex()
+    build_page_graph(rootns, str(tmp_path), media_index=index)
+    assert index.references == MediaIndex.from_tree(
+        rootns, str(tmp_path)).references
+    assert index.pages_containing(":infovault:bilder:team.jpg") == {
+        ":start", ":kit14:start"}
+    assert index.pages_containing("b.png") == {":kit14:motor"}
+    assert medialink_cleanup("https://wiki.ka-raceing.de/_media/a:B.jpg") \
+        == medialink_cleanup("https://wiki.ka-raceing.de/_media/a/b.jpg?w=5") \
+        == "a:b.jpg"
+    # the plain form, which RE_EMBEDDEDMEDIA and find_media miss
+    assert dict(index.galleries) == {"a": {":start"}}
+    assert find_galleries("{{gallery>:A}} {{gallery>b?crop}}\n"
+                          "{{gallery>c|T}} {{gallery>d?3&lightbox|T}} "
+                          "{{gallery>e") == [":A", "b", "c", "d"]
+    assert "infovault:bilder:other.jpg" not in index
+
+
+def test_reconcile_media(tmp_path):
+    write_pages(tmp_path / "pages", {
+        "start.txt": "{{:bilder:Team.jpg?200}} {{bilder:fehlt.png|x}}",
+        "kit14/start.txt": "{{https://wiki.ka-raceing.de/_media/bilder/"
+                           "2016/T%C3%BCr.jpg?w=50&tok=1|Tür}}",
+    })
+    write_pages(tmp_path / "media", {
+        "bilder/team.jpg": "x" * 10,
+        "bilder/2016/tuer.jpg": "t",
+        "bilder/2016/alt/unused.jpg": "y" * 100,
+        "logo.png": "z",
+    })
+    index = MediaIndex.from_tree(
+        build_namespace_tree(str(tmp_path / "pages")), str(tmp_path / "pages"))
+    mediafiles = list(scan_media(str(tmp_path / "media"), workers=2))
+    assert sorted(m.path for m in mediafiles) == [
+        "bilder:2016:alt:unused.jpg", "bilder:2016:tuer.jpg",
+        "bilder:team.jpg", "logo.png"]
+    present, missing, unreferenced = reconcile(mediafiles, index)
+    assert sorted(present) == ["bilder:2016:tuer.jpg", "bilder:team.jpg"]
+    assert present["bilder:team.jpg"].size == 10
+    assert missing == ["bilder:fehlt.png"]
+    assert sorted(unreferenced) == ["bilder:2016:alt:unused.jpg", "logo.png"]
+
+
+def test_media_tree():
+    tree = MediaTree(["a:b:1.jpg", "a:b:c:2.jpg", "a:bc:3.jpg", "a:b.jpg",
+                      "a:b:1.jpg", "b:4.jpg"])
+    assert tree.under("a:b") == ["a:b:1.jpg", "a:b:c:2.jpg"]
+    assert tree.under(":a:b:") == ["a:b:1.jpg", "a:b:c:2.jpg"]
+    assert tree.under("x") == []
+    assert len(tree.under("")) == 5
+    assert tree.covered(["a:b:c", "b:4.jpg"]) == {
+        "a:b:c:2.jpg": "a:b:c", "b:4.jpg": "b:4.jpg"}
+
+    page = Wikipage("start", "start.txt")
+    page.media = {"gallery>:A:B", "a:b.jpg"}
+    index = MediaIndex.from_pages([page])
+    assert dict(index.galleries) == {"a:b": {":start"}}
+    assert set(index) == {"a:b.jpg"}
+
+
+def test_deletion(tmp_path):
+    media = tmp_path / "media"
+    write_pages(media, {"keep.jpg": "", "a/1.jpg": "", "a/2.jpg": "",
+                        "b/3.jpg": "", "q/old.jpg": ""})
+    journal = str(tmp_path / "journal")
+    quarantine = str(media / "q")
+    plan = deletion.make_plan(str(media), ["./keep.jpg"], [quarantine])
+    assert plan == ["a/1.jpg", "a/2.jpg", "b/3.jpg"]
+
+    assert deletion.execute(plan, str(media), journal, dry_run=True) == plan
+    assert not os.path.exists(journal)
+
+    # interrupt a run after the first batch, before b/3.jpg is moved
+    deletion.execute(plan, str(media), journal, quarantine, batch_size=2)
+    with open(journal) as f:
+        lines = f.read().splitlines()
+    with open(journal, "w") as f:
+        f.write("\n".join(lines[:2]) + "\n")
+    os.rename(str(media / "q/b/3.jpg"), str(media / "b/3.jpg"))
+    assert deletion.remaining(journal) == {"b/3.jpg"}
+    # resuming needs the same quarantine, and a plan of the same files
+    for args in [(["b/3.jpg"], None), (["b/3.jpg"], str(tmp_path / "q2")),
+                 (["b/3.jpg", "keep.jpg"], quarantine), ([], quarantine)]:
+        with pytest.raises(ValueError):
+            deletion.execute(args[0], str(media), journal, args[1])
+    assert (media / "b/3.jpg").exists()
+    # the plan made for the resumed run lacks the files already moved
+    resumed_plan = deletion.make_plan(str(media), ["keep.jpg"], [quarantine])
+    assert deletion.execute(resumed_plan, str(media), journal,
+                            quarantine) == ["b/3.jpg"]
+    assert not (media / "a/1.jpg").exists()
+    assert (media / "q/a/1.jpg").exists() and (media / "q/b/3.jpg").exists()
+    assert deletion.read_journal(journal)['complete']
+
+    assert sorted(deletion.restore(journal)) == plan
+    assert (media / "a/1.jpg").exists() and (media / "b/3.jpg").exists()
+    assert (media / "keep.jpg").exists()
+
+    # a run after a complete one starts fresh, and archives the journal
+    assert deletion.execute(["a/1.jpg"], str(media), journal,
+                            dry_run=True) == ["a/1.jpg"]
+    assert deletion.execute(["a/1.jpg"], str(media), journal) == ["a/1.jpg"]
+    assert not (media / "a/1.jpg").exists()
+    assert deletion.read_journal(journal)['plan'] == ["a/1.jpg"]
+    archived = [name for name in os.listdir(str(tmp_path))
+                if name.startswith("journal.")]
+    assert len(archived) == 1
+    assert deletion.read_journal(str(tmp_path / archived[0]))[
+        'quarantine'] == quarantine
+
+
+def test_find_duplicates(tmp_path, monkeypatch):
+    media = tmp_path / "media"
+    write_pages(media, {"2015/team.jpg": "team", "2016/Team.jpg": "team",
+                        "2016/other.jpg": "tame", "big.png": "x" * 5})
+    write_pages(tmp_path / "pages", {"start.txt": "{{2016:team.jpg?1}}"})
+    index = MediaIndex.from_tree(
+        build_namespace_tree(str(tmp_path / "pages")), str(tmp_path / "pages"))
+    cache = DigestCache(str(tmp_path / "digests.json"))
+    groups = find_duplicates(scan_media(str(media)), str(media), cache)
+    assert [[m.path for m in g] for g in groups] == [
+        ["2015:team.jpg", "2016:team.jpg"]]
+    assert canonical_copy(groups[0], index).file_path == "2016/Team.jpg"
+    cache.save()
+
+    # unchanged files are not hashed again
+    monkeypatch.setattr("mediafiles.file_digest", None)
+    cache = DigestCache(str(tmp_path / "digests.json"))
+    assert find_duplicates(scan_media(str(media)), str(media), cache) == groups
+
+
+def test_disk_usage(tmp_path):
+    media = tmp_path / "media"
+    write_pages(media, {"bilder/2016/a.jpg": "a" * 10,
+                        "bilder/2016/b.jpg": "b" * 20,
+                        "bilder/2015/c.jpg": "c" * 40,
+                        "logo.png": "l"})
+    write_pages(tmp_path / "pages", {
+        "start.txt": "{{bilder:2016:a.jpg?1}} {{gallery>bilder:2015}}"})
+    index = MediaIndex.from_tree(
+        build_namespace_tree(str(tmp_path / "pages")), str(tmp_path / "pages"))
+    mediafiles = list(scan_media(str(media)))
+    usage = DiskUsage.from_files(mediafiles,
+                                 referenced_media(mediafiles, index))
+    usage.save(str(tmp_path / "usage.json"))
+    usage = DiskUsage.load(str(tmp_path / "usage.json"))
+    assert usage[""] == [50, 21, 2, 2]
+    assert usage[":bilder:2016"] == [10, 20, 1, 1]
+    assert usage["bilder:2017"] == [0, 0, 0, 0]
+    assert [ns for ns, _ in usage.children("bilder")] == [
+        "bilder:2016", "bilder:2015"]
+    assert [ns for ns, _ in usage.children("")] == ["bilder"]
+
+    # the cache is used until a media directory changes
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return DiskUsage.from_files(scan_media(str(media)), [])
+
+    filename = str(tmp_path / "cached.json")
+    for _ in range(2):
+        cached = cached_usage(filename, media_dirs(str(media)), compute)
+        assert cached[""] == [0, 71, 0, 4] and len(computed) == 1
+    write_pages(media, {"bilder/2015/d.jpg": "d"})
+    assert cached_usage(filename, media_dirs(str(media)), compute)[""] == \
+        [0, 72, 0, 5]
+    assert len(computed) == 2
+
+
+def php_serialize(value):
+    """ Minimal PHP serialize() for test data """
+    if isinstance(value, bool):
+        return "b:{};".format(int(value))
+    if isinstance(value, int):
+        return "i:{};".format(value)
+    if isinstance(value, str):
+        return 's:{}:"{}";'.format(len(value.encode("UTF-8")), value)
+    return "a:{}:{{{}}}".format(len(value), "".join(
+        php_serialize(k) + php_serialize(v) for k, v in value.items()))
+
+
+def test_php_unserialize():
+    assert dokuwiki_meta.php_unserialize(b'd:0.5;') == 0.5
+    assert dokuwiki_meta.php_unserialize(
+        php_serialize({"title": "Über", 1: True}).encode("UTF-8")) == {
+            "title": "Über", 1: True}
+    assert dokuwiki_meta.php_unserialize(
+        b'O:8:"stdClass":1:{s:1:"a";N;}') == {"a": None}
+
+
+def test_dokuwiki_meta(tmp_path):
+    pagesdir, metadir = tmp_path / "pages", tmp_path / "meta"
+    write_pages(pagesdir, {
+        "start.txt": "[[kit14:]] {{bilder:a.jpg?1}}",
+        "kit14/start.txt": "[[motor]] [[getriebe]]",
+        "kit14/motor.txt": "[[..:start]]",
+    })
+    def relation(references, media):
+        return php_serialize({"current": {"relation": {
+            "references": {r: True for r in references},
+            "media": {m: True for m in media}}}})
+    write_pages(metadir, {
+        "start.meta": relation(["kit14:start"], ["bilder:a.jpg"]),
+        # dokuwiki saw a link our regex misses
+        "kit14/start.meta": relation(["kit14:motor", "kit14:getriebe",
+                                      "kit15:start"], []),
+    })
+    rootns = build_namespace_tree(str(pagesdir))
+    disagreements = dokuwiki_meta.cross_check(rootns, str(pagesdir),
+                                              str(metadir))
+    assert disagreements == [(":kit14:start", set(), {":kit15:start"},
+                              set(), set())]
+
+    index = MediaIndex()
+    G, parsed = dokuwiki_meta.build_page_graph_meta(
+        rootns, str(pagesdir), str(metadir), index)
+    assert parsed == 1
+    assert set(G.successors(":kit14:start")) == {
+        ":kit14:motor", ":kit14:getriebe", ":kit15:start"}
+    assert set(G.successors(":kit14:motor")) == {":start"}
+    assert index.pages_containing("bilder:a.jpg") == {":start"}
+    # pages taken from metadata still carry their links and media
+    resolver = LinkResolver.from_tree(rootns)
+    for path, page in G.nodes(data="object"):
+        assert page is None or {link for link, _ in page.resolved_links(
+            resolver)} == set(G.successors(path))
+    assert G.nodes[":start"]["object"].media == {"bilder:a.jpg"}
+    assert G.nodes[":start"].get("meta") and \
+        not G.nodes[":kit14:motor"].get("meta")
+
+    indexdir = tmp_path / "index"
+    write_pages(indexdir, {
+        "page.idx": "start\nkit14:start\nkit14:motor\n",
+        "relation_references_w.idx": "kit14:start\nstart\n",
+        "relation_references_i.idx": "0\n2*1\n",
+    })
+    assert dokuwiki_meta.read_relation_index(
+        "relation_references", str(indexdir)) == {
+            "kit14:start": {":start"}, "start": {":kit14:motor"}}
+
+
+@contextlib.contextmanager
+def serve(respond):
+    """
+    Run a local stand-in HTTP server in a thread. respond(method, path,
+    headers, body) returns (status, headers, body). Yields the base url.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def handle_request(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            status, headers, body = respond(
+                self.command, self.path, self.headers, self.rfile.read(length))
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        do_GET = do_POST = do_HEAD = handle_request
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:{}".format(server.server_port)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_http_client():
+    def slow(method, path, headers, body):
+        time.sleep(0.5)
+        return (200, {"Set-Cookie": "session=slow"}, b"slow")
+
+    def fast(method, path, headers, body):
+        return (200, {}, headers.get("Cookie", "").encode())
+
+    async def run(slow_base, fast_base):
+        async with AsyncHTTPClient(max_connections=2, per_host=1,
+                                   retries=0) as client:
+            async def timed(url):
+                response = await client.get(url)
+                return (response.body, time.monotonic() - start)
+
+            start = time.monotonic()
+            results = await asyncio.gather(*[
+                timed(slow_base + "/{}".format(i)) for i in range(4)],
+                timed(fast_base))
+            # the slow host set a cookie, the fast one never gets it
+            assert client.cookies[slow_base.split("//")[1]] == \
+                {"session": "slow"}
+            assert (await client.get(fast_base)).body == b""
+            return results
+
+    with serve(slow) as slow_base, serve(fast) as fast_base:
+        results = asyncio.run(run(slow_base, fast_base))
+    # requests waiting for the slow host do not hold the global slots
+    assert results[-1][0] == b"" and results[-1][1] < 0.4
+    assert results[-2][1] > 1.5
+
+
+def test_verify_orphans(tmp_path):
+    requests = []
+    backlinks = {"/a": b"Nichts gefunden", "/kit14:b": b"<a>:start</a>"}
+
+    def respond(method, path, headers, body):
+        requests.append(path)
+        if path == "/start?do=login":
+            return (200, {"Set-Cookie": "DW=session; path=/"}, b"ok")
+        if headers.get("Cookie") != "DW=session":
+            return (200, {}, b"Zugang verweigert")
+        page = path.split("?")[0]
+        if page == "/kit14:b" and requests.count(path) == 1:
+            return (429, {}, b"slow down")
+        # errors are not backlink pages, whatever their text
+        if page == "/busy":
+            return (503, {}, b"busy")
+        if page == "/gone":
+            return (404, {}, b"not found")
+        if page == "/login":
+            return (302, {"Location": "/start?do=login"}, b"")
+        return (200, {}, backlinks.get(page, b"Zugang verweigert"))
+
+    G = nx.DiGraph([(":start", ":c")])
+    for node in [":a", ":kit14:b", ":c", ":start", ":busy", ":gone",
+                 ":login"]:
+        G.add_node(node, object=None)
+    G.add_edge(":a", ":a")
+    candidates = orphans.orphan_candidates(G)
+    assert candidates == [":a", ":busy", ":gone", ":kit14:b", ":login",
+                          ":start"]
+
+    async def run(base, cache):
+        async with AsyncHTTPClient(max_connections=2, backoff=0.01,
+                                   rate_limiter=RateLimiter()) as client:
+            assert await orphans.login(client, "u", "p", base)
+            return await orphans.verify_orphans(candidates, client, cache,
+                                                base)
+
+    with serve(respond) as base:
+        cache = ResultCache(str(tmp_path / "orphans.json"))
+        results = asyncio.run(run(base, cache))
+        assert results == {":a": "orphan", ":kit14:b": "linked",
+                           ":start": "denied", ":busy": "failed",
+                           ":gone": "failed", ":login": "failed"}
+        n = len(requests)
+        # resumed from the saved results, only the denied and failed pages
+        # are asked again
+        cache = ResultCache(str(tmp_path / "orphans.json"))
+        assert sorted(cache.entries) == [":a", ":kit14:b"]
+        assert asyncio.run(run(base, cache)) == results
+        assert sorted(set(requests[n:])) == [
+            "/busy?do=backlink", "/gone?do=backlink", "/login?do=backlink",
+            "/start?do=backlink", "/start?do=login"]
+
+        # checkpoints count the results of this run, also when expired
+        # entries are only refreshed and the cache does not grow
+        cache = ResultCache(str(tmp_path / "orphans.json"), ttl=-1)
+        saves = []
+        cache.save = lambda: saves.append(len(cache))
+
+        async def run_checkpointed():
+            async with AsyncHTTPClient(backoff=0.01) as client:
+                await orphans.login(client, "u", "p", base)
+                await orphans.verify_orphans(candidates, client, cache, base,
+                                             checkpoint_every=2)
+
+        asyncio.run(run_checkpointed())
+        assert len(saves) == 2  # one checkpoint, and the final save
+
+
+def test_linkcheck(tmp_path):
+    requests = []
+
+    def respond(method, path, headers, body):
+        requests.append((method, path))
+        if path == "/old":
+            return (301, {"Location": "/ok"}, b"")
+        if path == "/nohead" and method == "HEAD":
+            return (405, {}, b"")
+        if path in ("/ok", "/nohead"):
+            return (200, {}, b"fine")
+        if path == "/busy":
+            return (503, {}, b"")
+        return (404, {}, b"not found")
+
+    with serve(respond) as base:
+        a, b = Wikipage("a", "a.txt"), Wikipage("b", "kit14/b.txt")
+        a.links = {(base + "/ok", ""), (base + "/gone", "x"),
+                   ("mailto:x@y.de", "")}
+        b.links = {(base + "/old", ""), (base + "/nohead", ""),
+                   (base + "/gone", ""), ("http://127.0.0.1:1/", ""),
+                   (base + "/busy", "")}
+        urls = linkcheck.external_links([a, b])
+        assert len(urls) == 6
+
+        async def run(cache):
+            async with AsyncHTTPClient(per_host=2, retries=0) as client:
+                return await linkcheck.check_links(urls, client, cache)
+
+        cache = ResultCache(str(tmp_path / "links.json"))
+        results = asyncio.run(run(cache))
+        assert results[base + "/old"]["final_url"] == base + "/ok"
+        assert results[base + "/old"]["redirects"] == [base + "/old"]
+        assert results[base + "/nohead"]["status"] == 200
+        dead = linkcheck.dead_links(results, urls)
+        assert [(url, pages) for url, _, pages in dead] == [
+            (base + "/gone", [":a", ":kit14:b"]),
+            ("http://127.0.0.1:1/", [":kit14:b"]),
+            (base + "/busy", [":kit14:b"])]
+
+        # unreachable and 5xx urls are not cached, but checked again
+        n = len(requests)
+        cache = ResultCache(str(tmp_path / "links.json"))
+        assert sorted(cache.entries) == sorted(
+            base + path for path in ["/ok", "/gone", "/old", "/nohead"])
+        cache.entries[base + "/ok"][0] -= cache.ttl + 1
+        assert asyncio.run(run(cache)) == results
+        assert sorted(requests[n:]) == [("HEAD", "/busy"), ("HEAD", "/ok")]
+
+
+def test_linkcheck_hosts(tmp_path):
+    # many links to one slow site that sets a session cookie
+    fast_requests = []
+
+    def slow(method, path, headers, body):
+        time.sleep(0.3)
+        return (200, {"Set-Cookie": "session=slow"}, b"")
+
+    def fast(method, path, headers, body):
+        fast_requests.append((time.monotonic(), headers.get("Cookie")))
+        return (200 if path != "/gone" else 404, {}, b"")
+
+    async def run(urls):
+        async with AsyncHTTPClient(max_connections=2, per_host=1,
+                                   retries=0) as client:
+            return await linkcheck.check_links(
+                urls, client, ResultCache(str(tmp_path / "links.json")))
+
+    with serve(slow) as slow_base, serve(fast) as fast_base, \
+            serve(fast) as other_base:
+        urls = ["{}/{}".format(slow_base, i) for i in range(6)] + \
+            [fast_base + "/a", fast_base + "/gone", other_base + "/b"]
+        start = time.monotonic()
+        results = asyncio.run(run(urls))
+    assert [url for url, _, _ in linkcheck.dead_links(
+        results, {url: set() for url in urls})] == [fast_base + "/gone"]
+    # the other sites are checked while the slow one is still busy, and
+    # never get its cookie
+    # /gone is asked with HEAD and GET
+    assert len(fast_requests) == 4
+    assert all(t - start < 0.6 and cookie is None
+               for t, cookie in fast_requests)
+
+
+def test_sync(tmp_path):
+    pagesdir = tmp_path / "pages"
+    write_pages(pagesdir, {"start.txt": "[[old]]", "old.txt": "",
+                           "kit14/motor.txt": "alt"})
+    wiki = {"start": "[[kit14:motor]]", "kit14:motor": "neu",
+            "kit15:start": "[[..:start]]"}
+    changes = [
+        {"id": "kit14:motor", "revision": 100, "type": "E"},
+        {"id": "start", "revision": 110, "type": "E"},
+        {"id": "old", "revision": 120, "type": "D"},
+        {"id": "kit15:start", "revision": 90, "type": "C"},
+        {"id": "start", "revision": 130, "type": "E"},
+    ]
+    calls = []
+
+    def respond(method, path, headers, body):
+        assert path == "/lib/exe/jsonrpc.php"
+        assert headers["Authorization"] == "Bearer secret"
+        request = json.loads(body)
+        params = request["params"]
+        calls.append((request["method"], params))
+        if request["method"] == "core.getRecentPageChanges":
+            result = [c for c in changes if c["revision"] >= params["timestamp"]]
+        elif request["method"] == "core.getRecentMediaChanges":
+            result = [{"id": "bilder:a.jpg", "revision": 95, "type": "C"}]
+        else:
+            result = wiki[params["page"]]
+        return (200, {}, json.dumps({"jsonrpc": "2.0", "id": request["id"],
+                                     "result": result}).encode())
+
+    async def run(base, cache):
+        async with AsyncHTTPClient() as client:
+            rpc = sync.WikiRPC(client, base + "/lib/exe/jsonrpc.php",
+                               token="secret")
+            return await sync.sync(rpc, str(pagesdir),
+                                   str(tmp_path / "sync.json"), cache)
+
+    with serve(respond) as base:
+        cache = ParseCache(str(tmp_path / "cache.json"), str(pagesdir))
+        cache.refresh(build_namespace_tree(str(pagesdir)))
+        updated, deleted = asyncio.run(run(base, cache))
+        assert updated == ["kit14:motor", "kit15:start", "start"]
+        assert deleted == ["old"]
+        assert (pagesdir / "kit15" / "start.txt").read_text() == "[[..:start]]"
+        assert not (pagesdir / "old.txt").exists()
+        assert ":old" not in cache
+        assert cache.page(":start").links == {("kit14:motor", "")}
+        state = sync.read_state(str(tmp_path / "sync.json"))
+        assert state["timestamp"] == 131
+        assert state["media"]["bilder:a.jpg"]["revision"] == 95
+
+        # nothing changed since, nothing is fetched
+        calls.clear()
+        assert asyncio.run(run(base, None)) == ([], [])
+        assert [m for m, _ in calls] == ["core.getRecentPageChanges",
+                                         "core.getRecentMediaChanges"]
+
+
+def test_corpus_and_bench(tmp_path):
+    paths = generate_corpus(str(tmp_path / "a"), pages=60)
+    generate_corpus(str(tmp_path / "b"), pages=60)
+    for path in paths:
+        relpath = os.path.join(*path.split(":")[1:]) + ".txt"
+        assert (tmp_path / "a" / "pages" / relpath).read_bytes() == \
+            (tmp_path / "b" / "pages" / relpath).read_bytes()
+
+    G = build_page_graph(build_namespace_tree(str(tmp_path / "a" / "pages")),
+                         str(tmp_path / "a" / "pages"))
+    assert set(paths) <= set(G.nodes)
+    rules = [rule for _, _, rule in G.edges(data='rule')]
+    assert rules.count('page') > rules.count('wanted') > 0
+
+    results = bench.run_benchmarks([60], str(tmp_path), memory=True)
+    stages = results["60"]
+    assert stages["page_graph"]["seconds"] > 0
+    assert stages["page_graph"]["peak_bytes"] > 0
+    assert stages["populate"]["links_per_s"] > 0
+    slow = {"60": {name: dict(r, seconds=r.get("seconds", 0) + 1)
+                   for name, r in stages.items()}}
+    assert bench.regressions(results, results) == []
+    assert len(bench.regressions(slow, results)) == \
+        sum("seconds" in r for r in stages.values())
+
+
+def test_metrics(tmp_path):
+    pagesdir = tmp_path / "pages"
+    write_pages(pagesdir, {
+        "start.txt": "[[kit14:]] [[a#b#c]] {{gallery>:bilder?crop}}\n",
+        "kit14/start.txt": "[[..:start]] [[neu]]",
+        "kit14/fr_vorlage.txt": "@PAGE@",
+    })
+    (pagesdir / "alt.txt").write_bytes("[[gr\xf6\xdfe]]".encode("latin-1"))
+
+    progress = []
+    m = metrics.Metrics(progress=lambda *args: progress.append(args),
+                        progress_interval=0)
+    tree = build_namespace_tree(str(pagesdir), metrics=m)
+    G = build_page_graph(tree, str(pagesdir), metrics=m)
+    assert G.has_edge(":alt", ":groesse")
+    assert m.counters["files"] == 4
+    assert m.counters["pages"] == 3
+    assert m.counters["links"] == 5
+    assert m.counters["wanted"] == 3
+    assert m.events == {"template": 1, "encoding_fallback": 1,
+                        "multiple_section_link": 1}
+    assert set(m.timers) == {"walk", "read", "extract", "resolve", "insert"}
+    assert progress[-1][:3] == ("pages", 3, 3) and progress[-1][3] == 0
+
+    with m.activate():
+        assert medialink_cleanup("gallery>:bilder") is None
+    assert m.events["gallery"] == 1
+    # outside of activate(), events are dropped
+    medialink_cleanup("gallery>:bilder")
+    assert m.events["gallery"] == 1
+
+    cache = ParseCache(str(tmp_path / "cache.json"), str(pagesdir))
+    cache.refresh(tree, metrics=m)
+    cache.refresh(tree, metrics=m)
+    assert (m.counters["cache_misses"], m.counters["cache_hits"]) == (3, 3)
+
+    m.dump(str(tmp_path / "metrics.json"))
+    dumped = json.loads((tmp_path / "metrics.json").read_text())
+    assert dumped["events"]["template"] == {
+        "count": 1, "samples": ["kit14/fr_vorlage.txt"]}
+
+
+def test_memprofile(tmp_path):
+    assert memprofile.deep_size("abc") == sys.getsizeof("abc")
+    shared = "x" * 1000
+    seen = set()
+    first = memprofile.deep_size([shared], seen)
+    assert first > 1000
+    assert memprofile.deep_size((shared,), seen) < 100
+
+    pagesdir = tmp_path / "pages"
+    write_pages(pagesdir, {
+        "start.txt": "[[kit14:motor]]",
+        "kit14/motor.txt": "".join("[[teil{}]] ".format(i)
+                                   for i in range(200)),
+        "kit15/start.txt": "[[:start]]",
+    })
+    m = memprofile.MemoryMetrics()
+    try:
+        tree = build_namespace_tree(str(pagesdir), metrics=m)
+        G = build_page_graph(tree, str(pagesdir), metrics=m)
+        report = m.as_dict()
+        assert report["memory"]["insert"]["retained_bytes"] > 0
+        assert report["memory"]["extract"]["retained_bytes"] > 0
+        assert m.top_lines(3)
+    finally:
+        m.stop()
+
+    sizes = memprofile.structure_sizes(G, tree)
+    assert sizes["networkx"] > sizes["Wikipage.links"] > 0
+    assert sizes["anytree"] > 0
+    namespaces = memprofile.namespace_sizes(G)
+    assert namespaces[0][0] == ":kit14"
+    assert {ns for ns, _ in namespaces} == {":", ":kit14", ":kit15"}
+
+
+def test_adversarial_extraction(tmp_path):
+    # the scanners give the same results as the regexes ...
+    for case, source in adversarial_pages(200).items():
+        assert find_links(source) == RE_LINK.findall(source), case
+        assert find_media(source) == RE_EMBEDDEDMEDIA.findall(source), case
+        assert find_headings(source) == RE_HEADING.findall(source), case
+    source = "==== A ====\n  == B= ==  \n===x\n=\t==C==="
+    assert find_headings(source) == RE_HEADING.findall(source) == \
+        [("====", " A "), ("==", " B= ")]
+    source = ("[[a]] [[b|B]] {{:x.png?20|X}} {{y.png}} {{gallery>:z?crop}}\n"
+              "[[c]] --- //[[me@ka-raceing.de|Me]]//\n[[d]]]] {{|}}}")
+    assert find_links(source) == RE_LINK.findall(source) == \
+        ["a", "b|B", "d"]
+    assert find_media(source) == RE_EMBEDDEDMEDIA.findall(source) == \
+        [":x.png", "y.png", ""]
+
+    # ... within the time limit on every case, where the regexes are not
+    results = bench.run_adversarial(20000, limit=2.0, extractors=["scanner"])
+    assert all(times["scanner"] is not None for times in results.values())
+    assert bench.time_limited("regex", "{{|" * 3000, 0.2) is None
+
+    # pages over budget are skipped and reported
+    page = Wikipage("start", "start.txt")
+    page.src = "[[a]]"
+    try:
+        page.parse(budget=-1)
+        assert False, "no timeout"
+    except ExtractionTimeout:
+        assert page.links == set()
+    pagesdir = tmp_path / "pages"
+    write_pages(pagesdir, {"start.txt": "[[a]]", "b.txt": "[[start]]"})
+    m = metrics.Metrics()
+    G = build_page_graph(build_namespace_tree(str(pagesdir)), str(pagesdir),
+                         metrics=m, budget=-1)
+    assert G.number_of_edges() == 0
+    assert dict(G.nodes(data="skipped")) == {":start": True, ":b": True}
+    assert m.events["extraction_timeout"] == 2
+    # ... and so on every other path parsing pages
+    cache = ParseCache(str(tmp_path / "cache.json"), str(pagesdir))
+    cache.refresh(build_namespace_tree(str(pagesdir)), metrics=m, budget=-1)
+    assert cache.skipped() == [":b", ":start"]
+    assert cache.page(":start").skipped and cache.page(":start").links == set()
+    assert m.events["extraction_timeout"] == 4
+    # skipped pages are parsed again on the next refresh
+    assert sorted(cache.refresh(build_namespace_tree(str(pagesdir)))[0]) == \
+        [":b", ":start"]
+    assert cache.skipped() == []
+    G, parsed = dokuwiki_meta.build_page_graph_meta(
+        build_namespace_tree(str(pagesdir)), str(pagesdir),
+        str(tmp_path / "meta"), budget=-1)
+    assert dict(G.nodes(data="skipped")) == {":start": True, ":b": True}
+
+
+def test_wikiminer(tmp_path, capsys):
+    write_pages(tmp_path / "pages", {
+        "start.txt": "[[kit14:motor]] [[neu]] {{:bilder:a.jpg?20|A}}",
+        "kit14/motor.txt": "[[:start]] {{gallery>:bilder:2016?crop}}",
+        "kit14/alt.txt": "[[neu]]",
+    })
+    for name in ["a.jpg", "b.jpg", "2016/c.jpg"]:
+        os.makedirs(os.path.dirname(tmp_path / "media" / "bilder" / name),
+                    exist_ok=True)
+        (tmp_path / "media" / "bilder" / name).write_bytes(b"x" * 10)
+
+    def run(*argv):
+        capsys.readouterr()
+        wikiminer.main(["--datadir", str(tmp_path)] + list(argv))
+        return capsys.readouterr().out.splitlines()
+
+    assert run("build") == ["3 pages changed, 0 removed"]
+    assert run("backlinks", "Kit14:Motor") == [":start"]
+    # page ids are cleaned up like the links on the pages
+    for page in ["Kit14:Große Räder", ":kit14 : Motor Tuning", "Start",
+                 "kit14:"]:
+        link, _ = Wikipage.parse_raw_link(page)
+        assert wikiminer.page_path(page) == LinkResolver.absolute(link, "")
+    assert wikiminer.page_path("Kit14:Große Räder") == ":kit14:grosse_raeder"
+    assert run("wanted") == ["    1 :kit14:neu", "    1 :neu"]
+    assert run("orphans") == [":kit14:alt"]
+    assert run("media", ":Bilder:A.jpg") == ["bilder:a.jpg", "    :start"]
+    assert run("media") == ["Referenced but missing ->",
+                            "Present but unreferenced ->",
+                            "          10 bilder:b.jpg"]
+    assert run("media", "--du")[1].split() == ["20", "10", "2", "1", ":"]
+    assert os.path.exists(tmp_path / "media_usage.json")
+    (tmp_path / "media" / "bilder" / "d.jpg").write_bytes(b"x" * 10)
+    assert run("media", "--du")[1].split() == ["20", "20", "2", "2", ":"]
+    assert run("export", str(tmp_path / "pages.jsonl")) == []
+    assert len((tmp_path / "pages.jsonl").read_text().splitlines()) == 3
+
+    # queries do not import the parser or networkx
+    code = ("import sys, wikiminer; wikiminer.main(sys.argv[1:]); "
+            "print(sorted({'networkx', 'anytree', 'classes'} & "
+            "set(sys.modules)))")
+    out = subprocess.run(
+        [sys.executable, "-c", code, "--datadir", str(tmp_path),
+         "backlinks", ":start"], capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(wikiminer.__file__))).stdout
+    assert out.splitlines() == [":kit14:motor", "[]"]
+
+
+def test_search(tmp_path):
+    assert search.tokenize("Größe der [[kit14:Rädern|Räder]]") == \
+        ["groesse", "der", "kit14", "raedern", "raeder"]
+    values = [0, 1, 127, 128, 300, 2**40]
+    assert search.decode(search.encode(values)) == values
+
+    pagesdir = tmp_path / "pages"
+    write_pages(pagesdir, {
+        "start.txt": "Motor und Fahrwerk",
+        "kit14/motor.txt": "Motor Motor Motor, der Motor läuft",
+        "kit14/fahrwerk.txt": "Das Fahrwerk hat Räder",
+        "kit15/start.txt": "nichts",
+    })
+    conn = store.connect(str(tmp_path / "wiki.sqlite"))
+    cache = ParseCache(str(tmp_path / "cache.json"), str(pagesdir))
+    index = search.SearchIndex(conn)
+    store.sync(conn, cache, str(pagesdir), index)
+
+    index = search.SearchIndex(conn)
+    assert len(index) == 4
+    assert [p for p, _ in index.search("motor")] == [":kit14:motor", ":start"]
+    assert [p for p, _ in index.search("räder")] == [":kit14:fahrwerk"]
+    assert [p for p, _ in index.search("RAEDER")] == [":kit14:fahrwerk"]
+    assert index.search("fahrwerk motor")[0][0] == ":start"
+    assert index.search("unbekannt") == []
+    prior = {":kit14:fahrwerk": 0.9, ":start": 0.01}
+    assert index.search("fahrwerk", prior=prior)[0][0] == ":kit14:fahrwerk"
+
+    # changes are picked up incrementally, removed pages disappear
+    (pagesdir / "kit15" / "start.txt").write_text("neuer Motor")
+    os.remove(pagesdir / "start.txt")
+    changed, removed = store.sync(conn, cache, str(pagesdir), index)
+    assert (changed, removed) == ([":kit15:start"], [":start"])
+    index = search.SearchIndex(conn)
+    assert [p for p, _ in index.search("motor")] == [
+        ":kit14:motor", ":kit15:start"]
+    assert index.search("fahrwerk und")[0][0] == ":kit14:fahrwerk"
+    assert list(index.lengths).count(search.DELETED) == 2
+
+    # once more than half the ids are dead, the postings are rewritten
+    for i in range(4):
+        index.add(":kit14:motor", "Motor " * (i + 1))
+    index.save()
+    index = search.SearchIndex(conn)
+    assert search.DELETED not in index.lengths
+    assert len(index.lengths) == 3
+    assert [p for p, _ in index.search("motor")] == [
+        ":kit14:motor", ":kit15:start"]
+
+    # an index added to a warm cache still gets all pages
+    conn2 = store.connect(str(tmp_path / "other.sqlite"))
+    index2 = search.SearchIndex(conn2)
+    cache.refresh(build_namespace_tree(str(pagesdir)), search_index=index2)
+    index2.save()
+    assert len(search.SearchIndex(conn2)) == 3
+
+
+def test_suggest(tmp_path, capsys):
+    assert suggest.normalize("Größe_der Räder") == "groessederraeder"
+    assert suggest.namespaces(":a:b:page") == [":a:", ":a:b:"]
+    assert suggest.common_depth(":a:c:x", [":a:", ":a:b:"]) == 1
+
+    index = suggest.TrigramIndex.from_pages([
+        (":kit14:motor", "Motor"), (":kit15:motor", ""),
+        (":kit14:rad", "Vorderrad"), (":kit14:fahrwerk", "")])
+    assert len(index) == 4  # 'motor' once, 'vorderrad' as title
+    assert index.similar("motr") == {":kit14:motor": 0.375,
+                                     ":kit15:motor": 0.375}
+    assert list(index.similar("vorderad")) == [":kit14:rad"]
+    assert index.similar("motr", min_similarity=0.5) == {}
+    assert index.similar("xyzzy") == {}
+
+    write_pages(tmp_path / "pages", {
+        "kit14/motor.txt": "====== Motor ======",
+        "kit14/fahrwerk.txt": "[[motr]] [[gröse]] [[xyzzy]]",
+        "kit15/motor.txt": "",
+        "kit15/groesse.txt": "[[:kit14:motr]]",
+    })
+    wikiminer.main(["--datadir", str(tmp_path), "build"])
+    conn = store.connect(str(tmp_path / wikiminer.SNAPSHOT))
+    plan = {(source, raw): (suggestion, alternatives) for
+            source, raw, _, suggestion, _, alternatives
+            in suggest.rewrite_plan(conn)}
+    # ties go to the namespace of the linking page
+    assert plan == {
+        (":kit14:fahrwerk", "motr"): (":kit14:motor", [":kit15:motor"]),
+        (":kit15:groesse", ":kit14:motr"): (":kit15:motor",
+                                            [":kit14:motor"]),
+        (":kit14:fahrwerk", "gröse"): (":kit15:groesse", []),
+    }
+
+    capsys.readouterr()
+    wikiminer.main(["--datadir", str(tmp_path), "suggest", "--plan",
+                    str(tmp_path / "plan.tsv")])
+    assert capsys.readouterr().out == "3 links in {}\n".format(
+        tmp_path / "plan.tsv")
+    lines = (tmp_path / "plan.tsv").read_text().splitlines()
+    assert lines[0].split("\t") == ["source", "link", "target", "suggestion",
+                                    "similarity", "alternatives"]
+    assert ":kit14:fahrwerk\t[[motr]]\t:kit14:motr\t:kit14:motor\t0.38\t" \
+        ":kit15:motor" in lines
+
+
+def test_duplicates(tmp_path, capsys):
+    assert duplicates.shingles("Der Motor läuft") == ["der motor laeuft"]
+    assert duplicates.shingles("a b c d b c d") == [
+        "a b c", "b c d", "c d b", "d b c"]
+    assert duplicates.signature("[[ ]]") is None
+    # season copies only differ in numbers
+    assert duplicates.signature("Motor für kit12, 2016") == \
+        duplicates.signature("Motor für kit13, 2017")
+
+    text = " ".join("wort{}".format(chr(97 + i % 26) * (i // 26 + 1))
+                    for i in range(200))
+    a = duplicates.signature(text)
+    b = duplicates.signature(text.replace("wortb ", "anders "))
+    c = duplicates.signature(text[::-1])
+    assert 0.8 <= duplicates.similarity(a, b) < 1
+    assert duplicates.similarity(a, c) < 0.2
+    assert duplicates.clusters({":x": a, ":y": b, ":z": c, ":w": c}) == [
+        [":w", ":z"], [":x", ":y"]]
+    assert duplicates.clusters({":x": a, ":y": b}, threshold=1) == []
+
+    write_pages(tmp_path / "pages", {
+        "kit12/motor.txt": text + " [[kit12:fahrwerk]]",
+        "kit13/motor.txt": text + " [[kit13:fahrwerk]]",
+        "kit12/fahrwerk.txt": "[[motor]]",
+        "kit13/fahrwerk.txt": "[[:kit12:motor]] [[:kit13:motor]]",
+        "start.txt": "",
+    })
+    wikiminer.main(["--datadir", str(tmp_path), "build"])
+    cache = ParseCache(str(tmp_path / "wikiminer.cache.json"),
+                       str(tmp_path / "pages"))
+    assert sorted(cache.signatures()) == [
+        ":kit12:fahrwerk", ":kit12:motor", ":kit13:fahrwerk", ":kit13:motor"]
+    assert cache.entries[":start"]["minhash"] is None
+    # unchanged pages keep their signature
+    m = metrics.Metrics()
+    assert cache.refresh(build_namespace_tree(str(tmp_path / "pages")),
+                         m) == ([], [])
+    assert m.counters["cache_hits"] == 5
+
+    capsys.readouterr()
+    wikiminer.main(["--datadir", str(tmp_path), "duplicates"])
+    assert capsys.readouterr().out.splitlines() == [
+        "2 pages ->",
+        "  100% :kit12:motor  2 backlinks",
+        "  100% :kit13:motor  1 backlinks",
+    ]
+
+
+def test_history(tmp_path, capsys):
+    y2015, y2016, y2017 = 1420070400, 1451606400, 1483228800
+
+    def revisions(path, *changes):
+        file_path = path.lstrip(":").replace(":", "/")
+        lines = []
+        for date, typ, source in changes:
+            lines.append("\t".join([str(date), "127.0.0.1", typ,
+                                    path.lstrip(":"), "anna", "", "", "5"]))
+            if source is not None:
+                filename = history.revision_file(
+                    path, date, str(tmp_path / "attic"))
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                with gzip.open(filename, 'wt', encoding='UTF-8') as f:
+                    f.write(source)
+        filename = tmp_path / "meta" / (file_path + ".changes")
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        filename.write_text("\n".join(lines) + "\nbroken line\n")
+
+    revisions(":kit14:motor", (y2015, "C", "[[fahrwerk]] [[:start]]"),
+              (y2016, "E", "[[:start]] [[wiki]]"),
+              (y2016 + 1, "E", None),  # missing from the attic
+              (y2017, "e", None))  # only in pages
+    revisions(":kit14:fahrwerk", (y2015, "C", "ohne Links"))
+    revisions(":kit14:alt", (y2015, "C", "[[fahrwerk]]"),
+              (y2016, "D", None))
+    revisions(":start", (y2015, "C", "[[kit14:motor]] [[start]]"))
+    write_pages(tmp_path / "pages", {
+        "kit14/motor.txt": "[[:start]] [[bremse]]",
+        "kit14/fahrwerk.txt": "ohne Links",
+        "start.txt": "[[kit14:motor]] [[start]]",
+    })
+    (tmp_path / "meta" / "_dokuwiki.changes").write_text("")
+
+    assert [p for p, _ in history.changelogs(str(tmp_path / "meta"))] == [
+        ":start", ":kit14:alt", ":kit14:fahrwerk", ":kit14:motor"]
+    changes = list(history.read_changes(
+        str(tmp_path / "meta" / "kit14" / "motor.changes")))
+    assert [(c.date, c.type, c.user) for c in changes] == [
+        (y2015, "C", "anna"), (y2016, "E", "anna"), (y2016 + 1, "E", "anna"),
+        (y2017, "e", "anna")]
+
+    activities, deltas, skipped = history.analyze(str(tmp_path), 1)
+    assert skipped == 1
+    assert activities[":kit14:motor"] == history.Activity(
+        created=y2015, last_edit=y2017, edits=4, minor_edits=1, editors=1,
+        deleted=False)
+    assert activities[":kit14:alt"].deleted
+    assert [tuple(d) for d in deltas if d.source == ":kit14:motor"] == [
+        (y2015, ":kit14:motor", ":kit14:fahrwerk", 1),
+        (y2015, ":kit14:motor", ":start", 1),
+        (y2016, ":kit14:motor", ":kit14:fahrwerk", -1),
+        (y2016, ":kit14:motor", ":kit14:wiki", 1),
+        (y2017, ":kit14:motor", ":kit14:bremse", 1),
+        (y2017, ":kit14:motor", ":kit14:wiki", -1)]
+    assert history.analyze(str(tmp_path), 2) == (activities, deltas, skipped)
+
+    assert history.links_at(deltas, y2015) == {
+        (":kit14:motor", ":kit14:fahrwerk"), (":kit14:motor", ":start"),
+        (":kit14:alt", ":kit14:fahrwerk"), (":start", ":kit14:motor"),
+        (":start", ":start")}
+    assert history.link_counts(deltas) == [(2015, 5), (2016, 4), (2017, 4)]
+    # self links do not count, pages that were never linked neither
+    assert history.unlinked_since(deltas) == {":kit14:fahrwerk": y2016,
+                                              ":kit14:wiki": y2017}
+    assert [p for p, _ in history.unedited_since(activities, y2017)] == [
+        ":kit14:fahrwerk", ":start"]
+
+    capsys.readouterr()
+    history.print_report(activities, deltas, years=1, now=y2017 + 3600)
+    assert capsys.readouterr().out.splitlines() == [
+        "Links per year ->",
+        "2015        5",
+        "2016        4",
+        "2017        4",
+        "Not linked since 1 years ->",
+        "2016-01-01 :kit14:fahrwerk",
+        "Not edited since 1 years ->",
+        "2015-01-01 :kit14:fahrwerk (1 edits, 1 editors)",
+        "2015-01-01 :start (1 edits, 1 editors)",
+    ]
+
+
 if __name__ == "__main__":
-    test_parse_raw_link()
-    print("tests passed.")
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,327 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+"""
+One command for the wiki tools.
+
+`build` parses the pages changed since the last run and updates a
+snapshot of the wiki (a SQLite database, see store.py). The other
+commands answer from the snapshot. Every command imports only what it
+needs, so queries like backlinks start quickly.
+
+    python wikiminer.py [--datadir DIR] [--snapshot FILE] COMMAND
+
+    build                       update the snapshot from DIR/pages
+    backlinks PAGE              pages linking to PAGE
+    wanted                      links to pages that do not exist
+    suggest [--plan FILE]       existing pages for the wanted links
+    search QUERY [--prior]      full-text search, weighted by pagerank
+    rank [--hits] [-n N]        the most important pages
+    orphans [--verify USER]     pages no other page links to
+    media [ID ...] [--du [NS]]  media references, unused and missing media
+    export PAGES [EDGES]        JSON lines of all pages (and their links)
+    duplicates [--threshold T]  clusters of near-identical pages
+    history [--years N]         pages unlinked or unedited for N years
+
+DIR defaults to $WIKIMINER_DATADIR, or ./data.
+"""
+
+import argparse
+import os
+import sys
+
+SNAPSHOT = "wikiminer.sqlite"
+
+
+def page_path(page: str) -> str:
+    """
+    The wikipath of a page id, cleaned up like the links of the pages,
+    e.g. 'Kit14:Große Räder' -> ':kit14:grosse_raeder', 'kit14:' ->
+    ':kit14:start'
+    """
+    from pageids import clean_page_id
+
+    path = clean_page_id(page).lstrip(":/")
+    if not path or path.endswith(":"):
+        path += "start"
+    return ":" + path
+
+
+def _snapshot_file(args) -> str:
+    return args.snapshot or os.path.join(args.datadir, SNAPSHOT)
+
+
+def _snapshot(args, must_exist: bool = True):
+    import store
+
+    filename = _snapshot_file(args)
+    if must_exist and not os.path.exists(filename):
+        sys.exit("{} does not exist, run `wikiminer.py build` first".format(
+            filename))
+    return store.connect(filename)
+
+
+def _cache(args):
+    from cache import ParseCache
+
+    cachefile = os.path.splitext(_snapshot_file(args))[0] + ".cache.json"
+    return ParseCache(cachefile, args.pagesdir)
+
+
+def cmd_build(args) -> None:
+    import store
+    from search import SearchIndex
+
+    conn = _snapshot(args, must_exist=False)
+    cache = _cache(args)
+    changed, removed = store.sync(conn, cache, args.pagesdir,
+                                  SearchIndex(conn))
+    print("{} pages changed, {} removed".format(len(changed), len(removed)))
+    skipped = cache.skipped()
+    if skipped:
+        print("Skipped (took too long to parse, retried next build) ->",
+              file=sys.stderr)
+        print("\n".join(skipped), file=sys.stderr)
+
+
+def cmd_backlinks(args) -> None:
+    import store
+
+    conn = _snapshot(args)
+    path = page_path(args.page)
+    if not store.page_exists(conn, path):
+        print("{} does not exist".format(path), file=sys.stderr)
+    for source in store.backlinks(conn, path):
+        print(source)
+
+
+def cmd_wanted(args) -> None:
+    import store
+
+    for target, n in store.wanted_pages(_snapshot(args)):
+        print("{:5d} {}".format(n, target))
+
+
+def cmd_suggest(args) -> None:
+    import suggest
+
+    plan = suggest.rewrite_plan(_snapshot(args), args.n, args.min)
+    if args.plan:
+        with open(args.plan, 'w', encoding='UTF-8') as f:
+            suggest.write_plan(plan, f)
+        print("{} links in {}".format(len(plan), args.plan))
+    else:
+        suggest.write_plan(plan, sys.stdout)
+
+
+def cmd_search(args) -> None:
+    from search import SearchIndex
+
+    conn = _snapshot(args)
+    prior = None
+    if args.prior:
+        import networkx as nx
+        import store
+
+        try:
+            prior = nx.pagerank(store.page_graph(conn))
+        except ImportError as e:
+            sys.exit("networkx needs numpy and scipy for --prior: {}".format(
+                e))
+    for path, score in SearchIndex(conn).search(" ".join(args.query),
+                                                args.n, prior):
+        print("{:7.2f} {}".format(score, path))
+
+
+def cmd_rank(args) -> None:
+    import store
+    from build_graph import rank_hits, rank_pagerank
+
+    G = store.page_graph(_snapshot(args))
+    try:
+        if args.hits:
+            hubs, authorities = rank_hits(G)
+        else:
+            ranked = rank_pagerank(G)
+    except ImportError as e:
+        sys.exit("networkx needs numpy and scipy to rank pages: {}".format(e))
+    if args.hits:
+        print("Hubs ->")
+        print("\n".join(hubs[:args.n]))
+        print("Authorities ->")
+        print("\n".join(authorities[:args.n]))
+    else:
+        print("\n".join(ranked[:args.n]))
+
+
+def cmd_orphans(args) -> None:
+    import store
+
+    candidates = store.orphans(_snapshot(args))
+    if not args.verify:
+        print("\n".join(candidates))
+        return
+
+    import asyncio
+    import orphans
+
+    print("{} pages have no local backlinks".format(len(candidates)))
+    asyncio.run(orphans.verify(candidates, args.verify, os.path.join(
+        args.datadir, "orphans.json")))
+
+
+def cmd_media(args) -> None:
+    import store
+
+    from pageids import clean_media_id
+
+    conn = _snapshot(args)
+    for media in map(clean_media_id, args.ids):
+        print(media)
+        for page in store.pages_using_media(conn, media):
+            print("    " + page)
+    if args.ids:
+        return
+
+    from media import MediaTree
+    from mediafiles import USAGE, DiskUsage, by_size, cached_usage, \
+        media_dirs, print_usage, reconcile, referenced_media, scan_media
+
+    mediadir = os.path.join(args.datadir, "media")
+    if args.du is not None:
+        # computed again once media files or the snapshot changed
+        def compute():
+            mediafiles = list(scan_media(mediadir))
+            return DiskUsage.from_files(mediafiles, referenced_media(
+                mediafiles, store.media_index(conn)))
+
+        print_usage(cached_usage(os.path.join(args.datadir, USAGE), {
+            'media': media_dirs(mediadir),
+            'snapshot': os.stat(_snapshot_file(args)).st_mtime_ns,
+        }, compute), args.du)
+        return
+
+    index = store.media_index(conn)
+    mediafiles = list(scan_media(mediadir))
+    present, missing, unreferenced = reconcile(mediafiles, index)
+    for media in MediaTree(unreferenced).covered(index.galleries):
+        present[media] = unreferenced.pop(media)
+    print("Referenced but missing ->")
+    for media in missing:
+        print("{} (on {})".format(media, ", ".join(
+            sorted(index.pages_containing(media)))))
+    print("Present but unreferenced ->")
+    for mediafile in by_size(unreferenced.values()):
+        print("{:12d} {}".format(mediafile.size, mediafile.path))
+
+
+def cmd_export(args) -> None:
+    from build_graph import build_namespace_tree
+    from export import export, open_output
+
+    rootns = build_namespace_tree(args.pagesdir)
+    with open_output(args.pages) as pages_file:
+        if args.edges:
+            with open_output(args.edges) as edges_file:
+                n = export(rootns, pages_file, edges_file, args.pagesdir)
+        else:
+            n = export(rootns, pages_file, pagesdir=args.pagesdir)
+    print("exported {} pages".format(n), file=sys.stderr)
+
+
+def cmd_duplicates(args) -> None:
+    import duplicates
+
+    conn = _snapshot(args)
+    signatures = _cache(args).signatures()
+    rank = None
+    try:
+        import networkx as nx
+        import store
+
+        rank = nx.pagerank(store.page_graph(conn))
+    except ImportError:
+        pass  # without numpy and scipy, only the backlinks are shown
+    duplicates.print_clusters(
+        duplicates.clusters(signatures, args.threshold), signatures, conn,
+        rank)
+
+
+def cmd_history(args) -> None:
+    import history
+
+    activities, deltas, skipped = history.analyze(args.datadir, args.j)
+    print("{} pages, {} link changes, {} revisions missing".format(
+        len(activities), len(deltas), skipped), file=sys.stderr)
+    history.print_report(activities, deltas, args.years)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="wikiminer", description=__doc__.split("\n\n")[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datadir", default=os.environ.get(
+        "WIKIMINER_DATADIR", os.path.join(os.getcwd(), "data")))
+    parser.add_argument("--snapshot",
+                        help="default: DATADIR/" + SNAPSHOT)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("build").set_defaults(run=cmd_build)
+    backlinks = commands.add_parser("backlinks")
+    backlinks.add_argument("page")
+    backlinks.set_defaults(run=cmd_backlinks)
+    commands.add_parser("wanted").set_defaults(run=cmd_wanted)
+    suggest = commands.add_parser("suggest")
+    suggest.add_argument("--plan", metavar="FILE",
+                         help="write the rewrite plan to FILE")
+    suggest.add_argument("--min", type=float, default=0.3,
+                         help="lowest similarity (default: %(default)s)")
+    suggest.add_argument("-n", type=int, default=3,
+                         help="suggestions per link")
+    suggest.set_defaults(run=cmd_suggest)
+    search = commands.add_parser("search")
+    search.add_argument("query", nargs="+")
+    search.add_argument("--prior", action="store_true",
+                        help="prefer pages with a high pagerank")
+    search.add_argument("-n", type=int, default=10)
+    search.set_defaults(run=cmd_search)
+    rank = commands.add_parser("rank")
+    rank.add_argument("--hits", action="store_true")
+    rank.add_argument("-n", type=int, default=20)
+    rank.set_defaults(run=cmd_rank)
+    orphans = commands.add_parser("orphans")
+    orphans.add_argument("--verify", metavar="USER",
+                         help="check the candidates against the wiki")
+    orphans.set_defaults(run=cmd_orphans)
+    media = commands.add_parser("media")
+    media.add_argument("ids", nargs="*", metavar="ID")
+    media.add_argument("--du", nargs="?", const="", metavar="NS",
+                       help="disk usage of the media namespace")
+    media.set_defaults(run=cmd_media)
+    export = commands.add_parser("export")
+    export.add_argument("pages")
+    export.add_argument("edges", nargs="?")
+    export.set_defaults(run=cmd_export)
+    duplicates = commands.add_parser("duplicates")
+    duplicates.add_argument("--threshold", type=float, default=0.8,
+                            help="lowest similarity (default: %(default)s)")
+    duplicates.set_defaults(run=cmd_duplicates)
+    history = commands.add_parser("history")
+    history.add_argument("--years", type=float, default=2)
+    history.add_argument("-j", type=int, metavar="N",
+                         help="processes reading revisions (default: all "
+                         "cores)")
+    history.set_defaults(run=cmd_history)
+
+    args = parser.parse_args(argv)
+    args.pagesdir = os.path.join(args.datadir, "pages")
+    return args
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()